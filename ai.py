@@ -1,22 +1,82 @@
-from google import genai
 from google.genai import types
-from streamlit_geolocation import streamlit_geolocation
-from tavily import TavilyClient
-from typing import List, Dict, Union, Any
+from typing import List, Dict, Union, Any, Optional
 import re
-from youtube_transcript_api import YouTubeTranscriptApi
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 #from pytube import YouTube
 import os
+import io
+import json
+import time
+import asyncio
+import hashlib
+import contextvars
 from functools import lru_cache
-import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 
-available_models = ["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.5-flash-lite", "gemini-2.5-flash-preview-09-2025", "gemini-2.5-flash-lite-preview-09-2025",  "gemini-2.0-flash"]
+from cache import TTLCache, SingleFlight, ContentStore, CACHE_DIR
+from tracing import span, record_span, observe_rate
+from governor import GOVERNOR
+from ranking import (
+    split_passages,
+    transcript_passages,
+    select_passages,
+    fits_budget,
+    format_timestamp,
+    current_query
+)
+from history import estimate_tokens
+from sources import current_sources, remember_search_results, remember_pages, remember_transcripts
+from clients import (
+    get_genai_client,
+    get_tavily_client,
+    get_async_tavily_client,
+    get_async_http_client,
+    get_transcript_api,
+    youtube_client,
+    YOUTUBE_DATA_API_KEY,
+    YOUTUBE_API_BASE_URL,
+    available_models
+)
 
-YOUTUBE_DATA_API_KEY = os.getenv("YOUTUBE_DATA_API_KEY")
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
-# GEMINI_API_KEY is used internally by genai library so need to set in env variable
+# Tavily 검색 결과 캐시: topic/time_range에 따라 TTL을 다르게 적용 (뉴스는 짧게, 일반 검색은 길게)
+SEARCH_CACHE_MAXSIZE = int(os.getenv("SEARCH_CACHE_MAXSIZE", 2048))
+SEARCH_TTL_BY_TOPIC = {"general": 6 * 3600, "news": 10 * 60, "finance": 10 * 60}
+SEARCH_TTL_BY_TIME_RANGE = {"day": 15 * 60, "week": 60 * 60, "month": 6 * 3600, "year": 24 * 3600}
+_TIME_RANGE_ALIASES = {"d": "day", "w": "week", "m": "month", "y": "year"}
+
+_search_cache = TTLCache(maxsize=SEARCH_CACHE_MAXSIZE, ttl=SEARCH_TTL_BY_TOPIC["general"])
+_search_flight = SingleFlight()
+
+def _search_cache_key(query, topic, time_range, start_date, end_date, max_results, include_answer, include_raw_content, country):
+    """
+    의미상 같은 검색이 같은 key가 되도록 인자를 정규화합니다.
+    """
+    def _flag(value, true_value):
+        if isinstance(value, str):
+            return value.strip().lower() or False
+        return true_value if value else False
+
+    normalized = (
+        " ".join((query or "").lower().split()),
+        (topic or "general").lower(),
+        _TIME_RANGE_ALIASES.get((time_range or "").lower(), (time_range or "").lower()) or None,
+        start_date or None,
+        end_date or None,
+        int(max_results or 5),
+        _flag(include_answer, "basic"),
+        _flag(include_raw_content, "markdown"),
+        (country or "").strip().lower() or None,
+    )
+    return json.dumps(normalized, ensure_ascii=False)
+
+def _search_ttl(topic, time_range):
+    ttl = SEARCH_TTL_BY_TOPIC.get((topic or "general").lower(), SEARCH_TTL_BY_TOPIC["general"])
+    time_range = _TIME_RANGE_ALIASES.get((time_range or "").lower(), (time_range or "").lower())
+    if time_range in SEARCH_TTL_BY_TIME_RANGE:
+        ttl = min(ttl, SEARCH_TTL_BY_TIME_RANGE[time_range])
+    return ttl
+
+def get_search_cache_stats():
+    return {**_search_cache.stats(), "coalesced": _search_flight.coalesced}
 
 def search_web_tavily(query: str, topic: str = "general", time_range: str = None, start_date: str = None, end_date: str = None, max_results: int = 5,
                       include_answer: Union[bool, str] = False, include_raw_content: Union[bool, str] = False, country: str = None) -> Dict[str, Any]:
@@ -37,37 +97,194 @@ def search_web_tavily(query: str, topic: str = "general", time_range: str = None
         Dictionary containing search results.
     """
     #print(f"Searching Tavily for query: {query}")
-    tavily_client = TavilyClient(TAVILY_API_KEY)
-    response = tavily_client.search(
-        query=query,
-        auto_parameters=False,
-        topic=topic,
-        time_range=time_range,
-        start_date=start_date,
-        end_date=end_date,
-        max_results=max_results,
-        include_answer=include_answer,
-        include_raw_content=include_raw_content,
-        country=country
-    )
+    key = _search_cache_key(query, topic, time_range, start_date, end_date, max_results, include_answer, include_raw_content, country)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        remember_search_results(cached)
+        return cached
+
+    def _search():
+        tavily_client = get_tavily_client()
+        response = GOVERNOR.call(
+            "tavily", tavily_client.search,
+            query=query,
+            auto_parameters=False,
+            topic=topic,
+            time_range=time_range,
+            start_date=start_date,
+            end_date=end_date,
+            max_results=max_results,
+            include_answer=include_answer,
+            include_raw_content=include_raw_content,
+            country=country
+        )
+        _search_cache.set(key, response, ttl=_search_ttl(topic, time_range))
+        return response
+
+    # 여러 세션에서 동시에 같은 검색을 요청하면 하나의 요청만 보내고 결과를 공유
+    response = _search_flight.do(key, _search)
     #print(f"Tavily search response: {response}")
-    return response 
+    # 이후 턴에서 search_session_sources로 다시 찾을 수 있도록 세션 소스에 색인
+    remember_search_results(response)
+    return response
+
+async def search_web_tavily_async(query: str, topic: str = "general", time_range: str = None, start_date: str = None, end_date: str = None, max_results: int = 5,
+                                  include_answer: Union[bool, str] = False, include_raw_content: Union[bool, str] = False, country: str = None) -> Dict[str, Any]:
+    """
+    search_web_tavily의 비동기 버전 (공유 이벤트 루프에서 실행). 캐시와 중복 요청 합치기는 동기 버전과 공유합니다.
+    """
+    key = _search_cache_key(query, topic, time_range, start_date, end_date, max_results, include_answer, include_raw_content, country)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        remember_search_results(cached)
+        return cached
+
+    async def _search():
+        response = await GOVERNOR.call_async(
+            "tavily", get_async_tavily_client().search,
+            query=query,
+            auto_parameters=False,
+            topic=topic,
+            time_range=time_range,
+            start_date=start_date,
+            end_date=end_date,
+            max_results=max_results,
+            include_answer=include_answer,
+            include_raw_content=include_raw_content,
+            country=country
+        )
+        _search_cache.set(key, response, ttl=_search_ttl(topic, time_range))
+        return response
+
+    response = await _search_flight.do_async(key, _search)
+    remember_search_results(response)
+    return response
 
-def extract_web_page(urls: List[str]) -> List[Dict[str, str]]:
+# 추출된 페이지 본문 캐시 (URL 단위). 메모리에서 밀려난 항목은 디스크에 spill
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 24 * 3600))
+PAGE_CACHE_SPILL = os.getenv("PAGE_CACHE_SPILL", "1") == "1"
+EXTRACT_BATCH_SIZE = int(os.getenv("EXTRACT_BATCH_SIZE", 5))
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", 4))
+
+_page_store = ContentStore(max_bytes=PAGE_CACHE_MAX_BYTES, ttl=PAGE_CACHE_TTL,
+                           spill_dir=os.path.join(CACHE_DIR, "pages") if PAGE_CACHE_SPILL else None)
+_extract_executor = ThreadPoolExecutor(max_workers=EXTRACT_MAX_WORKERS, thread_name_prefix="extract")
+
+def _extract_batch(urls):
+    tavily_client = get_tavily_client()
+    response = GOVERNOR.call("tavily", tavily_client.extract, urls=urls, extract_depth="advanced")
+    return response["results"]
+
+def get_page_cache_stats():
+    return _page_store.stats()
+
+def _rank_pages(pages, query):
+    """
+    추출한 페이지가 도구 호출당 토큰 예산을 넘으면 질문과 관련 있는 passage만 URL별로 남깁니다.
+    (페이지 캐시에는 전체 본문이 그대로 남아있음)
+    """
+    contents = [page["content"] or "" for page in pages]
+    if fits_budget(contents):
+        return pages
+    with span("rank", documents=len(pages)) as attrs:
+        passages = [split_passages(content) for content in contents]
+        selected = select_passages(passages, query or current_query())
+        ranked = [{'url': page["url"], 'passages': [{'text': texts[i]} for i in indices], 'omitted_passages': len(texts) - len(indices)}
+                  for page, texts, indices in zip(pages, passages, selected)]
+        attrs["tokens_before"] = sum(estimate_tokens(c) for c in contents)
+        attrs["tokens_after"] = sum(estimate_tokens(p["text"]) for page in ranked for p in page["passages"])
+    return ranked
+
+def _pages_result(pages, query):
+    # 세션 소스에는 전체 본문을 색인하고, 모델에는 질문과 관련 있는 passage만 전달
+    remember_pages(pages)
+    return _rank_pages(pages, query)
+
+def extract_web_page(urls: List[str], query: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Extract raw content from a list of web page URLs.
+    When the pages are long, only the passages most relevant to the query are returned, in page order.
 
     Args:
         urls: List of URLs to extract content from.
+        query: What you are looking for in these pages (optional). Defaults to the user's question.
     Returns:
-        List of dictionaries with URL as key and raw content as value.
+        List of dictionaries with the URL and either its full content, or its most relevant passages
+        and the number of omitted passages when the pages are too long.
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    contents = {}
+    misses = []
+    for url in unique_urls:
+        content = _page_store.get(url)
+        if content is None:
+            misses.append(url)
+        else:
+            contents[url] = content
+
+    # 캐시에 없는 URL만 작은 배치로 나눠 병렬로 추출
+    extra = []
+    if misses:
+        requested = set(misses)
+        batches = [misses[i:i + EXTRACT_BATCH_SIZE] for i in range(0, len(misses), EXTRACT_BATCH_SIZE)]
+        with span("extract", urls=len(unique_urls), cached=len(unique_urls) - len(misses)):
+            # 배치마다 호출한 쪽의 contextvars(세션별 요청 제한, 현재 Trace)를 복사해서 실행
+            futures = [_extract_executor.submit(contextvars.copy_context().run, _extract_batch, batch) for batch in batches]
+            for results in (future.result() for future in futures):
+                for x in results:
+                    _page_store.set(x["url"], x["raw_content"])
+                    if x["url"] in requested and x["url"] not in contents:
+                        contents[x["url"]] = x["raw_content"]
+                    else:
+                        # Tavily가 요청과 다른 형태의 URL을 돌려준 경우
+                        extra.append({'url': x["url"], 'content': x["raw_content"]})
+
+    # 캐시 결과와 새로 추출한 결과를 원래 순서대로 합침
+    ret = [{'url': url, 'content': contents[url]} for url in unique_urls if url in contents] + extra
+    return _pages_result(ret, query)
+
+_extract_semaphore = None
+
+async def _extract_batch_async(urls):
+    global _extract_semaphore
+    if _extract_semaphore is None:
+        # 동기 버전의 추출 스레드 수와 같은 동시 실행 제한 (프로세스 전체)
+        _extract_semaphore = asyncio.Semaphore(EXTRACT_MAX_WORKERS)
+    async with _extract_semaphore:
+        response = await GOVERNOR.call_async("tavily", get_async_tavily_client().extract, urls=urls, extract_depth="advanced")
+    return response["results"]
+
+async def extract_web_page_async(urls: List[str], query: Optional[str] = None) -> List[Dict[str, Any]]:
     """
-    tavily_client = TavilyClient(TAVILY_API_KEY)
-    response = tavily_client.extract(urls=urls, extract_depth="advanced")
-    #print(response)
-    #return response
-    ret = [{'url': x["url"], 'content': x["raw_content"]} for x in response["results"]]
-    return ret
+    extract_web_page의 비동기 버전 (공유 이벤트 루프에서 실행). 페이지 캐시는 동기 버전과 공유합니다.
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    contents = {}
+    misses = []
+    for url in unique_urls:
+        content = _page_store.get(url)
+        if content is None:
+            misses.append(url)
+        else:
+            contents[url] = content
+
+    extra = []
+    if misses:
+        requested = set(misses)
+        batches = [misses[i:i + EXTRACT_BATCH_SIZE] for i in range(0, len(misses), EXTRACT_BATCH_SIZE)]
+        with span("extract", urls=len(unique_urls), cached=len(unique_urls) - len(misses)):
+            for results in await asyncio.gather(*[_extract_batch_async(batch) for batch in batches]):
+                for x in results:
+                    _page_store.set(x["url"], x["raw_content"])
+                    if x["url"] in requested and x["url"] not in contents:
+                        contents[x["url"]] = x["raw_content"]
+                    else:
+                        extra.append({'url': x["url"], 'content': x["raw_content"]})
+
+    # 랭킹은 CPU 작업이므로 공유 이벤트 루프를 막지 않도록 스레드에서 실행
+    pages = [{'url': url, 'content': contents[url]} for url in unique_urls if url in contents] + extra
+    return await asyncio.to_thread(_pages_result, pages, query)
 
 def _parse_youtube_url(url:str)->str:
     """
@@ -90,16 +307,16 @@ def _get_youtube_details(video_id):
     """
     YouTube Data API v3를 사용해 비디오의 제목과 설명을 가져옵니다.
     """
+    from googleapiclient.errors import HttpError
+
     try:
-        api_key = YOUTUBE_DATA_API_KEY
-        # YouTube API 서비스 빌드
-        youtube = build('youtube', 'v3', developerKey=api_key)
-        
-        request = youtube.videos().list(
-            part="snippet", # 'snippet' 부분에 제목, 설명이 포함됨
-            id=video_id
-        )
-        response = request.execute()
+        # 풀에서 미리 빌드된 YouTube API 클라이언트를 빌려옴
+        with youtube_client() as youtube:
+            request = youtube.videos().list(
+                part="snippet", # 'snippet' 부분에 제목, 설명이 포함됨
+                id=video_id
+            )
+            response = GOVERNOR.call("youtube", request.execute)
         
         if not response.get('items'):
             print(f"오류: 비디오 ID '{video_id}'를 찾을 수 없습니다.")
@@ -118,44 +335,294 @@ def _get_youtube_details(video_id):
         print(f"알 수 없는 오류 발생 (get_video_details): {e}")
         return None, None
 
-def extract_youtube_transcript(video_url: str) -> str:
+async def _get_youtube_details_async(video_id):
     """
-    Extract transcript from a YouTube video URL.
-    Note: Transcript may generated automatically and accuracy is not guaranteed. You can refer title and description of the video for more context and better accuracy.
-
-    Args:
-        video_url: URL of the YouTube video.
-    Returns:
-        Transcript text of the video.
+    _get_youtube_details의 비동기 버전. googleapiclient(httplib2)는 동기 전용이므로
+    videos.list REST 엔드포인트를 공유 httpx 클라이언트로 직접 호출합니다.
     """
-    video_id = _parse_youtube_url(video_url)
-    if not video_id:
-        return "Invalid YouTube URL."
-    title, description = _get_youtube_details(video_id)
+    async def _videos_list():
+        response = await get_async_http_client().get(
+            f"{YOUTUBE_API_BASE_URL}/youtube/v3/videos",
+            params={"part": "snippet", "id": video_id, "key": YOUTUBE_DATA_API_KEY or ""},
+            timeout=30.0,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        items = (await GOVERNOR.call_async("youtube", _videos_list)).get('items')
+        if not items:
+            print(f"오류: 비디오 ID '{video_id}'를 찾을 수 없습니다.")
+            return None, None
+
+        snippet = items[0]['snippet']
+        return snippet.get('title', 'No title'), snippet.get('description', 'No description')
+
+    except Exception as e:
+        print(f"API 호출 중 오류 발생 (get_video_details): {e}")
+        return None, None
 
-    ytt_api = YouTubeTranscriptApi()
-    transcript_list = ytt_api.list(video_id)
+# 비디오 ID 단위 자막 캐시 (자막은 바뀌지 않으므로 길게 유지하고 디스크에 바로 기록)
+YOUTUBE_CACHE_TTL = int(os.getenv("YOUTUBE_CACHE_TTL", 30 * 24 * 3600))
+YOUTUBE_MAX_WORKERS = int(os.getenv("YOUTUBE_MAX_WORKERS", 8))
+
+_transcript_store = ContentStore(max_bytes=PAGE_CACHE_MAX_BYTES, ttl=YOUTUBE_CACHE_TTL,
+                                 spill_dir=os.path.join(CACHE_DIR, "youtube"), write_through=True)
+_youtube_executor = ThreadPoolExecutor(max_workers=YOUTUBE_MAX_WORKERS, thread_name_prefix="youtube")
+
+def _fetch_youtube_transcript(video_id):
+    """
+    자막 목록을 조회해 수동 자막 -> 자동 생성 자막 순으로 찾아 [[시작 초, 텍스트], ...]를 반환합니다. (없으면 None)
+    """
+    ytt_api = get_transcript_api()
+    transcript_list = GOVERNOR.call("transcript", ytt_api.list, video_id)
     try:
         transcript = transcript_list.find_manually_created_transcript(['ko', 'en'])
     except Exception:
         try:
             transcript = transcript_list.find_generated_transcript(['ko', 'en'])
         except Exception:
-            return "Transcript not available for this video."
-    fetched_transcript = transcript.fetch()
-    content = "\n".join([x.text for x in fetched_transcript.snippets])
-    return [{'url': video_url, 'title': title, 'description': description, 'content': content}]
+            return None
+    fetched_transcript = GOVERNOR.call("transcript", transcript.fetch)
+    return [[round(x.start, 1), x.text] for x in fetched_transcript.snippets]
+
+def get_transcript_cache_stats():
+    return _transcript_store.stats()
+
+def _cached_transcript(video_id):
+    cached = _transcript_store.get(video_id)
+    return json.loads(cached) if cached is not None else None
+
+def _transcript_item(video_id, title, description, content, cached):
+    """
+    새로 가져온 자막(content) 또는 캐시 항목(cached)에 제목/설명을 붙여 결과 항목을 만듭니다.
+    자막은 바뀌지 않으므로 제목/설명을 가져오지 못했더라도 항상 캐시하고, 제목/설명은 다음 조회 때 다시 가져옵니다.
+    """
+    if cached is not None:
+        if title is None:
+            return cached
+        item = {**cached, 'title': title, 'description': description}
+    elif content is None:
+        return {'title': title, 'description': description, 'error': "Transcript not available for this video."}
+    else:
+        item = {'title': title, 'description': description, 'segments': content}
+    _transcript_store.set(video_id, json.dumps(item, ensure_ascii=False))
+    return item
+
+def _transcript_segments(item):
+    # 이전 형식의 캐시 항목은 시작 시각 없이 줄 단위 텍스트만 있음
+    if "segments" in item:
+        return item["segments"]
+    return [[None, line] for line in (item.get("content") or "").splitlines()]
+
+def _rank_transcripts(results, query):
+    """
+    자막이 도구 호출당 토큰 예산을 넘으면 질문과 관련 있는 구간만 남기고, 각 구간에 시작 시각과 그 시각의 링크를 붙입니다.
+    예산 안이면 전체 자막을 텍스트로 돌려줍니다.
+    """
+    videos = [r for r in results if "error" not in r]
+    segments = [_transcript_segments(r) for r in videos]
+    texts = ["\n".join(text for _, text in s) for s in segments]
+    if fits_budget(texts):
+        for r, text in zip(videos, texts):
+            r.pop("segments", None)
+            r["content"] = text
+        return results
+    with span("rank", documents=len(videos)) as attrs:
+        passages = [transcript_passages(s) for s in segments]
+        selected = select_passages([[text for _, text in p] for p in passages], query or current_query())
+        for r, video_passages, indices in zip(videos, passages, selected):
+            video_id = _parse_youtube_url(r["url"])
+            r.pop("segments", None)
+            r.pop("content", None)
+            r["passages"] = []
+            for start, text in (video_passages[i] for i in indices):
+                if start is None:
+                    r["passages"].append({'text': text})
+                else:
+                    r["passages"].append({'timestamp': format_timestamp(start),
+                                          'url': f"https://www.youtube.com/watch?v={video_id}&t={int(start)}s", 'text': text})
+            r["omitted_passages"] = len(video_passages) - len(indices)
+        attrs["tokens_before"] = sum(estimate_tokens(t) for t in texts)
+        attrs["tokens_after"] = sum(estimate_tokens(p["text"]) for r in videos for p in r["passages"])
+    return results
+
+def _transcripts_result(results, query):
+    # 시각 링크를 붙일 수 있도록 watch URL로 색인 (youtu.be 등 다른 형태의 URL도 같은 문서가 됨)
+    remember_transcripts([{'url': f"https://www.youtube.com/watch?v={_parse_youtube_url(r['url'])}", 'title': r.get('title'),
+                           'segments': _transcript_segments(r)} for r in results if "error" not in r])
+    return _rank_transcripts(results, query)
+
+def extract_youtube_transcript(video_urls: List[str], query: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Extract transcripts from one or more YouTube video URLs. Multiple videos are processed in parallel, so pass all relevant videos in a single call.
+    Note: Transcript may generated automatically and accuracy is not guaranteed. You can refer title and description of the video for more context and better accuracy.
+    When the transcripts are long, only the parts most relevant to the query are returned, each with its start timestamp and a link to that moment.
 
-def generate_config(google_web_search, google_map_search, google_code_execution, tavily_search, extraction, temperature=0.2):
+    Args:
+        video_urls: List of YouTube video URLs.
+        query: What you are looking for in these videos (optional). Defaults to the user's question.
+    Returns:
+        List of dictionaries with URL, title, description and either the transcript text, or its most relevant
+        timestamped passages and the number of omitted passages when the transcripts are too long.
+    """
+    if isinstance(video_urls, str):
+        video_urls = [video_urls]
+
+    results = {}
+    pending = {}
+    for video_url in dict.fromkeys(video_urls):
+        video_id = _parse_youtube_url(video_url)
+        if not video_id:
+            results[video_url] = {'url': video_url, 'error': "Invalid YouTube URL."}
+            continue
+        cached = _cached_transcript(video_id)
+        if cached is not None and cached.get('title') is not None:
+            results[video_url] = {'url': video_url, **cached}
+            continue
+        details_future = _youtube_executor.submit(contextvars.copy_context().run, _get_youtube_details, video_id)
+        if cached is not None:
+            # 자막은 캐시에 있지만 제목/설명을 가져오지 못했던 항목은 제목/설명만 다시 조회
+            pending[video_url] = (video_id, details_future, None, cached)
+            continue
+        # 제목/설명 조회와 자막 조회를 동시에 실행 (여러 비디오도 모두 병렬로 처리)
+        transcript_future = _youtube_executor.submit(contextvars.copy_context().run, _fetch_youtube_transcript, video_id)
+        pending[video_url] = (video_id, details_future, transcript_future, None)
+
+    for video_url, (video_id, details_future, transcript_future, cached) in pending.items():
+        content = None
+        if transcript_future is not None:
+            try:
+                content = transcript_future.result()
+            except Exception as e:
+                print(f"Failed to fetch transcript ({video_id}): {e}")
+        title, description = details_future.result()
+        results[video_url] = {'url': video_url, **_transcript_item(video_id, title, description, content, cached)}
+
+    return _transcripts_result([results[video_url] for video_url in dict.fromkeys(video_urls)], query)
+
+async def _fetch_youtube_transcript_async(video_id):
+    # youtube_transcript_api는 동기 전용이므로 기존 YouTube 스레드 풀에서 실행
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_youtube_executor, contextvars.copy_context().run, _fetch_youtube_transcript, video_id)
+
+async def _youtube_video_async(video_url):
+    video_id = _parse_youtube_url(video_url)
+    if not video_id:
+        return {'url': video_url, 'error': "Invalid YouTube URL."}
+    cached = _cached_transcript(video_id)
+    if cached is not None and cached.get('title') is not None:
+        return {'url': video_url, **cached}
+
+    if cached is not None:
+        # 자막은 캐시에 있지만 제목/설명을 가져오지 못했던 항목은 제목/설명만 다시 조회
+        details = (await asyncio.gather(_get_youtube_details_async(video_id), return_exceptions=True))[0]
+        content = None
+    else:
+        # 제목/설명 조회와 자막 조회를 동시에 실행
+        details, content = await asyncio.gather(
+            _get_youtube_details_async(video_id),
+            _fetch_youtube_transcript_async(video_id),
+            return_exceptions=True,
+        )
+    # return_exceptions=True이면 실패한 쪽은 예외 객체가 그대로 들어오므로 풀기 전에 확인
+    if isinstance(details, BaseException):
+        print(f"Failed to fetch video details ({video_id}): {details!r}")
+        details = (None, None)
+    title, description = details
+    if isinstance(content, BaseException):
+        print(f"Failed to fetch transcript ({video_id}): {content}")
+        content = None
+    return {'url': video_url, **_transcript_item(video_id, title, description, content, cached)}
+
+async def extract_youtube_transcript_async(video_urls: List[str], query: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    extract_youtube_transcript의 비동기 버전 (공유 이벤트 루프에서 실행). 자막 캐시는 동기 버전과 공유합니다.
+    """
+    if isinstance(video_urls, str):
+        video_urls = [video_urls]
+    unique_urls = list(dict.fromkeys(video_urls))
+    results = list(await asyncio.gather(*[_youtube_video_async(video_url) for video_url in unique_urls]))
+    return await asyncio.to_thread(_transcripts_result, results, query)
+
+def search_session_sources(query: str, max_results: int = 8) -> Dict[str, Any]:
+    """
+    Search the web search results, web pages and YouTube transcripts already fetched earlier in this conversation.
+    This is local and instant, so for follow-up questions use it first, and only search the web or extract pages again
+    when it does not have what you need.
+
+    Args:
+        query: What you are looking for (keywords or a natural language question).
+        max_results: Maximum number of passages to return. Default is 8.
+    Returns:
+        Dictionary with the number of stored sources and the matching passages, most relevant first.
+        Each passage has the URL, title, kind ("search", "page" or "transcript"), text, and a timestamp for transcripts.
+    """
+    sources = current_sources()
+    if sources is None:
+        return {'sources': 0, 'results': []}
+    with span("session_sources.search") as attrs:
+        results = sources.search(query, max_results=max_results)
+        attrs["results"] = len(results)
+    return {'sources': len(sources), 'results': results}
+
+async def search_session_sources_async(query: str, max_results: int = 8) -> Dict[str, Any]:
+    """
+    search_session_sources의 비동기 버전. 저장된 세션을 연 뒤 처음 검색할 때는 압축 해제와 색인이 필요하므로 스레드에서 실행합니다.
+    """
+    return await asyncio.to_thread(search_session_sources, query, max_results)
+
+# 모델이 호출할 수 있는 파이썬 함수 도구 (이름 -> 함수)
+TOOL_FUNCTIONS = {
+    "search_web_tavily": search_web_tavily,
+    "extract_web_page": extract_web_page,
+    "extract_youtube_transcript": extract_youtube_transcript,
+    "search_session_sources": search_session_sources,
+}
+# 비동기 경로(run_tool_loop_async)에서 사용하는 같은 도구의 코루틴 버전
+ASYNC_TOOL_FUNCTIONS = {
+    "search_web_tavily": search_web_tavily_async,
+    "extract_web_page": extract_web_page_async,
+    "extract_youtube_transcript": extract_youtube_transcript_async,
+    "search_session_sources": search_session_sources_async,
+}
+TOOL_MAX_ITERATIONS = int(os.getenv("TOOL_MAX_ITERATIONS", 10))
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", 8))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", 60))
+TOOL_TIMEOUTS = {
+    "search_web_tavily": 30,
+    "extract_web_page": 90,
+    "extract_youtube_transcript": 60,
+    "search_session_sources": 10,
+}
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+@lru_cache(maxsize=None)
+def _function_declaration(name):
+    return types.FunctionDeclaration.from_callable_with_api_option(callable=TOOL_FUNCTIONS[name], api_option="GEMINI_API")
+
+def generate_config(google_web_search, google_map_search, google_code_execution, tavily_search, extraction, temperature=0.2,
+                    location=None):
     tools = []
     tool_config = None
 
+    # 파이썬 함수는 선언(FunctionDeclaration)만 전달하고, 실행은 run_tool_loop에서 직접 병렬로 처리
+    function_names = []
     if tavily_search:
-        tools.append(search_web_tavily)
+        function_names.append("search_web_tavily")
 
     if extraction:
-        tools.append(extract_youtube_transcript)
-        tools.append(extract_web_page)
+        function_names.append("extract_youtube_transcript")
+        function_names.append("extract_web_page")
+
+    # 이 세션에서 이미 가져온 자료가 있으면 다시 검색/추출하기 전에 찾아볼 수 있도록 제공
+    sources = current_sources()
+    if function_names and sources is not None and len(sources):
+        function_names.append("search_session_sources")
+
+    if function_names:
+        tools.append(types.Tool(function_declarations=[_function_declaration(name) for name in function_names]))
 
     if google_web_search:
         grounding_tool = types.Tool (
@@ -164,8 +631,11 @@ def generate_config(google_web_search, google_map_search, google_code_execution,
         tools.append(grounding_tool)
 
     if google_map_search:
-        location = streamlit_geolocation()
-        if location:
+        # location({"latitude", "longitude"})을 주지 않으면 브라우저 위치를 요청 (Streamlit UI)
+        if location is None:
+            from streamlit_geolocation import streamlit_geolocation
+            location = streamlit_geolocation()
+        if location and location.get('latitude') is not None:
             latitude = location['latitude']
             longitude = location['longitude']
 
@@ -202,36 +672,105 @@ def generate_config(google_web_search, google_map_search, google_code_execution,
         """,
         max_output_tokens=65536,
         temperature=temperature,
-        thinking_config=types.ThinkingConfig(thinking_budget=-1)
+        thinking_config=types.ThinkingConfig(thinking_budget=-1),
+        automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
     )
     return config
 
-@lru_cache(maxsize=1)
-def get_genai_client():
-    return genai.Client()
-
-def genai_stream_wrapper(response_stream, grounding_metadata, total_citation_metadata, function_calls_list):
-    for chunk in response_stream:
-        if chunk.automatic_function_calling_history:
-            function_calls_list.extend(chunk.automatic_function_calling_history)
-        if chunk.candidates:
-            for cand in chunk.candidates:
-                if cand.citation_metadata:
-                    total_citation_metadata.extend(cand.citation_metadata)
-                if cand.grounding_metadata:
-                    grounding_metadata.append(cand.grounding_metadata)
-                if cand.content and cand.content.parts:
-                    for part in cand.content.parts:
-                        if part.executable_code:
-                            str = f"\n#### Executable Code Snippet\n```{'python' if part.executable_code.language == types.Language.PYTHON else ''}\n{part.executable_code.code}\n```\n"
+def genai_stream_wrapper(response_stream, grounding_metadata, total_citation_metadata, function_calls_list, citation_engine=None):
+    """
+    응답 스트림에서 텍스트를 yield하면서 메타데이터를 수집합니다.
+    citation_engine이 주어지면 메타데이터가 도착하는 즉시 전달해 인용 URL 해석을 미리 시작합니다.
+    첫 토큰까지의 시간(first_token)과 생성 속도(tokens/sec)를 현재 Trace에 기록합니다.
+    """
+    started = time.perf_counter()
+    timing = {"first": None, "last": None, "tokens": 0, "decode_time": 0.0, "output_tokens": 0}
+    first_token = True
+    try:
+        for chunk in response_stream:
+            for text in _chunk_texts(chunk, grounding_metadata, total_citation_metadata, function_calls_list, citation_engine, timing):
+                if first_token:
+                    first_token = False
+                    record_span("first_token", started, time.perf_counter())
+                yield text
+    finally:
+        _record_generate_timing(started, timing)
+
+async def genai_stream_wrapper_async(response_stream, grounding_metadata, total_citation_metadata, function_calls_list, citation_engine=None):
+    """genai_stream_wrapper의 비동기 버전 (response_stream은 async iterator)"""
+    started = time.perf_counter()
+    timing = {"first": None, "last": None, "tokens": 0, "decode_time": 0.0, "output_tokens": 0}
+    first_token = True
+    try:
+        async for chunk in response_stream:
+            for text in _chunk_texts(chunk, grounding_metadata, total_citation_metadata, function_calls_list, citation_engine, timing):
+                if first_token:
+                    first_token = False
+                    record_span("first_token", started, time.perf_counter())
+                yield text
+    finally:
+        _record_generate_timing(started, timing)
+
+def _record_generate_timing(started, timing):
+    _close_response_timing(timing)
+    attrs = {"output_tokens": timing["output_tokens"]}
+    if timing["output_tokens"] and timing["decode_time"] > 0:
+        rate = timing["output_tokens"] / timing["decode_time"]
+        attrs["tokens_per_second"] = round(rate, 1)
+        observe_rate("dumblexity_tokens_per_second", rate)
+    record_span("generate", started, time.perf_counter(), **attrs)
+
+def _close_response_timing(timing):
+    """한 번의 모델 응답(함수 호출 사이의 각 호출)의 생성 시간과 출력 토큰 수를 누적합니다."""
+    if timing["first"] is not None:
+        timing["decode_time"] += timing["last"] - timing["first"]
+        timing["output_tokens"] += timing["tokens"]
+    timing.update(first=None, last=None, tokens=0)
+
+def _chunk_texts(chunk, grounding_metadata, total_citation_metadata, function_calls_list, citation_engine, timing):
+    """chunk 하나에서 메타데이터를 수집하고 표시할 텍스트를 yield합니다. (동기/비동기 스트림 공용)"""
+    if chunk.automatic_function_calling_history:
+        function_calls_list.extend(chunk.automatic_function_calling_history)
+        if citation_engine:
+            citation_engine.add_function_history(chunk.automatic_function_calling_history)
+        # 함수 호출 결과를 보내기 전에 모델 응답 하나가 끝남 (도구 실행 시간은 생성 속도에서 제외)
+        _close_response_timing(timing)
+        if not chunk.candidates:
+            return
+    now = time.perf_counter()
+    if timing["first"] is None:
+        timing["first"] = now
+    timing["last"] = now
+    if chunk.usage_metadata and chunk.usage_metadata.candidates_token_count:
+        # 스트리밍 중 usage_metadata는 해당 응답의 누적값
+        timing["tokens"] = chunk.usage_metadata.candidates_token_count
+    if chunk.candidates:
+        for cand in chunk.candidates:
+            if cand.citation_metadata:
+                total_citation_metadata.append(cand.citation_metadata)
+                if citation_engine:
+                    citation_engine.add_citation_metadata(cand.citation_metadata)
+            if cand.grounding_metadata:
+                grounding_metadata.append(cand.grounding_metadata)
+                if citation_engine:
+                    citation_engine.add_grounding_metadata(cand.grounding_metadata)
+            if cand.content and cand.content.parts:
+                for part in cand.content.parts:
+                    if part.executable_code:
+                        str = f"\n#### Executable Code Snippet\n```{'python' if part.executable_code.language == types.Language.PYTHON else ''}\n{part.executable_code.code}\n```\n"
+                        yield str
+                        if part.code_execution_result and part.code_execution_result.output:
+                            str = f"\n#### Code Execution Result\n```\n{part.code_execution_result.output}\n```"
                             yield str
-                            if part.code_execution_result and part.code_execution_result.output:
-                                str = f"\n#### Code Execution Result\n```\n{part.code_execution_result.output}\n```"
-                                yield str
-                        #elif part.text:
-                            #yield part.text
-        if chunk.text:
-            yield chunk.text
+                    #elif part.text:
+                        #yield part.text
+    if chunk.function_calls:
+        # 함수 호출이 포함된 chunk에서 chunk.text를 읽으면 SDK가 경고를 출력하므로 텍스트 part만 직접 모음
+        text = "".join(part.text for part in chunk.candidates[0].content.parts if part.text and not part.thought)
+        if text:
+            yield text
+    elif chunk.text:
+        yield chunk.text
 
 def gen_sdk_history(role, text):
     return types.Content(
@@ -239,33 +778,218 @@ def gen_sdk_history(role, text):
         parts=[types.Part(text=text)]
     )
 
+def _run_tool(function_call):
+    func = TOOL_FUNCTIONS.get(function_call.name)
+    if func is None:
+        raise ValueError(f"Unknown function: {function_call.name}")
+    with span(f"tool.{function_call.name}"):
+        return func(**(function_call.args or {}))
+
+def _function_response(function_call, response):
+    return types.Part(function_response=types.FunctionResponse(
+        id=function_call.id, name=function_call.name, response=response
+    ))
+
 def get_function_call_results(function_calls):
+    """
+    한 단계에서 모델이 요청한 함수 호출을 모두 동시에 실행하고 function_response Part 목록을 반환합니다.
+    도구별 제한 시간을 넘기거나 실패한 호출은 오류 응답으로 돌려줍니다.
+    """
+    started = time.monotonic()
+    futures = [_tool_executor.submit(contextvars.copy_context().run, _run_tool, fc) for fc in function_calls]
     results = []
-    for func_call in function_calls:
-        if func_call.name == "extract_web_page":
-            result = extract_web_page(func_call.args["urls"])
-            results.append(
-                types.Part.from_function_response(name=func_call.name, response={"contents":result})
-            )
+    for function_call, future in zip(function_calls, futures):
+        timeout = TOOL_TIMEOUTS.get(function_call.name, TOOL_TIMEOUT)
+        try:
+            response = {"result": future.result(timeout=max(0.0, started + timeout - time.monotonic()))}
+        except FuturesTimeoutError:
+            response = {"error": f"{function_call.name} timed out after {timeout:.0f}s."}
+        except Exception as e:
+            response = {"error": f"{function_call.name} failed: {e}"}
+        results.append(_function_response(function_call, response))
+    return results
+
+async def _run_tool_async(function_call):
+    func = ASYNC_TOOL_FUNCTIONS.get(function_call.name)
+    if func is None:
+        raise ValueError(f"Unknown function: {function_call.name}")
+    timeout = TOOL_TIMEOUTS.get(function_call.name, TOOL_TIMEOUT)
+    with span(f"tool.{function_call.name}"):
+        return await asyncio.wait_for(func(**(function_call.args or {})), timeout)
+
+async def get_function_call_results_async(function_calls):
+    """get_function_call_results의 비동기 버전 (모든 호출을 공유 이벤트 루프에서 동시에 실행)"""
+    outcomes = await asyncio.gather(*[_run_tool_async(fc) for fc in function_calls], return_exceptions=True)
+    results = []
+    for function_call, outcome in zip(function_calls, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            timeout = TOOL_TIMEOUTS.get(function_call.name, TOOL_TIMEOUT)
+            response = {"error": f"{function_call.name} timed out after {timeout:.0f}s."}
+        elif isinstance(outcome, BaseException):
+            # 같은 요청을 기다리던 다른 호출이 취소된 경우(CancelledError)도 오류로 전달
+            response = {"error": f"{function_call.name} failed: {outcome!r}"}
+        else:
+            response = {"result": outcome}
+        results.append(_function_response(function_call, response))
     return results
 
-def process_files(uploaded_files):
-    file_contents = []
-    if uploaded_files:
-        for uploaded_file in uploaded_files:
-            if uploaded_file.size > 2 * 1024 * 1024:
-                with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                    tmp_file.write(uploaded_file.getvalue())
-                    temp_file_path = tmp_file.name
-                    content = get_genai_client().files.upload(file=temp_file_path, config=dict(mime_type=uploaded_file.type))
-                    file_contents.append(content)
-                    if os.path.exists(temp_file_path):
-                        os.remove(temp_file_path)
+def _tool_call_event(function_calls):
+    return {"type": "tool_call", "calls": [{"id": fc.id, "name": fc.name, "args": fc.args or {}} for fc in function_calls]}
+
+def _tool_result_event(responses):
+    return {"type": "tool_result", "results": [
+        {"id": p.function_response.id, "name": p.function_response.name, "error": p.function_response.response.get("error")}
+        for p in responses
+    ]}
+
+def _tool_limit_responses(function_calls):
+    # 반복 횟수 제한에 도달하면 도구를 실행하지 않고 지금까지의 정보로 답하도록 요청
+    return [_function_response(fc, {"error": "Tool call limit reached. Answer with the information you already have."})
+            for fc in function_calls]
+
+def _function_history_chunk(function_calls, responses):
+    call_content = types.Content(role="model", parts=[types.Part(function_call=fc) for fc in function_calls])
+    response_content = types.Content(role="user", parts=responses)
+    return types.GenerateContentResponse(automatic_function_calling_history=[call_content, response_content])
+
+def run_tool_loop(chat_session, message, max_iterations=TOOL_MAX_ITERATIONS, on_event=None):
+    """
+    send_message_stream의 응답 chunk를 그대로 yield하면서, 모델이 함수 호출을 요청하면 직접 (병렬로) 실행하고
+    결과를 다시 보내는 과정을 반복합니다. 호출/응답 내역은 자동 함수 호출(AFC)과 같은 형태로
+    automatic_function_calling_history에 담아 yield하므로 genai_stream_wrapper가 그대로 수집합니다.
+    on_event가 주어지면 도구 실행 전후에 {"type": "tool_call" | "tool_result", ...} 이벤트로 호출됩니다.
+    """
+    for iteration in range(max_iterations + 1):
+        function_calls = []
+        for chunk in GOVERNOR.stream("gemini", chat_session.send_message_stream, message):
+            if chunk.function_calls:
+                function_calls.extend(chunk.function_calls)
+            yield chunk
+        if not function_calls:
+            return
+
+        if on_event:
+            on_event(_tool_call_event(function_calls))
+        if iteration < max_iterations:
+            responses = get_function_call_results(function_calls)
+        else:
+            responses = _tool_limit_responses(function_calls)
+        if on_event:
+            on_event(_tool_result_event(responses))
+        yield _function_history_chunk(function_calls, responses)
+        message = responses
+
+        if iteration == max_iterations:
+            # 마지막 답변 (추가 함수 호출은 무시)
+            for chunk in GOVERNOR.stream("gemini", chat_session.send_message_stream, message):
+                yield chunk
+            return
+
+async def run_tool_loop_async(chat_session, message, max_iterations=TOOL_MAX_ITERATIONS, on_event=None):
+    """
+    run_tool_loop의 비동기 버전. chat_session은 client.aio.chats.create()로 만든 AsyncChat이며,
+    모델 스트리밍과 도구 실행이 모두 공유 이벤트 루프에서 진행됩니다.
+    """
+    for iteration in range(max_iterations + 1):
+        function_calls = []
+        async for chunk in GOVERNOR.stream_async("gemini", chat_session.send_message_stream, message):
+            if chunk.function_calls:
+                function_calls.extend(chunk.function_calls)
+            yield chunk
+        if not function_calls:
+            return
+
+        if on_event:
+            on_event(_tool_call_event(function_calls))
+        if iteration < max_iterations:
+            responses = await get_function_call_results_async(function_calls)
+        else:
+            responses = _tool_limit_responses(function_calls)
+        if on_event:
+            on_event(_tool_result_event(responses))
+        yield _function_history_chunk(function_calls, responses)
+        message = responses
+
+        if iteration == max_iterations:
+            async for chunk in GOVERNOR.stream_async("gemini", chat_session.send_message_stream, message):
+                yield chunk
+            return
+
+# 업로드 파일 캐시: (내용 해시, MIME 타입)이 같으면 만료 전까지 업로드된 파일 핸들을 재사용
+INLINE_FILE_LIMIT = 2 * 1024 * 1024
+UPLOAD_MAX_WORKERS = int(os.getenv("UPLOAD_MAX_WORKERS", 4))
+# 업로드된 파일은 48시간 후 만료되므로, 만료 직전의 핸들은 재사용하지 않음
+_FILE_EXPIRY_MARGIN = 10 * 60
+
+_uploaded_file_cache = TTLCache(maxsize=1024, ttl=47 * 3600)
+_inline_part_cache = TTLCache(maxsize=256, ttl=6 * 3600)
+_file_digests = TTLCache(maxsize=1024, ttl=6 * 3600)  # Streamlit file_id -> 내용 해시
+_upload_flight = SingleFlight()
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS, thread_name_prefix="upload")
+
+def _file_cache_key(uploaded_file):
+    file_id = getattr(uploaded_file, "file_id", None)
+    digest = _file_digests.get(file_id) if file_id else None
+    if digest is None:
+        digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        if file_id:
+            _file_digests.set(file_id, digest)
+    return f"{digest}:{uploaded_file.type}"
+
+def _upload_file(key, data, mime_type, display_name):
+    cached = _uploaded_file_cache.get(key)
+    if cached is not None:
+        return cached
+    # 임시 파일 없이 메모리에서 바로 업로드
+    with span("upload_file", file=display_name, bytes=len(data)):
+        file = get_genai_client().files.upload(file=io.BytesIO(data), config=dict(mime_type=mime_type, display_name=display_name))
+    ttl = 47 * 3600
+    if file.expiration_time:
+        ttl = file.expiration_time.timestamp() - time.time() - _FILE_EXPIRY_MARGIN
+    if ttl > 0:
+        _uploaded_file_cache.set(key, file, ttl=ttl)
+    return file
+
+def process_files(uploaded_files, progress_callback=None):
+    """
+    업로드된 파일을 모델 입력(Part 또는 업로드된 File)으로 변환합니다.
+    이미 처리한 파일은 캐시에서 재사용하고, 새로 업로드할 파일은 병렬로 업로드합니다.
+    progress_callback(done, total, name)은 호출한 스레드에서 업로드가 끝날 때마다 호출됩니다.
+    """
+    with span("process_files", files=len(uploaded_files or [])) as attrs:
+        file_contents = _process_files(uploaded_files, progress_callback)
+        attrs["uploaded"] = sum(1 for f in file_contents if isinstance(f, types.File))
+    return file_contents
+
+def _process_files(uploaded_files, progress_callback):
+    file_contents = [None] * len(uploaded_files or [])
+    pending = {}
+    for i, uploaded_file in enumerate(uploaded_files or []):
+        key = _file_cache_key(uploaded_file)
+        if uploaded_file.size > INLINE_FILE_LIMIT:
+            cached = _uploaded_file_cache.get(key)
+            if cached is not None:
+                file_contents[i] = cached
             else:
+                future = _upload_executor.submit(contextvars.copy_context().run, _upload_flight.do, key, _upload_file,
+                                                 key, uploaded_file.getvalue(), uploaded_file.type, uploaded_file.name)
+                pending[future] = (i, uploaded_file.name)
+        else:
+            content = _inline_part_cache.get(key)
+            if content is None:
                 content = types.Part.from_bytes(
                     data=uploaded_file.getvalue(),
                     mime_type=uploaded_file.type,
                 )
-                file_contents.append(content)
-    print(f"Processed {len(file_contents)} files.")
+                _inline_part_cache.set(key, content)
+            file_contents[i] = content
+
+    if pending and progress_callback:
+        progress_callback(0, len(pending), None)
+    for done, future in enumerate(as_completed(pending), start=1):
+        i, name = pending[future]
+        file_contents[i] = future.result()
+        if progress_callback:
+            progress_callback(done, len(pending), name)
+
     return file_contents
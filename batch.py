@@ -0,0 +1,236 @@
+"""
+JSONL 파일의 질문을 동시에 실행하고 결과를 JSONL로 기록하는 배치 실행기.
+
+    python batch.py prompts.jsonl -o answers.jsonl --workers 8
+    python batch.py prompts.jsonl -o answers.jsonl --resume    # 중단된 작업 이어서 실행
+
+입력 한 줄: {"id": "q1", "prompt": "...", "model": "...", "temperature": 0.2, "search_mode": "google|maps|code|external|none",
+            "google_web_search": true, ...(generate_config 도구 옵션), "history_budget": 32000, "messages": [...](이전 대화)}
+  prompt가 없으면 body/title 필드를 사용하고, id가 없으면 request_id 또는 줄 번호를 사용합니다.
+출력 한 줄: {"id", "line", "prompt", "model", "options", "content", "citations", "tool_calls", "timing", "error"}
+  결과는 끝나는 순서대로 바로 기록됩니다. --resume이면 이미 성공한 id는 건너뜁니다.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from ai import available_models
+from engine import ChatEngine, tool_options, SEARCH_MODES, TOOL_OPTION_NAMES
+from history import HISTORY_TOKEN_BUDGET
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 4))
+
+
+def read_jobs(path, defaults):
+    """입력 JSONL을 읽어 작업 목록을 만듭니다. (빈 줄, 주석(#) 줄은 무시)"""
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_no}: invalid JSON ({e})", file=sys.stderr)
+                continue
+            if isinstance(item, str):
+                item = {"prompt": item}
+            prompt = item.get("prompt") or item.get("body") or item.get("title")
+            if not prompt:
+                print(f"Skipping line {line_no}: no prompt", file=sys.stderr)
+                continue
+            search_mode = item.get("search_mode", defaults["search_mode"])
+            if search_mode not in SEARCH_MODES:
+                print(f"Skipping line {line_no}: unknown search_mode {search_mode!r}", file=sys.stderr)
+                continue
+            jobs.append({
+                "id": str(item.get("id") or item.get("request_id") or f"line-{line_no}"),
+                "line": line_no,
+                "prompt": prompt,
+                "model": item.get("model") or defaults["model"],
+                "temperature": float(item.get("temperature", defaults["temperature"])),
+                "options": tool_options(search_mode, **{k: item.get(k) for k in TOOL_OPTION_NAMES}),
+                "history_budget": int(item.get("history_budget", defaults["history_budget"])),
+                "messages": item.get("messages") or [],
+                "location": item.get("location") or {},
+            })
+    return jobs
+
+
+def completed_ids(path, retry_errors=True):
+    """이미 기록된 결과의 id. retry_errors이면 오류로 끝난 항목은 다시 실행합니다."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # 비정상 종료로 잘린 마지막 줄
+                continue
+            if not (retry_errors and result.get("error")):
+                done.add(result["id"])
+    return done
+
+
+def _timing(trace):
+    spans = trace["spans"]
+    timing = {"total": round(trace["duration"], 3)}
+    for name in ("first_token", "generate", "citations"):
+        durations = [s["duration"] for s in spans if s["name"] == name]
+        if durations:
+            timing[name] = round(sum(durations), 3)
+    tool_durations = [s["duration"] for s in spans if s["name"].startswith("tool.")]
+    if tool_durations:
+        timing["tools"] = round(sum(tool_durations), 3)
+        timing["tool_calls"] = len(tool_durations)
+    generate = next((s for s in spans if s["name"] == "generate"), None)
+    if generate and generate.get("tokens_per_second"):
+        timing["tokens_per_second"] = generate["tokens_per_second"]
+    return timing
+
+
+def run_job(job):
+    started = time.time()
+    result = {
+        "id": job["id"], "line": job["line"], "prompt": job["prompt"], "model": job["model"],
+        "options": job["options"], "content": "", "citations": [], "tool_calls": [], "timing": None, "error": None,
+        "started_at": datetime.datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+    }
+    engine = ChatEngine(
+        state={"messages": list(job["messages"])},
+        model=job["model"],
+        temperature=job["temperature"],
+        options=job["options"],
+        history_budget=job["history_budget"],
+        location=job["location"],
+        autosave=False,
+    )
+    try:
+        for event in engine.ask(job["prompt"]):
+            if event["type"] == "citations":
+                result["citations"].append({"header": event["header"], "text": event["text"]})
+            elif event["type"] == "tool_call":
+                result["tool_calls"].extend(event["calls"])
+            elif event["type"] == "done":
+                result["content"] = event["content"]
+                result["timing"] = _timing(event["trace"])
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["timing"] = {"total": round(time.time() - started, 3)}
+    return result
+
+
+class ResultWriter:
+    """결과를 끝나는 즉시 한 줄씩 기록합니다. (여러 스레드에서 호출 가능)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # 이전 실행이 줄 중간에서 끊겼으면 새 줄에서 시작
+        needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+
+    def write(self, result):
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def run_batch(jobs, output_path, workers=BATCH_WORKERS, on_result=None):
+    """
+    작업을 최대 workers개씩 동시에 실행하고 결과를 output_path에 기록합니다.
+    제출은 실행 중인 작업 수만큼만 앞서 진행하므로 입력이 커도 메모리 사용량이 일정합니다.
+    """
+    writer = ResultWriter(output_path)
+    pending = set()
+    errors = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+            job_iter = iter(jobs)
+            for job in job_iter:
+                pending.add(executor.submit(run_job, job))
+                if len(pending) >= workers * 2:
+                    break
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    result = future.result()
+                    errors += bool(result["error"])
+                    writer.write(result)
+                    if on_result:
+                        on_result(result)
+                    next_job = next(job_iter, None)
+                    if next_job is not None:
+                        pending.add(executor.submit(run_job, next_job))
+    finally:
+        writer.close()
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run many prompts from a JSONL file concurrently.")
+    parser.add_argument("input", help="input JSONL (one prompt per line)")
+    parser.add_argument("-o", "--output", help="output JSONL (default: <input>.answers.jsonl)")
+    parser.add_argument("-w", "--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--resume", action="store_true", help="skip ids already answered in the output file")
+    parser.add_argument("--no-retry-errors", action="store_true", help="with --resume, also skip ids that failed")
+    parser.add_argument("--model", default=available_models[0], help="default model for lines without one")
+    parser.add_argument("--search", default="google", choices=sorted(SEARCH_MODES), help="default search mode")
+    parser.add_argument("--temperature", type=float, default=0.2)
+    parser.add_argument("--history-budget", type=int, default=HISTORY_TOKEN_BUDGET)
+    parser.add_argument("--limit", type=int, help="run at most this many prompts")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.input)[0] + ".answers.jsonl"
+    defaults = {"model": args.model, "search_mode": args.search, "temperature": args.temperature,
+                "history_budget": args.history_budget}
+    jobs = read_jobs(args.input, defaults)
+    if args.resume:
+        done = completed_ids(output, retry_errors=not args.no_retry_errors)
+        skipped = sum(1 for job in jobs if job["id"] in done)
+        jobs = [job for job in jobs if job["id"] not in done]
+        print(f"Resuming: {skipped} already answered.", file=sys.stderr)
+    elif os.path.exists(output) and os.path.getsize(output):
+        parser.error(f"{output} already exists (use --resume to continue it, or choose another --output)")
+    if args.limit is not None:
+        jobs = jobs[:args.limit]
+
+    total = len(jobs)
+    started = time.time()
+    progress = {"done": 0}
+
+    def _report(result):
+        progress["done"] += 1
+        elapsed = time.time() - started
+        rate = progress["done"] / elapsed if elapsed else 0.0
+        eta = (total - progress["done"]) / rate if rate else 0.0
+        status = "ERROR " + result["error"] if result["error"] else f"{result['timing']['total']:.1f}s"
+        print(f"[{progress['done']}/{total}] {result['id']}: {status} ({rate:.2f}/s, ETA {eta:.0f}s)", file=sys.stderr)
+
+    print(f"Running {total} prompts with {args.workers} workers -> {output}", file=sys.stderr)
+    errors = run_batch(jobs, output, workers=args.workers, on_result=_report)
+    print(f"Finished {total} prompts in {time.time() - started:.1f}s ({errors} errors).", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""
+벤치마크용 로컬 대체 서버와 mock.
+
+FakeServices 하나의 HTTP 서버가 다음 API를 흉내냅니다. (응답 지연은 latency 설정으로 조절)
+  - Gemini: streamGenerateContent(SSE), generateContent, 파일 업로드(resumable)
+  - Tavily: /search, /extract
+  - YouTube Data API v3: /youtube/v3/videos
+  - 리디렉션 URL: /r/<id> -> /final/<id>?utm_source=bench
+
+YouTube 자막(youtube_transcript_api)은 youtube.com 페이지를 직접 파싱하므로 서버 대신 FakeTranscriptApi로 대체합니다.
+
+Gemini 응답의 형태는 마지막 user 메시지에 포함된 지시어로 정합니다.
+  [bench chunks=20 chunk_chars=40 citations=8 tools=2]
+  - chunks/chunk_chars: 스트리밍 chunk 수와 chunk당 글자 수
+  - citations: grounding chunk(인용) 수. URL은 요청마다 새로 만들어지므로 URL 캐시에 걸리지 않음
+  - tools: 첫 응답에서 요청할 search_web_tavily 병렬 호출 수
+  - throttle: 같은 요청의 처음 N번은 429(RESOURCE_EXHAUSTED, Retry-After: 0)로 거절
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import datetime
+import itertools
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_LATENCY = {
+    "gemini": 0.05,        # 첫 chunk까지의 지연
+    "gemini_chunk": 0.005, # chunk 간 간격
+    "tavily": 0.08,
+    "youtube": 0.04,
+    "transcript": 0.12,
+    "redirect": 0.02,
+    "upload": 0.03,
+}
+
+_DIRECTIVE_RE = re.compile(r"\[bench ([^\]]*)\]")
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+          "et dolore magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris").split()
+
+
+def _directives(body):
+    """요청 본문에서 마지막 user 텍스트의 [bench ...] 지시어를 읽습니다."""
+    options = {}
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            match = _DIRECTIVE_RE.search(part.get("text") or "")
+            if match:
+                options = dict(kv.split("=", 1) for kv in match.group(1).split() if "=" in kv)
+    return {k: int(v) for k, v in options.items() if v.isdigit()}
+
+
+def _has_function_response(body):
+    contents = body.get("contents", [])
+    return bool(contents) and any("functionResponse" in part for part in contents[-1].get("parts", []))
+
+
+def _text(n_chars, seed):
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < n_chars:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:n_chars]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeServices/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- helpers ---
+    def _sleep(self, kind):
+        latency = self.server.latency.get(kind, 0)
+        if latency:
+            time.sleep(latency * random.uniform(0.8, 1.2))
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, obj, status=200, headers=None):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    # --- routing ---
+    def do_HEAD(self):
+        self._route("HEAD")
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def _route(self, method):
+        self.server.requests += 1
+        path = urlsplit(self.path).path
+        if path.startswith("/r/"):
+            self._sleep("redirect")
+            self._send_empty(302, {"Location": f"/final/{path[3:]}?utm_source=bench&gclid=x"})
+        elif path.startswith("/final/"):
+            self._sleep("redirect")
+            if method == "HEAD":
+                self._send_empty(200)
+            else:
+                self._send_json({"ok": True})
+        elif path == "/search" and method == "POST":
+            self._tavily_search(json.loads(self._read_body() or b"{}"))
+        elif path == "/extract" and method == "POST":
+            self._tavily_extract(json.loads(self._read_body() or b"{}"))
+        elif path == "/youtube/v3/videos":
+            self._youtube_videos(parse_qs(urlsplit(self.path).query))
+        elif path.startswith("/upload/") and method == "POST":
+            self._upload_start()
+        elif path.startswith("/upload-session/") and method == "POST":
+            self._upload_finalize(path.rsplit("/", 1)[-1])
+        elif path.endswith(":streamGenerateContent") and method == "POST":
+            self._stream_generate(json.loads(self._read_body() or b"{}"))
+        elif path.endswith(":generateContent") and method == "POST":
+            self._read_body()
+            self._sleep("gemini")
+            self._send_json({"candidates": [{"content": {"role": "model", "parts": [{"text": _text(400, 0)}]},
+                                             "finishReason": "STOP"}]})
+        else:
+            self._read_body()
+            self._send_json({"error": {"code": 404, "message": f"Unknown path {path}"}}, status=404)
+
+    # --- Tavily ---
+    def _tavily_search(self, body):
+        self._sleep("tavily")
+        query = body.get("query", "")
+        seed = hashlib.sha1(query.encode("utf-8")).hexdigest()[:10]
+        results = [{
+            "url": f"{self.server.base_url}/final/{seed}-{i}",
+            "title": f"Result {i} for {query}",
+            "content": _text(300, f"{seed}{i}"),
+            "score": round(1 - i * 0.05, 2),
+        } for i in range(int(body.get("max_results") or 5))]
+        self._send_json({"query": query, "results": results, "response_time": 0.1})
+
+    def _tavily_extract(self, body):
+        self._sleep("tavily")
+        results = [{"url": url, "raw_content": _text(self.server.page_chars, url)} for url in body.get("urls", [])]
+        self._send_json({"results": results, "failed_results": []})
+
+    # --- YouTube Data API ---
+    def _youtube_videos(self, query):
+        self._sleep("youtube")
+        video_id = (query.get("id") or [""])[0]
+        self._send_json({"items": [{"id": video_id, "snippet": {"title": f"Video {video_id}",
+                                                                "description": _text(500, video_id)}}]})
+
+    # --- Gemini file upload ---
+    def _upload_start(self):
+        self._read_body()
+        self._sleep("upload")
+        upload_id = next(self.server.counter)
+        self._send_json({}, headers={"X-Goog-Upload-Url": f"{self.server.base_url}/upload-session/{upload_id}",
+                                     "X-Goog-Upload-Status": "active"})
+
+    def _upload_finalize(self, upload_id):
+        data = self._read_body()
+        self._sleep("upload")
+        status = "final" if "finalize" in (self.headers.get("X-Goog-Upload-Command") or "") else "active"
+        expires = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=48)).isoformat()
+        file = {
+            "name": f"files/bench-{upload_id}",
+            "uri": f"{self.server.base_url}/v1beta/files/bench-{upload_id}",
+            "mimeType": "application/octet-stream",
+            "sizeBytes": str(len(data)),
+            "state": "ACTIVE",
+            "expirationTime": expires,
+        }
+        self._send_json({"file": file}, headers={"X-Goog-Upload-Status": status})
+
+    # --- Gemini streaming ---
+    def _stream_generate(self, body):
+        options = _directives(body)
+        if options.get("throttle") and self._throttle(body, options["throttle"]):
+            return
+        self._sleep("gemini")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        n_tools = options.get("tools", 0)
+        if n_tools and not _has_function_response(body):
+            parts = [{"functionCall": {"id": f"call-{i}", "name": "search_web_tavily",
+                                       "args": {"query": f"bench query {next(self.server.counter)}"}}}
+                     for i in range(n_tools)]
+            self._write_event({"candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP"}]})
+        else:
+            self._stream_text(options)
+        self._write_chunk(b"")
+
+    def _throttle(self, body, times):
+        key = json.dumps(body.get("contents", [])[-1:], sort_keys=True)
+        with self.server.lock:
+            attempt = self.server.throttle_counts.get(key, 0) + 1
+            self.server.throttle_counts[key] = attempt
+        if attempt > times:
+            return False
+        self._send_json({"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+                                   "status": "RESOURCE_EXHAUSTED"}}, status=429, headers={"Retry-After": "0"})
+        return True
+
+    def _stream_text(self, options):
+        chunks = options.get("chunks", 20)
+        chunk_chars = options.get("chunk_chars", 40)
+        citations = options.get("citations", 0)
+        nonce = next(self.server.counter)
+        chunk_delay = self.server.latency.get("gemini_chunk", 0)
+        for i in range(chunks):
+            if i and chunk_delay:
+                time.sleep(chunk_delay)
+            event = {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": _text(chunk_chars, i) + " "}]}}],
+                "usageMetadata": {"candidatesTokenCount": (i + 1) * max(1, chunk_chars // 4)},
+            }
+            if i == chunks - 1:
+                candidate = event["candidates"][0]
+                candidate["finishReason"] = "STOP"
+                if citations:
+                    candidate["groundingMetadata"] = {
+                        "groundingChunks": [{"web": {"uri": f"{self.server.base_url}/r/{nonce}-{c}",
+                                                     "title": f"Source {c}"}} for c in range(citations)],
+                        # 3/4 정도만 답변에서 사용된 것으로 표시
+                        "groundingSupports": [{"segment": {"startIndex": 0, "endIndex": 10},
+                                               "groundingChunkIndices": [c]}
+                                              for c in range(citations) if c % 4 != 3],
+                    }
+            self._write_event(event)
+
+    def _write_event(self, event):
+        self._write_chunk(("data: " + json.dumps(event) + "\r\n\r\n").encode("utf-8"))
+
+
+class FakeServices:
+    """백그라운드 스레드에서 실행되는 로컬 대체 서버. base_url을 각 클라이언트의 endpoint로 지정해 사용합니다."""
+
+    def __init__(self, latency=None, page_chars=8000, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.server.page_chars = page_chars
+        self.server.counter = itertools.count()
+        self.server.requests = 0
+        self.server.lock = threading.Lock()
+        self.server.throttle_counts = {}
+        self.server.base_url = f"http://{host}:{self.server.server_port}"
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return self.server.base_url
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeTranscriptApi:
+    """YouTubeTranscriptApi 대체: list() -> find_*_transcript() -> fetch().snippets"""
+
+    def __init__(self, latency=DEFAULT_LATENCY["transcript"], snippets=300):
+        self.latency = latency
+        self.snippets = snippets
+
+    def list(self, video_id):
+        time.sleep(self.latency * random.uniform(0.8, 1.2))
+        snippets = [SimpleNamespace(text=_text(60, f"{video_id}{i}"), start=i * 4.0, duration=4.0)
+                    for i in range(self.snippets)]
+        transcript = SimpleNamespace(fetch=lambda: SimpleNamespace(snippets=snippets))
+        return SimpleNamespace(find_manually_created_transcript=lambda languages: transcript,
+                               find_generated_transcript=lambda languages: transcript)
+
+
+class FakeUploadedFile:
+    """st.file_uploader가 돌려주는 UploadedFile과 같은 속성을 가진 객체"""
+
+    _ids = itertools.count()
+
+    def __init__(self, name, data, mime_type="text/plain"):
+        self.name = name
+        self.type = mime_type
+        self.size = len(data)
+        self.file_id = f"bench-{next(self._ids)}"
+        self._data = data
+
+    def getvalue(self):
+        return self._data
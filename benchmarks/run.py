@@ -0,0 +1,455 @@
+"""
+오프라인 성능 벤치마크.
+
+Streamlit 없이 UI 외부 경로(genai_stream_wrapper, 도구 함수, resolve_all_urls_async, save_session/load_session,
+process_files, 전체 턴)를 로컬 대체 서버(benchmarks/fakes.py)에 대해 실행하고 지연 시간 백분위수와 처리량을 보고합니다.
+
+    python -m benchmarks.run                       # 전체 실행
+    python -m benchmarks.run --quick --only turn   # 일부만 빠르게
+    python -m benchmarks.run --save-baseline main  # benchmarks/baselines/main.json 으로 저장
+    python -m benchmarks.run --compare main        # 기준과 비교 (p50이 threshold 이상 느려지면 exit code 1)
+
+세션/캐시 파일은 임시 디렉토리에 만들어지므로 실제 데이터에는 영향을 주지 않습니다.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import datetime
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(REPO_ROOT, "benchmarks", "baselines")
+MODEL = "gemini-2.5-flash"
+
+# 앱 모듈은 환경 변수를 설정한 뒤에 import (setup_environment 참고)
+ai = utils = st = None
+
+
+def setup_environment(fakes, workdir):
+    """대체 서버를 가리키도록 환경 변수를 설정한 뒤 앱 모듈을 import합니다."""
+    global ai, utils, st
+    os.chdir(workdir)
+    os.environ.update({
+        "GEMINI_API_KEY": "bench",
+        "TAVILY_API_KEY": "bench",
+        "YOUTUBE_DATA_API_KEY": "bench",
+        "GEMINI_BASE_URL": fakes.base_url,
+        "TAVILY_BASE_URL": fakes.base_url,
+        "YOUTUBE_API_ENDPOINT": fakes.base_url,
+        "DUMBLEXITY_CACHE_DIR": os.path.join(workdir, "cache"),
+        "METRICS_FILE": os.path.join(workdir, "metrics.prom"),
+    })
+    # 코드 자체의 지연 시간을 측정하므로 외부 API 요청 속도 제한은 끔 (직접 지정한 값은 유지)
+    for provider in ("GEMINI", "TAVILY", "YOUTUBE", "TRANSCRIPT", "RESOLVER"):
+        os.environ.setdefault(f"GOVERNOR_{provider}_RPS", "0")
+    sys.path.insert(0, REPO_ROOT)
+    import streamlit
+    import ai as ai_module
+    import utils as utils_module
+    from benchmarks.fakes import FakeTranscriptApi
+
+    ai, utils, st = ai_module, utils_module, streamlit
+    transcript_api = FakeTranscriptApi(latency=fakes.server.latency["transcript"])
+    ai.get_transcript_api = lambda: transcript_api
+
+
+# --- Synthetic data ---
+def synthetic_messages(count, citations=5):
+    messages = []
+    for i in range(count):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"Question {i}: how does component {i} work in detail?"})
+        else:
+            content = f"Answer {i}. " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 30
+            if citations:
+                content += "\n\n#### Web Citations\n" + "".join(
+                    f"{c + 1}. [Source {c}](https://example.com/{i}/{c})\n" for c in range(citations))
+            messages.append({"role": "assistant", "content": content})
+    return messages
+
+
+def synthetic_chunks(count, chunk_chars=40):
+    from google.genai import types
+    chunks = []
+    for i in range(count):
+        chunks.append(types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text="x" * chunk_chars)]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(candidates_token_count=(i + 1) * 10),
+        ))
+    return chunks
+
+
+# --- Benchmarks ---
+# 각 벤치마크는 (이름, 파라미터, 반복 1회를 실행하는 함수, 동시 실행 가능 여부)를 반환합니다.
+# 반복 함수는 추가 지표(dict)를 반환할 수 있습니다. (예: ttft_ms)
+_counter = itertools.count()
+
+
+def bench_turn(history, citations, tools=0, chunks=40, async_=False, throttle=0):
+    from history import HistoryManager
+    from citations import CitationEngine
+    from clients import run_async
+    from tracing import start_trace
+
+    client = ai.get_genai_client()
+    messages = synthetic_messages(history)
+
+    def _prepare():
+        sdk_history, _ = HistoryManager(client, budget=10 ** 9).build(messages)
+        return ai.generate_config(False, False, False, tavily_search=bool(tools), extraction=False), sdk_history
+
+    def op():
+        prompt = f"Question {next(_counter)} [bench chunks={chunks} citations={citations} tools={tools} throttle={throttle}]"
+        with start_trace(MODEL):
+            config, sdk_history = _prepare()
+            chat = client.chats.create(model=MODEL, config=config, history=sdk_history)
+            engine = CitationEngine()
+            started = time.perf_counter()
+            first_token = None
+            for _ in ai.genai_stream_wrapper(ai.run_tool_loop(chat, [prompt]), [], [], [], citation_engine=engine):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+            for _ in engine.sections():
+                pass
+        return {"ttft_ms": (first_token or 0) * 1000}
+
+    async def _async_turn(prompt, config, sdk_history):
+        chat = client.aio.chats.create(model=MODEL, config=config, history=sdk_history)
+        engine = CitationEngine()
+        started = time.perf_counter()
+        first_token = None
+        async for _ in ai.genai_stream_wrapper_async(ai.run_tool_loop_async(chat, [prompt]), [], [], [], citation_engine=engine):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+        async for _ in engine.sections_async():
+            pass
+        return first_token
+
+    def async_op():
+        prompt = f"Question {next(_counter)} [bench chunks={chunks} citations={citations} tools={tools} throttle={throttle}]"
+        with start_trace(MODEL):
+            config, sdk_history = _prepare()
+            first_token = run_async(_async_turn(prompt, config, sdk_history))
+        return {"ttft_ms": (first_token or 0) * 1000}
+
+    params = {"history": history, "citations": citations, "tools": tools}
+    if throttle:
+        params["throttle"] = throttle
+    if async_:
+        return "turn", {**params, "async": True}, async_op, True
+    return "turn", params, op, True
+
+def bench_stream_wrapper(chunks):
+    responses = synthetic_chunks(chunks)
+
+    def op():
+        for _ in ai.genai_stream_wrapper(iter(responses), [], [], []):
+            pass
+
+    return "stream_wrapper", {"chunks": chunks}, op, True
+
+
+def bench_search(cached, async_=False):
+    from clients import run_async
+
+    def op():
+        query = "cached query" if cached else f"search benchmark {next(_counter)}"
+        if async_:
+            run_async(ai.search_web_tavily_async(query))
+        else:
+            ai.search_web_tavily(query)
+
+    return "tool.search", {"cached": cached, **({"async": True} if async_ else {})}, op, True
+
+
+def bench_extract(urls, async_=False):
+    from clients import run_async
+
+    def op():
+        n = next(_counter)
+        page_urls = [f"https://example.com/page/{n}/{i}" for i in range(urls)]
+        if async_:
+            run_async(ai.extract_web_page_async(page_urls))
+        else:
+            ai.extract_web_page(page_urls)
+
+    return "tool.extract", {"urls": urls, **({"async": True} if async_ else {})}, op, True
+
+
+def bench_youtube(videos, async_=False):
+    from clients import run_async
+
+    def op():
+        n = next(_counter)
+        video_urls = [f"https://www.youtube.com/watch?v=b{n:06d}{i:04d}" for i in range(videos)]
+        if async_:
+            run_async(ai.extract_youtube_transcript_async(video_urls))
+        else:
+            ai.extract_youtube_transcript(video_urls)
+
+    return "tool.youtube", {"videos": videos, **({"async": True} if async_ else {})}, op, True
+
+
+def bench_resolve(urls, base_url):
+    from clients import run_async
+
+    def op():
+        n = next(_counter)
+        run_async(utils.resolve_all_urls_async([f"{base_url}/r/resolve{n}-{i}" for i in range(urls)]))
+
+    return "resolve_urls", {"urls": urls}, op, True
+
+
+def bench_save_session(messages, incremental):
+    base = synthetic_messages(messages)
+
+    def op():
+        name = f"bench-{messages}-{int(incremental)}"
+        if incremental:
+            if st.session_state.get("current_session_name") != name:
+                st.session_state.messages = list(base)
+                st.session_state.current_session_name = None
+                utils.save_session(name, silent=True)
+            st.session_state.messages += synthetic_messages(2)
+        else:
+            st.session_state.messages = list(base)
+            st.session_state.current_session_name = None
+        utils.save_session(name, silent=True)
+
+    return "save_session", {"messages": messages, "incremental": incremental}, op, False
+
+
+def bench_load_session(messages):
+    name = f"bench-load-{messages}"
+    st.session_state.messages = synthetic_messages(messages)
+    st.session_state.current_session_name = None
+    utils.save_session(name, silent=True)
+
+    def op():
+        utils.load_session(name)
+
+    return "load_session", {"messages": messages}, op, False
+
+
+def bench_process_files(files, size):
+    from benchmarks.fakes import FakeUploadedFile
+
+    def op():
+        n = next(_counter)
+        uploaded = [FakeUploadedFile(f"file{i}.txt", (f"{n}-{i}-".encode() * (size // 4 + 1))[:size]) for i in range(files)]
+        ai.process_files(uploaded)
+
+    return "process_files", {"files": files, "kb": size // 1024}, op, True
+
+
+def build_suite(quick, base_url):
+    suite = [
+        bench_stream_wrapper(200),
+        bench_stream_wrapper(2000),
+        bench_turn(history=0, citations=0),
+        bench_turn(history=20, citations=10),
+        bench_turn(history=100, citations=40),
+        bench_turn(history=20, citations=10, tools=3),
+        bench_turn(history=20, citations=10, async_=True),
+        bench_turn(history=20, citations=10, tools=3, async_=True),
+        bench_turn(history=20, citations=10, throttle=2),
+        bench_turn(history=20, citations=10, throttle=2, async_=True),
+        bench_search(cached=False),
+        bench_search(cached=False, async_=True),
+        bench_search(cached=True),
+        bench_extract(urls=5),
+        bench_extract(urls=20),
+        bench_extract(urls=20, async_=True),
+        bench_youtube(videos=1),
+        bench_youtube(videos=4),
+        bench_youtube(videos=4, async_=True),
+        bench_resolve(10, base_url),
+        bench_resolve(50, base_url),
+        bench_save_session(20, incremental=False),
+        bench_save_session(200, incremental=False),
+        bench_save_session(200, incremental=True),
+        bench_load_session(20),
+        bench_load_session(200),
+        bench_process_files(files=4, size=64 * 1024),
+        bench_process_files(files=2, size=3 * 1024 * 1024),
+    ]
+    if quick:
+        quick_keys = {("turn", 20), ("stream_wrapper", 200), ("resolve_urls", 10), ("save_session", 20),
+                      ("load_session", 200), ("process_files", 4)}
+        suite = [b for b in suite if b[0].startswith("tool.") or (b[0], next(iter(b[1].values()))) in quick_keys]
+    return suite
+
+
+# --- Runner ---
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1],
+    }
+
+
+def run_benchmark(op, iterations, concurrency, warmup=1):
+    for _ in range(warmup):
+        op()
+
+    latencies = []
+    extras = {}
+
+    def timed():
+        started = time.perf_counter()
+        extra = op() or {}
+        return (time.perf_counter() - started) * 1000, extra
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda _: timed(), range(iterations)))
+    else:
+        results = [timed() for _ in range(iterations)]
+    wall = time.perf_counter() - started
+
+    for latency, extra in results:
+        latencies.append(latency)
+        for k, v in extra.items():
+            extras.setdefault(k, []).append(v)
+    result = {"n": iterations, "throughput": iterations / wall, **summarize(latencies)}
+    for k, values in extras.items():
+        result[k] = summarize(values)["p50"]
+    return result
+
+
+def result_key(name, params):
+    return f"{name}[{','.join(f'{k}={v}' for k, v in params.items())}]"
+
+
+def print_results(results):
+    print(f"\n{'benchmark':<64} {'n':>4} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'ops/s':>8}  extra")
+    for key, r in results.items():
+        extra = "  ".join(f"{k}={v:.1f}" for k, v in r.items()
+                          if k not in ("n", "throughput", "mean", "p50", "p95", "p99", "max"))
+        print(f"{key:<64} {r['n']:>4} {r['mean']:>9.1f} {r['p50']:>9.1f} {r['p95']:>9.1f} {r['p99']:>9.1f} "
+              f"{r['throughput']:>8.1f}  {extra}")
+    print("(latencies in ms)")
+
+
+def print_stage_metrics():
+    """전체 턴 벤치마크에서 tracing으로 수집된 단계별 백분위수"""
+    from tracing import METRICS
+    series = METRICS.snapshot().get("dumblexity_stage_duration_seconds", [])
+    if not series:
+        return
+    print(f"\n{'stage':<28} {'model':<20} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for labels, summary in series:
+        print(f"{labels['stage']:<28} {labels['model']:<20} {summary['count']:>6} {summary[0.5] * 1000:>9.1f} "
+              f"{summary[0.95] * 1000:>9.1f} {summary[0.99] * 1000:>9.1f}")
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, results, meta):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(baseline_path(name), "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"\nSaved baseline to {baseline_path(name)}")
+
+
+def compare_baseline(name, results, threshold, min_delta_ms):
+    """p50이 기준보다 threshold 비율 이상, min_delta_ms 이상 느려진 벤치마크 수를 반환합니다."""
+    with open(baseline_path(name), "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = 0
+    print(f"\nComparison with baseline '{name}' (threshold {threshold:.0%}):")
+    print(f"{'benchmark':<64} {'base p50':>9} {'p50':>9} {'Δp50':>8} {'Δp95':>8} {'Δops/s':>8}")
+    for key, r in results.items():
+        base = baseline.get(key)
+        if not base:
+            print(f"{key:<64} {'(new)':>9}")
+            continue
+        d50 = r["p50"] / base["p50"] - 1 if base["p50"] else 0.0
+        d95 = r["p95"] / base["p95"] - 1 if base["p95"] else 0.0
+        dtp = r["throughput"] / base["throughput"] - 1 if base["throughput"] else 0.0
+        flag = ""
+        if d50 > threshold and r["p50"] - base["p50"] >= min_delta_ms:
+            regressions += 1
+            flag = "  ⚠️ regression"
+        print(f"{key:<64} {base['p50']:>9.1f} {r['p50']:>9.1f} {d50:>+8.1%} {d95:>+8.1%} {dtp:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for Dumblexity's non-UI code paths.")
+    parser.add_argument("--quick", action="store_true", help="run a smaller subset with fewer iterations")
+    parser.add_argument("--iterations", type=int, default=None, help="iterations per benchmark (default 20, quick 5)")
+    parser.add_argument("--concurrency", type=int, default=1, help="concurrent iterations for thread-safe benchmarks")
+    parser.add_argument("--only", action="append", default=[], help="run benchmarks whose name contains this text")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiply fake service latencies (0 measures pure client-side overhead)")
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50 slowdown before flagging (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore slowdowns smaller than this many milliseconds (timer noise)")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+    if args.compare and not os.path.exists(baseline_path(args.compare)):
+        parser.error(f"baseline not found: {baseline_path(args.compare)}")
+
+    from benchmarks.fakes import FakeServices, DEFAULT_LATENCY
+
+    latency = {k: v * args.latency_scale for k, v in DEFAULT_LATENCY.items()}
+    fakes = FakeServices(latency=latency).start()
+    workdir = tempfile.mkdtemp(prefix="dumblexity-bench-")
+    output = os.path.abspath(args.output) if args.output else None
+    setup_environment(fakes, workdir)
+
+    iterations = args.iterations or (5 if args.quick else 20)
+    results = {}
+    for name, params, op, concurrent in build_suite(args.quick, fakes.base_url):
+        key = result_key(name, params)
+        if args.only and not any(o in name for o in args.only):
+            continue
+        print(f"Running {key}...", flush=True)
+        results[key] = run_benchmark(op, iterations, args.concurrency if concurrent else 1)
+
+    print_results(results)
+    print_stage_metrics()
+
+    meta = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": iterations,
+        "concurrency": args.concurrency,
+        "latency": latency,
+        "session_backend": os.getenv("SESSION_BACKEND", "sqlite"),
+        "fake_requests": fakes.requests,
+    }
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results, meta)
+    regressions = compare_baseline(args.compare, results, args.threshold, args.min_delta_ms) if args.compare else 0
+    fakes.stop()
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
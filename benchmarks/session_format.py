@@ -0,0 +1,113 @@
+"""
+세션 저장 형식 비교: 이전 indent=2 JSON 파일 vs packed(.pack) vs sqlite.
+
+    python -m benchmarks.session_format                    # 200 / 2000 메시지 세션
+    python -m benchmarks.session_format --messages 5000 --repeat 5
+
+파일 크기와 전체 로드 시간, 세션 열기(최근 SESSION_TAIL_MESSAGES개만 디코딩) 시간을 비교합니다.
+세션 파일은 임시 디렉토리에 만들어집니다.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def realistic_messages(count, seed=0):
+    """실제 답변과 비슷하게 문장, 코드 블록, 인용 목록이 섞인 메시지 (같은 문장이 반복되지 않도록 무작위 단어 사용)"""
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10))) for _ in range(3000)]
+    domains = [f"{rng.choice(vocabulary)}.{rng.choice(['com', 'org', 'io', 'dev', 'net'])}" for _ in range(200)]
+
+    def sentence():
+        return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(6, 20))).capitalize() + "."
+
+    messages = []
+    for i in range(count):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": " ".join(sentence() for _ in range(rng.randint(1, 3)))})
+            continue
+        paragraphs = [" ".join(sentence() for _ in range(rng.randint(3, 8))) for _ in range(rng.randint(2, 6))]
+        if rng.random() < 0.3:
+            paragraphs.append("```python\n" + "\n".join(f"{rng.choice(vocabulary)} = {rng.randint(0, 999)}" for _ in range(8)) + "\n```")
+        citations = "".join(
+            f"{c + 1}. [{sentence()[:60]}](https://{rng.choice(domains)}/{rng.choice(vocabulary)}/{rng.randint(1, 10**6)})\n"
+            for c in range(rng.randint(3, 12)))
+        messages.append({"role": "assistant", "content": "\n\n".join(paragraphs) + "\n\n#### Web Citations\n" + citations})
+    return messages
+
+
+def _best(fn, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return min(durations), statistics.median(durations)
+
+
+def compare(count, repeat, workdir):
+    import session_store
+
+    messages = realistic_messages(count)
+    name = f"session-{count}"
+    rows = []
+
+    legacy_path = os.path.join(workdir, f"{name}.json")
+    with open(legacy_path, "w", encoding="utf-8") as f:
+        json.dump(messages, f, ensure_ascii=False, indent=2)
+
+    def _load_legacy():
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    legacy_load = _best(_load_legacy, repeat)
+    rows.append(("json (indent=2)", os.path.getsize(legacy_path), legacy_load, legacy_load))
+
+    for label, backend, size in (
+        ("packed", session_store.PackedSessionBackend(os.path.join(workdir, "packed")), None),
+        ("sqlite", session_store.SqliteSessionBackend(os.path.join(workdir, "sqlite")), None),
+    ):
+        backend.replace(name, messages)
+        assert backend.load(name) == messages
+        if label == "packed":
+            size = os.path.getsize(backend._path(name))
+        else:
+            # WAL을 DB 파일에 반영한 뒤 크기 측정 (메시지 테이블 + FTS 색인 포함)
+            backend._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            size = os.path.getsize(backend.db_path)
+        full = _best(lambda: backend.load(name), repeat)
+        paged = _best(lambda: backend.load_paged(name)[-1], repeat)
+        rows.append((label, size, full, paged))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare session file size and load time across storage formats.")
+    parser.add_argument("--messages", type=int, nargs="+", default=[200, 2000])
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_ROOT)
+    with tempfile.TemporaryDirectory(prefix="dumblexity-sessions-") as workdir:
+        for sub in ("packed", "sqlite"):
+            os.makedirs(os.path.join(workdir, sub))
+        # session_store는 import 시 작업 디렉토리에 sessions/를 만들므로 임시 디렉토리에서 import
+        os.chdir(workdir)
+        print(f"{'messages':>8}  {'format':<16} {'size':>12} {'ratio':>7} {'full load (ms)':>15} {'open (ms)':>10}")
+        for count in args.messages:
+            rows = compare(count, args.repeat, workdir)
+            legacy_size = rows[0][1]
+            for label, size, full, paged in rows:
+                print(f"{count:>8}  {label:<16} {size:>12,} {size / legacy_size:>6.0%} {full[1] * 1000:>15.2f} {paged[1] * 1000:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# 캐시 파일을 저장할 디렉토리 (세션과 마찬가지로 볼륨으로 마운트하면 재시작 후에도 유지됨)
+CACHE_DIR = os.getenv("DUMBLEXITY_CACHE_DIR", "cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+
+class TTLCache:
+    """
+    TTL + LRU 방식의 thread-safe 캐시.
+    persist_path를 지정하면 JSON 파일로 저장하고, 생성 시 다시 읽어옵니다.
+    (persist를 사용할 경우 key는 문자열, value는 JSON 직렬화 가능해야 합니다.)
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, persist_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.RLock()
+        self._dirty = False
+        if persist_path:
+            self._load()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self._dirty = True
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._dirty = True
+
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._dirty = True
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and (item[1] is None or item[1] > time.time())
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3),
+        }
+
+    def save(self):
+        """변경 사항이 있을 때만 파일에 원자적으로(tmp 파일 + rename) 저장합니다."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            payload = [[k, v, exp] for k, (v, exp) in self._data.items() if exp is None or exp > now]
+            self._dirty = False
+        tmp_path = f"{self.persist_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            print(f"Failed to persist cache {self.persist_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except Exception as e:
+            print(f"Failed to load cache {self.persist_path}: {e}")
+            return
+        now = time.time()
+        for key, value, expires_at in payload[-self.maxsize:]:
+            if expires_at is None or expires_at > now:
+                self._data[key] = (value, expires_at)
+
+
+class ContentStore:
+    """
+    크기(byte) 기준으로 제한되는 문자열 콘텐츠 저장소 (LRU + TTL).
+    spill_dir를 지정하면 메모리에서 밀려난 항목을 디스크에 저장해 두었다가 다시 읽어옵니다.
+    write_through=True이면 저장 즉시 디스크에도 기록해 재시작 후에도 유지됩니다.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=24 * 3600, spill_dir=None, max_spill_bytes=512 * 1024 * 1024,
+                 write_through=False):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.write_through = write_through
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (content, expires_at)
+        self._bytes = 0
+        self._spills_since_prune = 0
+        self._lock = threading.RLock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                self._remove(key)
+        item = self._read_spill(key)
+        if item is not None:
+            with self._lock:
+                self.hits += 1
+                self._put(key, *item)
+            return item[0]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, content, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put(key, content, expires_at)
+        if self.write_through:
+            self._write_spill(key, content, expires_at)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def _put(self, key, content, expires_at):
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (content, expires_at)
+        self._bytes += len(content)
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._data) > 1:
+            old_key, (old_content, old_expires_at) = self._data.popitem(last=False)
+            self._bytes -= len(old_content)
+            evicted.append((old_key, old_content, old_expires_at))
+        if not self.write_through:
+            for item in evicted:
+                self._write_spill(*item)
+
+    def _remove(self, key):
+        content, _ = self._data.pop(key)
+        self._bytes -= len(content)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _write_spill(self, key, content, expires_at):
+        if not self.spill_dir:
+            return
+        path = self._spill_path(key)
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"key": key, "content": content, "expires_at": expires_at}, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            print(f"Failed to spill cache entry: {e}")
+            return
+        self._spills_since_prune += 1
+        if self._spills_since_prune >= 100:
+            self._spills_since_prune = 0
+            self._prune_spill()
+
+    def _read_spill(self, key):
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if item.get("key") != key or item["expires_at"] <= time.time():
+            return None
+        return item["content"], item["expires_at"]
+
+    def _prune_spill(self):
+        """디스크 사용량이 max_spill_bytes를 넘으면 오래된 파일부터 삭제합니다."""
+        try:
+            entries = [e for e in os.scandir(self.spill_dir) if e.name.endswith(".json")]
+            stats = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_spill_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+class SingleFlight:
+    """
+    같은 key에 대한 동시 호출을 하나의 실행으로 합칩니다. (먼저 들어온 호출만 실제로 실행하고, 나머지는 그 결과를 공유)
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        return future, leader
+
+    def do(self, key, fn, *args, **kwargs):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """
+        do()의 코루틴 버전 (fn은 코루틴 함수). 동기 호출과 같은 key 공간을 사용하므로 스레드와 이벤트 루프의 호출도 하나로 합쳐집니다.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            # 기다리던 쪽이 취소되어도 공유 Future(다른 호출자의 결과)는 취소하지 않음
+            return await asyncio.shield(asyncio.wrap_future(future))
+        try:
+            result = await fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,174 @@
+import os
+import json
+import asyncio
+
+from clients import submit_async
+from utils import resolve_url_async, save_url_cache, dedupe_resolved, canonicalize_url
+
+# 리디렉션 해석 동시 실행 수 (프로세스 전체)
+CITATION_RESOLVE_CONCURRENCY = int(os.getenv("CITATION_RESOLVE_CONCURRENCY", 16))
+CITATION_RESOLVE_TIMEOUT = float(os.getenv("CITATION_RESOLVE_TIMEOUT", 15))
+
+_resolve_semaphore = None
+
+
+async def _resolve_bounded(url):
+    global _resolve_semaphore
+    if _resolve_semaphore is None:
+        _resolve_semaphore = asyncio.Semaphore(CITATION_RESOLVE_CONCURRENCY)
+    async with _resolve_semaphore:
+        return await resolve_url_async(url)
+
+
+def _function_response_urls(content):
+    """함수 호출 결과(Tavily 검색/추출, YouTube 자막)에서 (url, title) 목록을 추출합니다."""
+    urls = []
+    for part in content.parts or []:
+        func_response = part.function_response
+        if not func_response:
+            continue
+        response = func_response.response
+        output = response.get("result", response) if response else None
+        if isinstance(output, str):
+            try:
+                output = json.loads(output)
+            except json.JSONDecodeError:
+                pass
+        if isinstance(output, dict) and 'results' in output:
+            for res in output['results']:
+                if res.get("url"):
+                    urls.append((res["url"], res.get("title", "Untitled")))
+        elif output and isinstance(output, list) and isinstance(output[0], dict) and 'url' in output[0]:
+            for res in output:
+                if res.get("url"):
+                    urls.append((res["url"], res.get("title", res["url"])))
+    return urls
+
+
+class CitationEngine:
+    """
+    스트리밍 도중 genai_stream_wrapper로부터 citation/grounding 메타데이터와 함수 호출 결과를 받아
+    인용 섹션을 구성합니다. 리디렉션 URL은 모든 섹션에 걸쳐 한 번씩만, 도착하는 즉시 공유 이벤트 루프에서
+    (동시 실행 수를 제한하며) 해석을 시작하므로 답변이 끝날 때쯤에는 대부분 해석이 끝나 있습니다.
+    """
+
+    def __init__(self):
+        self.citations = {}
+        self.used_web = {}
+        self.unused_web = {}
+        self.used_map = {}
+        self.unused_map = {}
+        self.function_results = {}
+        self._futures = {}
+
+    def _resolve(self, uri):
+        if uri not in self._futures:
+            self._futures[uri] = submit_async(_resolve_bounded(uri))
+
+    def add_citation_metadata(self, citation_metadata):
+        for citation in citation_metadata.citations or []:
+            if citation.uri:
+                self.citations[citation.uri] = citation.title or "Untitled"
+                self._resolve(citation.uri)
+
+    def add_grounding_metadata(self, metadata):
+        chunks = metadata.grounding_chunks or []
+        supports = metadata.grounding_supports or []
+        used_chunk_indices = set()
+        for support in supports:
+            used_chunk_indices.update(support.grounding_chunk_indices or [])
+        for i, chunk in enumerate(chunks):
+            if chunk.web and chunk.web.uri:
+                target = self.used_web if i in used_chunk_indices else self.unused_web
+                target[chunk.web.uri] = chunk.web.title or "Untitled"
+                self._resolve(chunk.web.uri)
+            if chunk.maps and chunk.maps.uri:
+                target = self.used_map if i in used_chunk_indices else self.unused_map
+                target[chunk.maps.uri] = chunk.maps.title or "Untitled"
+
+    def add_function_history(self, contents):
+        for content in contents:
+            for uri, title in _function_response_urls(content):
+                self.function_results[uri] = title
+
+    def _resolved_entries(self, chunks, timeout):
+        entries = []
+        for uri, title in chunks.items():
+            try:
+                resolved_uri = self._futures[uri].result(timeout)
+            except Exception:
+                resolved_uri = uri
+            entries.append((resolved_uri, title))
+        # 서로 다른 리디렉션 URL이 같은 페이지로 해석되면 하나만 표시
+        return dedupe_resolved(entries)
+
+    async def _resolved_entries_async(self, chunks, timeout):
+        async def _result(uri):
+            try:
+                # 공유 Future는 취소하지 않고 기다리기만 함
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._futures[uri])), timeout)
+            except Exception:
+                return uri
+        resolved = await asyncio.gather(*[_result(uri) for uri in chunks])
+        return dedupe_resolved(list(zip(resolved, chunks.values())))
+
+    def _plan(self):
+        unused_web = {uri: title for uri, title in self.unused_web.items() if uri not in self.used_web}
+        unused_map = {uri: title for uri, title in self.unused_map.items() if uri not in self.used_map}
+        return [
+            ("Citations", self.citations, True),
+            ("Web Citations", self.used_web, True),
+            ("Web Citations (not used)", unused_web, True),
+            ("Map Citations", self.used_map, False),
+            ("Map Citations (not used)", unused_map, False),
+            ("Function Call Citations", self.function_results, False),
+        ]
+
+    @staticmethod
+    def _section_text(header, entries, shown_web):
+        if header == "Web Citations (not used)":
+            # 사용된 인용과 같은 페이지로 해석된 항목은 제외
+            entries = [(uri, title) for uri, title in entries if canonicalize_url(uri) not in shown_web]
+            if not entries:
+                return None
+        elif header == "Web Citations":
+            shown_web.update(canonicalize_url(uri) for uri, _ in entries)
+        text = f"\n\n#### {header}\n"
+        for i, (uri, title) in enumerate(entries):
+            text += f"{i+1}. [{title}]({uri})\n"
+        return text
+
+    def _finish(self):
+        if self._futures:
+            save_url_cache()
+
+    def sections(self, timeout=CITATION_RESOLVE_TIMEOUT):
+        """
+        (제목, 마크다운) 섹션을 준비되는 순서대로 생성합니다.
+        """
+        shown_web = set()
+        try:
+            for header, chunks, resolve in self._plan():
+                if not chunks:
+                    continue
+                entries = self._resolved_entries(chunks, timeout) if resolve else list(chunks.items())
+                text = self._section_text(header, entries, shown_web)
+                if text:
+                    yield header, text
+        finally:
+            self._finish()
+
+    async def sections_async(self, timeout=CITATION_RESOLVE_TIMEOUT):
+        """sections()의 비동기 버전 (공유 이벤트 루프를 막지 않고 해석 결과를 기다림)"""
+        shown_web = set()
+        try:
+            for header, chunks, resolve in self._plan():
+                if not chunks:
+                    continue
+                entries = await self._resolved_entries_async(chunks, timeout) if resolve else list(chunks.items())
+                text = self._section_text(header, entries, shown_web)
+                if text:
+                    yield header, text
+        finally:
+            # URL 캐시 파일 저장은 이벤트 루프 밖에서
+            await asyncio.to_thread(self._finish)
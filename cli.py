@@ -0,0 +1,96 @@
+"""
+터미널에서 ChatEngine을 사용하는 CLI.
+
+    python cli.py "질문"                              # 한 번 질문하고 종료
+    python cli.py --session notes --search external  # 대화형 (세션에 자동 저장)
+    python cli.py --file report.pdf "요약해줘"
+    python cli.py --json "질문"                       # 이벤트를 JSON Lines로 출력
+"""
+import sys
+import json
+import argparse
+
+from ai import available_models
+from engine import ChatEngine, LocalFile, tool_options, SEARCH_MODES
+from history import HISTORY_TOKEN_BUDGET
+from session_store import get_session_backend, sanitize_session_name
+
+
+def run_turn(engine, prompt, files, as_json=False, show_citations=True):
+    for event in engine.ask(prompt, files=files):
+        if as_json:
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+        elif event["type"] == "text":
+            sys.stdout.write(event["text"])
+            sys.stdout.flush()
+        elif event["type"] == "tool_call":
+            print(f"\n[tools] {', '.join(c['name'] for c in event['calls'])}", file=sys.stderr, flush=True)
+        elif event["type"] == "throttle":
+            print(f"\n[rate limited] {event['provider']}: retrying in {event['delay']:.1f}s", file=sys.stderr, flush=True)
+        elif event["type"] == "upload" and event["name"]:
+            print(f"[upload] {event['name']} ({event['done']}/{event['total']})", file=sys.stderr, flush=True)
+        elif event["type"] == "citations" and show_citations:
+            sys.stdout.write(event["text"])
+        elif event["type"] == "done":
+            sys.stdout.write("\n")
+            print(f"[{event['trace']['duration']:.1f}s]", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ask Dumblexity from the terminal.")
+    parser.add_argument("prompt", nargs="?", help="question to ask (omit for an interactive session)")
+    parser.add_argument("--model", default=available_models[0], choices=available_models)
+    parser.add_argument("--search", default="google", choices=sorted(SEARCH_MODES), help="search mode / tools")
+    parser.add_argument("--temperature", type=float, default=0.2)
+    parser.add_argument("--session", help="load this saved session and auto-save to it")
+    parser.add_argument("--file", action="append", default=[], help="attach a local file (repeatable)")
+    parser.add_argument("--history-budget", type=int, default=HISTORY_TOKEN_BUDGET)
+    parser.add_argument("--context-cache", action="store_true", help="use explicit context caching")
+    parser.add_argument("--location", nargs=2, type=float, metavar=("LAT", "LNG"), help="location for map search")
+    parser.add_argument("--json", action="store_true", help="print raw events as JSON lines")
+    parser.add_argument("--no-citations", action="store_true")
+    args = parser.parse_args(argv)
+
+    engine = ChatEngine(
+        model=args.model,
+        temperature=args.temperature,
+        options=tool_options(args.search),
+        history_budget=args.history_budget,
+        use_context_cache=args.context_cache,
+        location={"latitude": args.location[0], "longitude": args.location[1]} if args.location else {},
+    )
+    session_name = sanitize_session_name(args.session)
+    if session_name:
+        if get_session_backend().exists(session_name):
+            engine.load(session_name)
+            print(f"Loaded session '{session_name}' ({len(engine.messages)} messages).", file=sys.stderr)
+        else:
+            engine.state["current_session_name"] = session_name
+
+    files = [LocalFile(path) for path in args.file]
+    if args.prompt:
+        run_turn(engine, args.prompt, files, args.json, not args.no_citations)
+        return 0
+
+    # 대화형: 첨부 파일은 첫 질문에만 함께 보냄
+    while True:
+        try:
+            prompt = input("\n> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return 0
+        if not prompt:
+            continue
+        if prompt in ("/exit", "/quit"):
+            return 0
+        try:
+            run_turn(engine, prompt, files, args.json, not args.no_citations)
+        except KeyboardInterrupt:
+            print("\n[interrupted]", file=sys.stderr)
+        except Exception as e:
+            print(f"\nError: {e}", file=sys.stderr)
+        files = []
+
+
+if __name__ == "__main__":
+    sys.exit(main())
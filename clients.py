@@ -0,0 +1,237 @@
+import os
+import queue
+import atexit
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import lru_cache
+
+import httpx
+
+# genai, tavily, youtube_transcript_api, googleapiclient는 가져오는 데 오래 걸리므로(합계 약 2초)
+# 첫 화면 렌더링을 늦추지 않도록 각 클라이언트를 처음 만들 때 가져옵니다. (startup.py로 측정)
+
+YOUTUBE_DATA_API_KEY = os.getenv("YOUTUBE_DATA_API_KEY")
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+# GEMINI_API_KEY is used internally by genai library so need to set in env variable
+# 로컬 테스트용 모델 API 대체 서버 등을 사용할 때 지정 (기본값: Google 엔드포인트)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+available_models = ["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.5-flash-lite", "gemini-2.5-flash-preview-09-2025", "gemini-2.5-flash-lite-preview-09-2025",  "gemini-2.0-flash"]
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+YOUTUBE_API_ENDPOINT = os.getenv("YOUTUBE_API_ENDPOINT")
+# 비동기 경로에서 YouTube Data API를 직접 호출할 때 사용하는 주소 (googleapiclient의 기본 rootUrl과 같음)
+YOUTUBE_API_BASE_URL = (YOUTUBE_API_ENDPOINT or "https://youtube.googleapis.com").rstrip("/")
+
+# 커넥션 풀 크기 설정
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+TAVILY_POOL_SIZE = int(os.getenv("TAVILY_POOL_SIZE", 10))
+YOUTUBE_POOL_SIZE = int(os.getenv("YOUTUBE_POOL_SIZE", 4))
+
+
+def _http_limits():
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS)
+
+
+def _pooled_session(pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# --- Shared event loop ---
+# 모든 비동기 작업(httpx 등)은 프로세스 전체에서 하나의 백그라운드 이벤트 루프에서 실행됩니다.
+# (asyncio.run()처럼 매번 루프를 새로 만들면 keep-alive 커넥션을 재사용할 수 없음)
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="dumblexity-event-loop", daemon=True).start()
+        return _loop
+
+
+def is_shared_loop_running():
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+
+async def _run_in_context(coro, context):
+    return await asyncio.get_running_loop().create_task(coro, context=context)
+
+
+def submit_async(coro):
+    """
+    공유 이벤트 루프에 코루틴을 예약하고 concurrent.futures.Future를 반환합니다.
+    호출한 스레드의 contextvars(현재 Trace 등)가 코루틴에도 전달됩니다.
+    """
+    return asyncio.run_coroutine_threadsafe(_run_in_context(coro, contextvars.copy_context()), get_event_loop())
+
+
+def run_async(coro, timeout=None):
+    """동기 코드(Streamlit 스크립트 등)에서 코루틴을 공유 이벤트 루프에서 실행하고 결과를 기다립니다."""
+    return submit_async(coro).result(timeout)
+
+
+# --- Clients ---
+_async_http_client = None
+
+
+def get_async_http_client():
+    """
+    공유 이벤트 루프 전용 httpx.AsyncClient (keep-alive 커넥션 풀).
+    반드시 공유 이벤트 루프 안에서만 사용해야 합니다.
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = httpx.AsyncClient(limits=_http_limits())
+    return _async_http_client
+
+
+@lru_cache(maxsize=1)
+def get_genai_client():
+    from google import genai
+    from google.genai import types
+
+    http_options = types.HttpOptions(
+        base_url=GEMINI_BASE_URL,
+        client_args={"limits": _http_limits()},
+        async_client_args={"limits": _http_limits()},
+    )
+    return genai.Client(http_options=http_options)
+
+
+@lru_cache(maxsize=1)
+def get_tavily_client():
+    from tavily_clients import PooledTavilyClient
+    return PooledTavilyClient(TAVILY_API_KEY, base_url=TAVILY_BASE_URL)
+
+
+@lru_cache(maxsize=1)
+def get_async_tavily_client():
+    from tavily_clients import PooledAsyncTavilyClient
+    return PooledAsyncTavilyClient(TAVILY_API_KEY, base_url=TAVILY_BASE_URL)
+
+
+@lru_cache(maxsize=1)
+def get_transcript_api():
+    from youtube_transcript_api import YouTubeTranscriptApi
+
+    return YouTubeTranscriptApi(http_client=_pooled_session(YOUTUBE_POOL_SIZE))
+
+
+def _build_youtube_client():
+    from googleapiclient.discovery import build
+
+    # static_discovery: 패키지에 포함된 discovery 문서를 사용 (네트워크 요청 없음)
+    client_options = {"api_endpoint": YOUTUBE_API_ENDPOINT} if YOUTUBE_API_ENDPOINT else None
+    return build('youtube', 'v3', developerKey=YOUTUBE_DATA_API_KEY, cache_discovery=False, static_discovery=True,
+                 client_options=client_options)
+
+
+# googleapiclient(httplib2)는 thread-safe하지 않으므로 스레드별로 빌려 쓰는 풀을 사용합니다.
+_youtube_pool = queue.LifoQueue(maxsize=YOUTUBE_POOL_SIZE)
+_youtube_created = 0
+_youtube_lock = threading.Lock()
+
+
+@contextmanager
+def youtube_client():
+    """YouTube Data API 클라이언트를 풀에서 빌려옵니다. (풀이 비어있고 여유가 있으면 새로 생성)"""
+    global _youtube_created
+    try:
+        client = _youtube_pool.get_nowait()
+    except queue.Empty:
+        with _youtube_lock:
+            create = _youtube_created < YOUTUBE_POOL_SIZE
+            if create:
+                _youtube_created += 1
+        if create:
+            try:
+                client = _build_youtube_client()
+            except BaseException:
+                # 생성에 실패한 자리는 반환해서 다음 호출이 다시 생성할 수 있도록 함 (반환하지 않으면 풀이 영원히 빔)
+                with _youtube_lock:
+                    _youtube_created -= 1
+                raise
+        else:
+            client = _youtube_pool.get()
+    try:
+        yield client
+    finally:
+        _youtube_pool.put(client)
+
+
+async def _close_async_clients():
+    if get_genai_client.cache_info().currsize:
+        await get_genai_client().aio.aclose()
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+
+
+@atexit.register
+def _shutdown_event_loop():
+    # 종료 시 공유 이벤트 루프의 aiohttp/httpx 세션을 닫음 (닫지 않으면 "Unclosed client session" 경고)
+    if _loop is None or not _loop.is_running():
+        return
+    try:
+        run_async(_close_async_clients(), timeout=5)
+    except Exception:
+        pass
+
+
+def warm_up_clients():
+    """
+    시작 시 모델 클라이언트를 미리 생성해 첫 질문에서 SDK 로딩, 풀 생성 비용을 치르지 않도록 합니다.
+    클라이언트 객체만 만들고 커넥션은 열지 않으므로 TCP/TLS 연결은 첫 요청에서 맺어집니다.
+    """
+    get_event_loop()
+    get_genai_client()
+    run_async(_warm_up_async_http_client())
+    print("Clients warmed up.")
+
+
+def warm_up_tool_clients():
+    """
+    외부 검색 도구(Tavily, YouTube) 클라이언트를 미리 생성합니다. (discovery 문서 로딩, 풀 생성; 커넥션은 첫 요청에서 맺음)
+    해당 모드를 처음 선택했을 때만 호출되므로, 사용하지 않으면 패키지도 로드되지 않습니다.
+    """
+    get_transcript_api()
+    if TAVILY_API_KEY:
+        get_tavily_client()
+        get_async_tavily_client()
+    if YOUTUBE_DATA_API_KEY:
+        with youtube_client():
+            pass
+    print("Tool clients warmed up.")
+
+
+async def _warm_up_async_http_client():
+    get_async_http_client()
+
+
+def warm_up_clients_in_background():
+    threading.Thread(target=_safe_warm_up, args=(warm_up_clients,), name="dumblexity-warm-up", daemon=True).start()
+
+
+def warm_up_tool_clients_in_background():
+    threading.Thread(target=_safe_warm_up, args=(warm_up_tool_clients,), name="dumblexity-tool-warm-up", daemon=True).start()
+
+
+def _safe_warm_up(warm_up):
+    try:
+        warm_up()
+    except Exception as e:
+        print(f"Failed to warm up clients: {e}")
@@ -0,0 +1,144 @@
+import os
+import time
+import hashlib
+import threading
+
+from google.genai import types
+
+from history import estimate_tokens
+
+# 명시적 컨텍스트 캐시 설정
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", 600))
+# 모델별 최소 캐시 토큰 수보다 작으면 캐시를 만들지 않음
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 4096))
+# 캐시 이후 새로 쌓인 history가 이만큼 커지면 캐시를 다시 만듦
+CONTEXT_CACHE_REFRESH_TOKENS = int(os.getenv("CONTEXT_CACHE_REFRESH_TOKENS", 8192))
+# 만료까지 남은 시간이 이보다 짧으면 새로 만듦
+_EXPIRY_MARGIN = 60
+
+
+def _content_digest(contents):
+    digest = hashlib.sha1()
+    for content in contents:
+        digest.update((content.role or "").encode("utf-8"))
+        for part in content.parts or []:
+            digest.update((part.text or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _file_identity(part):
+    if isinstance(part, types.File):
+        return part.name or part.uri
+    if part.inline_data is not None:
+        return hashlib.sha1(part.inline_data.data).hexdigest()
+    return part.text or ""
+
+
+def _file_part(file):
+    if isinstance(file, types.File):
+        return types.Part.from_uri(file_uri=file.uri, mime_type=file.mime_type)
+    return file
+
+
+class ContextCacheManager:
+    """
+    system instruction, 이전 history, 업로드 파일로 이루어진 안정적인 prefix를 cached content로 만들어 재사용합니다.
+    캐시 정보는 state(dict, 보통 st.session_state의 일부)에 저장되며, 대화가 충분히 길어지면 새로 만들고
+    만료가 가까워지거나 prefix가 바뀌면(다른 세션, 설정 변경) 교체합니다.
+    """
+
+    def __init__(self, client, state, ttl=CONTEXT_CACHE_TTL, min_tokens=CONTEXT_CACHE_MIN_TOKENS,
+                 refresh_tokens=CONTEXT_CACHE_REFRESH_TOKENS):
+        self.client = client
+        self.state = state
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.refresh_tokens = refresh_tokens
+
+    def _base_key(self, model, config, files):
+        parts = [model, str(config.system_instruction), repr(config.tools), repr(config.tool_config)]
+        parts += [_file_identity(f) for f in files]
+        return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def _cached_config(self, config, name):
+        # cached content를 사용할 때는 system_instruction/tools/tool_config를 요청에 함께 보낼 수 없음
+        return config.model_copy(update={"system_instruction": None, "tools": None, "tool_config": None, "cached_content": name})
+
+    def _usable_entry(self, base_key, history):
+        entry = self.state.get("entry")
+        if not entry or entry["base_key"] != base_key or entry["expire_at"] - time.time() < _EXPIRY_MARGIN:
+            return None
+        if len(history) < entry["history_len"] or _content_digest(history[:entry["history_len"]]) != entry["digest"]:
+            return None
+        return entry
+
+    def prepare(self, model, config, history, files):
+        """
+        Returns:
+            (config, history, files) - 캐시를 사용하면 캐시에 포함되지 않은 나머지만 반환합니다.
+        """
+        base_key = self._base_key(model, config, files)
+        entry = self._usable_entry(base_key, history)
+        if entry:
+            tail = history[entry["history_len"]:]
+            tail_tokens = sum(estimate_tokens(p.text or "") for c in tail for p in c.parts or [])
+            if tail_tokens < self.refresh_tokens:
+                if entry["expire_at"] - time.time() < self.ttl / 2:
+                    self._touch(entry)
+                return self._cached_config(config, entry["name"]), tail, []
+
+        prefix_tokens = estimate_tokens(str(config.system_instruction or ""))
+        prefix_tokens += sum(estimate_tokens(p.text or "") for c in history for p in c.parts or [])
+        if prefix_tokens < self.min_tokens and not files:
+            return config, history, files
+
+        contents = list(history)
+        if files:
+            contents.append(types.Content(role="user", parts=[_file_part(f) for f in files] + [types.Part(text="(Attached files)")]))
+            contents.append(types.Content(role="model", parts=[types.Part(text="I have read the attached files.")]))
+        try:
+            cached = self.client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    contents=contents,
+                    system_instruction=config.system_instruction,
+                    tools=config.tools,
+                    tool_config=config.tool_config,
+                    ttl=f"{self.ttl}s",
+                    display_name="dumblexity-context",
+                ),
+            )
+        except Exception as e:
+            # 최소 토큰 수 미달 등: 캐시 없이 진행
+            print(f"Failed to create context cache: {e}")
+            return config, history, files
+
+        self.drop()
+        self.state["entry"] = {
+            "name": cached.name,
+            "base_key": base_key,
+            "history_len": len(history),
+            "digest": _content_digest(history),
+            "expire_at": cached.expire_time.timestamp() if cached.expire_time else time.time() + self.ttl,
+        }
+        print(f"Created context cache {cached.name} (~{prefix_tokens} tokens, {len(files)} files).")
+        return self._cached_config(config, cached.name), [], []
+
+    def _touch(self, entry):
+        try:
+            updated = self.client.caches.update(name=entry["name"], config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+            entry["expire_at"] = updated.expire_time.timestamp() if updated.expire_time else time.time() + self.ttl
+        except Exception as e:
+            print(f"Failed to extend context cache: {e}")
+
+    def drop(self):
+        """현재 캐시를 상태에서 제거하고 백그라운드에서 삭제합니다."""
+        entry = self.state.pop("entry", None)
+        if entry:
+            threading.Thread(target=self._delete, args=(entry["name"],), daemon=True).start()
+
+    def _delete(self, name):
+        try:
+            self.client.caches.delete(name=name)
+        except Exception as e:
+            print(f"Failed to delete context cache {name}: {e}")
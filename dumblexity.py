@@ -1,42 +1,63 @@
 import streamlit as st
 import traceback
-import asyncio
-from st_copy import copy_button
-import streamlit_mermaid as stmd
-import re
-import json
+import datetime
+import itertools
 
 from utils import (
-    resolve_all_urls_async,
     save_session,
     load_session,
     delete_session,
-    get_all_sessions
+    list_sessions,
+    count_sessions,
+    search_sessions
 )
 
-from ai import (
-    genai_stream_wrapper,
-    generate_config,
-    get_genai_client,
-    gen_sdk_history,
-    available_models,
-    get_function_call_results,
-    process_files
+from clients import (
+    warm_up_clients_in_background,
+    warm_up_tool_clients_in_background,
+    available_models
 )
 
+from history import HISTORY_TOKEN_BUDGET
+
+from tracing import start_metrics_server
+
+from ui import (
+    render_chat_history,
+    render_trace,
+    render_stream,
+    reset_history_window
+)
+
+# [CHANGED] genai SDK(engine, context_cache)와 선택적 UI 컴포넌트(st_copy, streamlit_geolocation)는
+# 첫 화면 렌더링을 늦추지 않도록 실제로 필요한 곳에서 가져옵니다. (python startup.py로 import 시간 확인)
+
 # --- Constants & Setup ---
 st.set_page_config(page_title="Dumblexity", page_icon="🤖", layout="wide")
 
 GLOBAL_THEME_COLOR = "dark"
 MERMAID_THEME = "dark"
+SESSION_LIST_PAGE_SIZE = 50
+SESSION_SEARCH_LIMIT = 10
 
 st.title("🤖 Dumblexity - AI Assistant")
 
 
-# --- Session State Initialization ---
-if "genai_client" not in st.session_state:
-    st.session_state.genai_client = get_genai_client()
+# [CHANGED] 프로세스당 한 번만 모델 클라이언트(httpx, genai)를 미리 생성 (첫 화면을 그린 뒤 스크립트 끝에서 호출)
+@st.cache_resource(show_spinner=False)
+def _warm_up_clients():
+    warm_up_clients_in_background()
+    start_metrics_server()
+    return True
+
+
+# [NEW] 외부 검색 도구 클라이언트(Tavily, YouTube)는 External Search 모드를 처음 선택했을 때 미리 생성
+@st.cache_resource(show_spinner=False)
+def _warm_up_tool_clients():
+    warm_up_tool_clients_in_background()
+    return True
 
+# --- Session State Initialization ---
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
@@ -44,6 +65,10 @@ if "messages" not in st.session_state:
 if "current_session_name" not in st.session_state:
     st.session_state.current_session_name = None
 
+# [NEW] 답변별 타이밍 (메시지 인덱스 -> Trace.to_dict())
+if "traces" not in st.session_state:
+    st.session_state.traces = {}
+
 # --- Sidebar ---
 with st.sidebar:
     # [NEW] 파일 업로드 섹션 추가 (설정 위에 배치하여 접근성 높임)
@@ -79,6 +104,27 @@ with st.sidebar:
     )
 
 
+    history_token_budget = st.number_input(
+        "History token budget:",
+        min_value=2000,
+        max_value=1000000,
+        value=HISTORY_TOKEN_BUDGET,
+        step=1000,
+        help="Older turns beyond this budget are summarized before being sent to the model."
+    )
+
+    use_context_cache = st.checkbox(
+        "⚡ Context caching",
+        value=False,
+        help="Cache the system instruction, older history and attached files on the model side to cut input tokens on follow-up turns."
+    )
+
+    show_timing = st.checkbox(
+        "⏱️ Show timing waterfall",
+        value=False,
+        help="Show where each answer spent its time (uploads, model, tools, citation checks)."
+    )
+
     # [CHANGED] 상호 배타적인 검색 모드 선택
     st.markdown("##### 🔍 Search Mode")
     search_mode = st.radio(
@@ -105,6 +151,7 @@ with st.sidebar:
     elif search_mode == "External Search":
         use_tavily_search = st.checkbox("웹 검색 (Tavily Search)", value=True)
         use_extraction = st.checkbox("웹/YT 추출(extraction)", value=True)
+        _warm_up_tool_clients()
 
     st.divider()
     
@@ -120,6 +167,14 @@ with st.sidebar:
         st.session_state.messages = []
         # [NEW] 현재 세션 이름 초기화
         st.session_state.current_session_name = None
+        reset_history_window()
+        st.session_state.traces = {}
+        st.session_state.pop("session_sources", None)
+        # [CHANGED] 세션별 컨텍스트 캐시가 있을 때만 정리 (없으면 genai SDK를 로드하지 않음)
+        if st.session_state.get("context_cache", {}).get("entry"):
+            from context_cache import ContextCacheManager
+            from clients import get_genai_client
+            ContextCacheManager(get_genai_client(), state=st.session_state.context_cache).drop()
         st.rerun()
 
     st.divider()
@@ -135,17 +190,44 @@ with st.sidebar:
 
     st.divider()
 
-    existing_sessions = get_all_sessions()
-    if existing_sessions:
-        
+    # [NEW] 저장된 모든 세션 내용 전문 검색
+    search_query = st.text_input("🔎 Search sessions:", placeholder="Search saved conversations...")
+    if search_query.strip():
+        hits = search_sessions(search_query.strip(), limit=SESSION_SEARCH_LIMIT)
+        if hits:
+            for i, hit in enumerate(hits):
+                role_icon = "🧑" if hit["role"] == "user" else "🤖"
+                st.markdown(f"**{hit['session']}** {role_icon} #{hit['seq'] + 1}  \n{hit['snippet']}")
+                if st.button("📂 Open", key=f"search_hit_{i}"):
+                    load_session(hit["session"])
+        else:
+            st.caption("No matches found.")
+        st.divider()
+
+    # [CHANGED] 파일 시스템을 스캔하지 않고 세션 인덱스에서 한 페이지씩 조회
+    total_sessions = count_sessions()
+    if total_sessions:
+        page_count = (total_sessions + SESSION_LIST_PAGE_SIZE - 1) // SESSION_LIST_PAGE_SIZE
+        page = 1
+        if page_count > 1:
+            page = st.number_input(f"Page (1-{page_count}):", min_value=1, max_value=page_count, value=1, step=1)
+        existing_sessions = {x["name"]: x for x in list_sessions(limit=SESSION_LIST_PAGE_SIZE, offset=(page - 1) * SESSION_LIST_PAGE_SIZE)}
+        session_names = list(existing_sessions.keys())
+
         # [NEW] 현재 세션이 목록에 있다면 기본값으로 선택
         default_index = None
         if st.session_state.current_session_name in existing_sessions:
-            default_index = existing_sessions.index(st.session_state.current_session_name)
-        
+            default_index = session_names.index(st.session_state.current_session_name)
+
+        def _format_session(name):
+            info = existing_sessions[name]
+            updated = datetime.datetime.fromtimestamp(info["updated_at"]).strftime("%m-%d %H:%M")
+            return f"{name} ({info['message_count']} msgs, {updated})"
+
         selected_session = st.selectbox("Select a session:", 
-                                        existing_sessions, 
-                                        index=default_index)
+                                        session_names, 
+                                        index=default_index,
+                                        format_func=_format_session)
         
         col1, col2 = st.columns(2)
         with col1:
@@ -158,15 +240,8 @@ with st.sidebar:
         st.markdown("*No saved sessions found.*")
 
 # --- Display Chat History ---
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-        # [NEW] 어시스턴트의 메시지(봇 답변) 아래에만 복사 버튼 추가
-        if message["role"] == "assistant":
-            copy_button(message["content"],
-                        tooltip="Copy this text",
-                        copied_label="Copied!",
-                        icon="📋")
+# [CHANGED] 최근 메시지만 렌더링 (이전 메시지는 필요할 때 페이지 단위로 표시)
+render_chat_history(st.session_state.messages, st.session_state.traces if show_timing else None)
 
 # --- Chat Input & Response Handling ---
 if prompt := st.chat_input("Ask me anything..."):
@@ -178,216 +253,98 @@ if prompt := st.chat_input("Ask me anything..."):
     with st.chat_message("user"):
         st.markdown(full_prompt_content)
 
-    # History 생성
-    sdk_history = []
-    for msg in st.session_state.messages:
-        role = "user" if msg["role"] == "user" else "model"
-        sdk_history.append(
-            gen_sdk_history(role, msg["content"])
-        )
-
-    st.session_state.messages.append({"role": "user", "content": full_prompt_content})
-    
-    # [NEW] 사용자 메시지가 추가된 직후에도 자동 저장 (선택 사항이지만, 응답 전 앱이 멈출 경우 대비)
-    if st.session_state.current_session_name:
-        save_session(st.session_state.current_session_name, silent=True)
-
     with st.chat_message("assistant"):
-        with st.spinner("🤖 Thinking..."):
-            try:
-                total_grounding_metadata = []
-                total_function_calls = []
-                total_citation_metadata = []
-                
-                config_payload = generate_config(
-                    google_web_search=use_google_web_search, 
-                    google_map_search=use_google_map_search,
-                    google_code_execution=use_google_code_execution,
-                    tavily_search=use_tavily_search,
-                    extraction=use_extraction,
-                    temperature=temperature
-                )
-
-                if uploaded_files:
-                    file_contents = process_files(uploaded_files)
-
-                chat_session = st.session_state.genai_client.chats.create(
-                    model=selected_model,
-                    config=config_payload,
-                    history=sdk_history
-                )
-
-                response_stream = chat_session.send_message_stream([full_prompt_content] + (file_contents if uploaded_files else []))
-                full_response_text = st.write_stream(genai_stream_wrapper(response_stream, total_grounding_metadata, total_citation_metadata, total_function_calls))
-
-                # Not yet used for extract_web_page and extract_youtube_transcript as they are called automatically within the model response
-
-                #if total_function_calls:
-                #    st.info("🔧 Calling functions...")
-                #    function_results = get_function_call_results(total_function_calls)
-                #    response_stream2 = chat_session.send_message_stream(function_results)
-                #    total_function_calls.clear()
-                #    full_response_text += st.write_stream(genai_stream_wrapper(response_stream2, total_grounding_chunks, total_function_calls))
-
-                citation_text = ""
+        from engine import ChatEngine
+        from streamlit_geolocation import streamlit_geolocation
+
+        # [CHANGED] history 구성, 모델 호출, 도구 실행, 인용 구성, 자동 저장은 ChatEngine이 처리하고
+        # 여기서는 이벤트를 화면에 표시만 합니다. (st.session_state를 그대로 상태로 사용)
+        engine = ChatEngine(
+            state=st.session_state,
+            model=selected_model,
+            temperature=temperature,
+            options=dict(
+                google_web_search=use_google_web_search,
+                google_map_search=use_google_map_search,
+                google_code_execution=use_google_code_execution,
+                tavily_search=use_tavily_search,
+                extraction=use_extraction
+            ),
+            history_budget=history_token_budget,
+            use_context_cache=use_context_cache,
+            # 위치 컴포넌트는 스크립트 스레드에서만 렌더링할 수 있으므로 여기서 요청
+            location=streamlit_geolocation() if use_google_map_search else {}
+        )
+        try:
+            events = engine.ask(full_prompt_content, files=uploaded_files)
+            # History 생성
+            # [CHANGED] 토큰 예산을 넘는 오래된 턴은 요약으로 대체 (요약은 세션 상태에 캐시되어 점진적으로 갱신)
+            history_stats = next(events)
+            token_caption = f"🧮 Prompt ≈ {history_stats['prompt_tokens']:,} / {history_stats['budget']:,} tokens"
+            if history_stats["summarized"]:
+                token_caption += f" · {history_stats['summarized']} earlier messages summarized"
+            if history_stats["dropped"]:
+                token_caption += f" · {history_stats['dropped']} earlier messages dropped"
+            st.caption(token_caption)
+
+            with st.spinner("🤖 Thinking..."):
+                # [CHANGED] 이미 업로드한 파일은 재사용하고, 새 파일만 병렬 업로드하며 진행 상황 표시
+                upload_progress = st.empty()
+                tool_status = st.empty()
+                remaining_events = []
+
+                def _text_stream():
+                    for event in events:
+                        if event["type"] == "text":
+                            yield event["text"]
+                            continue
+                        # 응답이 잠시 멈추는 시점이므로 모아둔 텍스트를 바로 표시
+                        yield ""
+                        if event["type"] == "upload":
+                            text = f"📤 Uploaded {event['name']} ({event['done']}/{event['total']})" if event["name"] else f"📤 Uploading {event['total']} file(s)..."
+                            upload_progress.progress(event["done"] / event["total"], text=text)
+                        elif event["type"] == "tool_call":
+                            upload_progress.empty()
+                            tool_status.caption("🛠️ " + ", ".join(call["name"] for call in event["calls"]))
+                        elif event["type"] == "tool_result":
+                            tool_status.empty()
+                        elif event["type"] == "throttle":
+                            tool_status.caption(f"⏳ {event['provider']} is rate limiting requests, retrying in {event['delay']:.1f}s (attempt {event['attempt']})")
+                        else:
+                            remaining_events.append(event)
+                            return
+
+                # [CHANGED] 청크를 모아서 표시하고, 닫힌 코드/mermaid 블록은 그 자리에서 바로 렌더링
+                full_response_text = render_stream(_text_stream())
+                upload_progress.empty()
+                tool_status.empty()
+
+                final_content = full_response_text
+                trace = None
                 with st.spinner("🔍 Verifying citations..."):
-                    unique_citation_chunks = {}
-                    if total_citation_metadata:
-                        for citation in total_citation_metadata:
-                            uri = citation.uri
-                            title = citation.title or "Untitled"
-                            if uri:
-                                unique_citation_chunks[uri] = title
-                    
-                    if unique_citation_chunks:
-                        citation_text += "\n\n#### Citations\n"
-                        urls_to_fetch = list(unique_citation_chunks.keys())
-                        resolved_urls = asyncio.run(resolve_all_urls_async(urls_to_fetch))
-
-                        for i, initial_uri in enumerate(urls_to_fetch):
-                            title = unique_citation_chunks[initial_uri]
-                            resolved_uri = resolved_urls[i]
-                            web_citation_text += f"{i+1}. [{title}]({resolved_uri})\n"
-                        
-                        st.markdown(citation_text)
-                            
-                    if total_grounding_metadata:
-                        unique_used_web_chunks = {}
-                        unique_used_map_chunks = {}
-                        unique_unused_web_chunks = {}
-                        unique_unused_map_chunks = {}
-                        for metadata in total_grounding_metadata:
-                            chunks = metadata.grounding_chunks or []
-                            supports = metadata.grounding_supports or []
-                            #print(chunks)
-                            #print(supports)
-                            #print('------------------')
-                            used_chunk_indices = []
-                            for support in supports:
-                                used_chunk_indices.extend(support.grounding_chunk_indices)
-                            used_chunk_indices_set = set(used_chunk_indices)
-                            for i, chunk in enumerate(chunks):
-                                if chunk.web and chunk.web.uri:
-                                    if i in used_chunk_indices_set:
-                                        unique_used_web_chunks[chunk.web.uri] = chunk.web.title or "Untitled"
-                                    else:
-                                        unique_unused_web_chunks[chunk.web.uri] = chunk.web.title or "Untitled"
-                                if chunk.maps and chunk.maps.uri:
-                                    if i in used_chunk_indices_set:
-                                        unique_used_map_chunks[chunk.maps.uri] = chunk.maps.title or "Untitled"
-                                    else:
-                                        unique_unused_map_chunks[chunk.maps.uri] = chunk.maps.title or "Untitled"
-
-                        if unique_used_web_chunks:
-                            web_citation_text = "\n\n#### Web Citations\n"
-                            
-                            urls_to_fetch = list(unique_used_web_chunks.keys())
-                            
-                            # --- [FIX START] ---
-                            # [CHANGED] asyncio.run()을 사용하여 비동기 함수를 동기식으로 호출
-                            # 이것이 동기(Streamlit) 코드와 비동기(httpx) 코드를 연결하는 다리입니다.
-                            resolved_urls = asyncio.run(resolve_all_urls_async(urls_to_fetch))
-                            # --- [FIX END] ---
-
-                            # [NEW] 병렬로 받아온 결과를 사용하여 Citatation 텍스트 구성
-                            for i, initial_uri in enumerate(urls_to_fetch):
-                                title = unique_used_web_chunks[initial_uri]
-                                resolved_uri = resolved_urls[i]
-                                web_citation_text += f"{i+1}. [{title}]({resolved_uri})\n"
-                            
-                            st.markdown(web_citation_text)
-                            citation_text += web_citation_text
-                        if unique_unused_web_chunks:
-                            web_citation_text = "\n\n#### Web Citations (not used)\n"
-                            
-                            urls_to_fetch = list(unique_unused_web_chunks.keys())
-
-                            resolved_urls = asyncio.run(resolve_all_urls_async(urls_to_fetch))
-
-                            for i, initial_uri in enumerate(urls_to_fetch):
-                                title = unique_unused_web_chunks[initial_uri]
-                                resolved_uri = resolved_urls[i]
-                                web_citation_text += f"{i+1}. [{title}]({resolved_uri})\n"
-                            
-                            st.markdown(web_citation_text)
-                            citation_text += web_citation_text
-                        if unique_used_map_chunks:
-                            map_citation_text = "\n\n#### Map Citations\n"
-                            for i, (uri, title) in enumerate(unique_used_map_chunks.items()):
-                                map_citation_text += f"{i+1}. [{title}]({uri})\n"
-                            
-                            st.markdown(map_citation_text)
-                            citation_text += map_citation_text
-                        if unique_unused_map_chunks:
-                            map_citation_text = "\n\n#### Map Citations (not used)\n"
-                            for i, (uri, title) in enumerate(unique_unused_map_chunks.items()):
-                                map_citation_text += f"{i+1}. [{title}]({uri})\n"
-                            
-                            st.markdown(map_citation_text)
-                            citation_text += map_citation_text
-
-                if total_function_calls:
-                    with st.spinner("🔍 Verifying citations from function calls..."):
-                        unique_web_chunks = {}
-                        for func_call in total_function_calls:
-                            parts = func_call.parts
-                            if parts:
-                                for part in parts:
-                                    func_response = part.function_response
-                                    if func_response:
-                                        #print(f"Function response: {func_response}")
-                                        response = func_response.response
-                                        output = response.get("result", response) if response else None
-                                        if isinstance(output, str):
-                                            try:
-                                                output = json.loads(output)
-                                            except json.JSONDecodeError:
-                                                pass
-                                        if output and 'results' in output:
-                                            for res in output['results']:
-                                                uri = res.get("url")
-                                                title = res.get("title", "Untitled")
-                                                if uri:
-                                                    unique_web_chunks[uri] = title
-                                        elif output and isinstance(output, list) and 'url' in output[0]:
-                                            for res in output:
-                                                uri = res.get("url")
-                                                title = res.get('title', uri)  # Use last part of URL as title if not provided
-                                                if uri:
-                                                    unique_web_chunks[uri] = title
-                        if unique_web_chunks:
-                            func_citation_text = "\n\n#### Function Call Citations\n"
-
-                            for i, (uri, title) in enumerate(unique_web_chunks.items()):
-                                func_citation_text += f"{i+1}. [{title}]({uri})\n"
-                            
-                            st.markdown(func_citation_text)
-                            citation_text += func_citation_text
-
-                final_content = full_response_text + citation_text
-
-                regex_pattern = r"```mermaid\s*?(.*?)```"
-                mermaid_blocks = re.findall(regex_pattern, final_content, re.DOTALL)
-                if mermaid_blocks:
-                    st.markdown("#### Mermaid Diagrams")    
-                    for block in mermaid_blocks:
-                        stmd.st_mermaid(block)
-
+                    # 섹션별로 준비되는 즉시 표시
+                    for event in itertools.chain(remaining_events, events):
+                        if event["type"] == "citations":
+                            st.markdown(event["text"])
+                        elif event["type"] == "done":
+                            final_content = event["content"]
+                            trace = event["trace"]
+
+                from st_copy import copy_button
                 copy_button(final_content,
                             tooltip="Copy this text",
                             copied_label="Copied!",
                             icon="📋")
-                
-                st.session_state.messages.append({"role": "assistant", "content": final_content})
-
-                # --- [NEW] 자동 저장 트리거 ---
-                # 어시스턴트의 응답이 message에 추가된 후,
-                # 현재 세션 이름이 존재한다면 (즉, 로드했거나 한 번이라도 저장했다면)
-                # 'silent=True'로 자동 저장합니다.
-                if st.session_state.current_session_name:
-                    save_session(st.session_state.current_session_name, silent=True)
-                # --- [NEW] End Auto-save ---
-
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
-                traceback.print_exc()
\ No newline at end of file
+
+                # 답변은 ChatEngine이 st.session_state.messages에 추가하고, 현재 세션이 있으면 자동 저장함
+                if trace:
+                    st.session_state.traces[len(st.session_state.messages) - 1] = trace
+                    if show_timing:
+                        render_trace(trace)
+
+        except Exception as e:
+            st.error(f"An error occurred: {e}")
+            traceback.print_exc()
+
+# 첫 화면을 모두 보낸 뒤 시작해 백그라운드 SDK 로딩이 렌더링과 경쟁하지 않도록 함
+_warm_up_clients()
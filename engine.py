@@ -0,0 +1,268 @@
+import os
+import uuid
+import queue
+import asyncio
+import mimetypes
+import threading
+import contextvars
+
+from ai import (
+    genai_stream_wrapper,
+    genai_stream_wrapper_async,
+    run_tool_loop,
+    run_tool_loop_async,
+    generate_config,
+    get_genai_client,
+    available_models,
+    process_files
+)
+from history import HistoryManager, HISTORY_TOKEN_BUDGET, estimate_tokens
+from context_cache import ContextCacheManager
+from citations import CitationEngine
+from clients import submit_async
+from session_store import get_session_backend, save_messages
+from tracing import start_trace, span
+from governor import set_session
+from ranking import set_query
+from sources import SessionSources, set_sources
+
+# 검색 모드별 generate_config 옵션 (Streamlit 사이드바의 기본값과 같음)
+SEARCH_MODES = {
+    "google": {"google_web_search": True},
+    "maps": {"google_web_search": True, "google_map_search": True},
+    "code": {"google_web_search": True, "google_code_execution": True},
+    "external": {"tavily_search": True, "extraction": True},
+    "none": {},
+}
+TOOL_OPTION_NAMES = ("google_web_search", "google_map_search", "google_code_execution", "tavily_search", "extraction")
+# 1이면 모델 스트리밍과 도구 실행을 공유 이벤트 루프에서 비동기로 처리 (0이면 턴마다 작업 스레드 사용)
+CHAT_ENGINE_ASYNC = os.getenv("CHAT_ENGINE_ASYNC", "1") == "1"
+
+_DONE = object()
+
+
+def tool_options(search_mode="google", **overrides):
+    """검색 모드 이름으로 generate_config의 도구 옵션 dict를 만듭니다."""
+    options = {name: False for name in TOOL_OPTION_NAMES}
+    options.update(SEARCH_MODES[search_mode])
+    options.update({k: v for k, v in overrides.items() if k in TOOL_OPTION_NAMES and v is not None})
+    return options
+
+
+class LocalFile:
+    """로컬 파일을 process_files가 받는 업로드 파일(UploadedFile)과 같은 형태로 감쌉니다."""
+
+    def __init__(self, path, mime_type=None):
+        self.name = os.path.basename(path)
+        self.type = mime_type or mimetypes.guess_type(path)[0] or "text/plain"
+        with open(path, "rb") as f:
+            self._data = f.read()
+        self.size = len(self._data)
+        self.file_id = None
+
+    def getvalue(self):
+        return self._data
+
+
+class ChatEngine:
+    """
+    Streamlit과 무관한 채팅 오케스트레이션 (history 구성, config 생성, 파일 처리, 스트리밍/도구 실행, 인용 구성, 자동 저장).
+
+    state는 dict 또는 st.session_state이며 "messages", "current_session_name", "persisted_message_count",
+    "history_summary", "context_cache", "session_sources" 키를 사용합니다. (Streamlit UI와 같은 키이므로 UI에서도 그대로 사용 가능)
+    ask()는 다음과 같은 이벤트 dict를 순서대로 yield합니다.
+        {"type": "history", "tokens", "budget", "summarized", "dropped", "prompt_tokens"}
+        {"type": "upload", "done", "total", "name"}
+        {"type": "tool_call", "calls": [{"id", "name", "args"}]}
+        {"type": "tool_result", "results": [{"id", "name", "error"}]}
+        {"type": "throttle", "provider", "attempt", "delay"}   (외부 API의 요청 제한으로 재시도를 기다리는 중)
+        {"type": "text", "text"}
+        {"type": "citations", "header", "text"}
+        {"type": "done", "content", "trace"}
+    모델 호출과 도구 실행은 use_async이면 공유 이벤트 루프(client.aio)에서, 아니면 작업 스레드에서 진행되며
+    이벤트는 thread-safe 큐로 전달됩니다. state는 ask()를 호출한 스레드에서만 변경됩니다.
+    """
+
+    def __init__(self, state=None, client=None, model=None, temperature=0.2, options=None,
+                 history_budget=HISTORY_TOKEN_BUDGET, use_context_cache=False, location=None, autosave=True,
+                 use_async=CHAT_ENGINE_ASYNC):
+        self.state = state if state is not None else {}
+        self.state.setdefault("messages", [])
+        self.state.setdefault("current_session_name", None)
+        self.client = client or get_genai_client()
+        self.model = model or available_models[0]
+        self.temperature = temperature
+        self.options = options if options is not None else tool_options()
+        self.history_budget = history_budget
+        self.use_context_cache = use_context_cache
+        # 지도 검색용 위치. 헤드리스 실행에서는 브라우저 위치를 요청하지 않도록 빈 dict가 기본값
+        self.location = location if location is not None else {}
+        self.autosave = autosave
+        self.use_async = use_async
+        # 외부 API 요청을 세션별로 공정하게 나누기 위한 key (st.session_state는 브라우저 세션마다 따로 유지됨)
+        # (작업 스레드에서는 st.session_state를 읽을 수 없으므로 여기서 미리 읽어 둠)
+        self.session_key = self.state.setdefault("governor_session", uuid.uuid4().hex)
+        self.context_cache = ContextCacheManager(self.client, state=self.state.setdefault("context_cache", {}))
+
+    @property
+    def messages(self):
+        return self.state["messages"]
+
+    # --- Sessions ---
+    def load(self, name):
+        backend = get_session_backend()
+        messages = backend.load_paged(name)
+        self.state["messages"] = messages
+        self.state["persisted_message_count"] = len(messages)
+        self.state["session_sources"] = SessionSources(backend.load_sources(name))
+        self.state["persisted_sources_version"] = 0
+        self.state["current_session_name"] = name
+        return messages
+
+    def save(self, name=None):
+        name = name or self.state.get("current_session_name")
+        if name:
+            save_messages(self.state, name)
+
+    def clear(self):
+        self.state["messages"] = []
+        self.state["current_session_name"] = None
+        self.state.pop("session_sources", None)
+        self.context_cache.drop()
+
+    def _autosave(self):
+        if self.autosave and self.state.get("current_session_name"):
+            try:
+                with span("save_session"):
+                    save_messages(self.state, self.state["current_session_name"])
+            except Exception as e:
+                print(f"Auto-save failed: {e}")
+
+    # --- Chat ---
+    def ask(self, prompt, files=None):
+        """prompt에 대한 답변을 이벤트 스트림으로 생성합니다. (오류는 예외로 전달)"""
+        with start_trace(self.model) as trace:
+            history_manager = HistoryManager(self.client, budget=self.history_budget,
+                                             state=self.state.setdefault("history_summary", {}))
+            with span("build_history"):
+                sdk_history, history_stats = history_manager.build(self.messages)
+            self.messages.append({"role": "user", "content": prompt})
+            # 도구 결과를 색인하고 search_session_sources가 검색하는 세션별 저장소
+            if self.state.get("session_sources") is None:
+                self.state["session_sources"] = SessionSources()
+            sources = self.state["session_sources"]
+
+            # 모델 호출은 바로 시작하고, 그동안 호출한 쪽에서 history 이벤트 표시와 자동 저장을 진행
+            events = queue.Queue()
+            stop = threading.Event()
+            if self.use_async:
+                # 세션마다 스레드를 점유하지 않고 공유 이벤트 루프의 task로 실행
+                task = submit_async(self._produce_async(prompt, files or [], sdk_history, sources, events.put, stop))
+            else:
+                task = None
+                worker = threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(self._produce, prompt, files or [], sdk_history, sources, events.put, stop),
+                    name="chat-engine", daemon=True,
+                )
+                worker.start()
+            final_content = ""
+            try:
+                yield {"type": "history", **history_stats, "prompt_tokens": history_stats["tokens"] + estimate_tokens(prompt)}
+                # 사용자 메시지가 추가된 직후에도 자동 저장 (응답 전에 중단될 경우 대비)
+                self._autosave()
+
+                while True:
+                    event = events.get()
+                    if event is _DONE:
+                        break
+                    if isinstance(event, BaseException):
+                        raise event
+                    if event["type"] in ("text", "citations"):
+                        final_content += event["text"]
+                    yield event
+            finally:
+                # 소비자가 중간에 멈추면(클라이언트 연결 종료 등) 작업 스레드/task도 중단
+                stop.set()
+                if task is not None:
+                    task.cancel()
+
+            self.messages.append({"role": "assistant", "content": final_content})
+            self._autosave()
+            yield {"type": "done", "content": final_content, "trace": trace.to_dict()}
+
+    def _produce(self, prompt, files, sdk_history, sources, emit, stop):
+        try:
+            set_session(self.session_key, on_throttle=lambda info: emit({"type": "throttle", **info}))
+            # 도구 결과(추출한 페이지, 자막)를 줄일 때 기준이 되는 질문
+            set_query(prompt)
+            set_sources(sources)
+            config = generate_config(temperature=self.temperature, location=self.location, **self.options)
+
+            file_contents = []
+            if files:
+                def _progress(done, total, name):
+                    emit({"type": "upload", "done": done, "total": total, "name": name})
+                file_contents = process_files(files, progress_callback=_progress)
+
+            if self.use_context_cache:
+                config, sdk_history, file_contents = self.context_cache.prepare(self.model, config, sdk_history, file_contents)
+
+            with span("chats.create"):
+                chat_session = self.client.chats.create(model=self.model, config=config, history=sdk_history)
+
+            citation_engine = CitationEngine()
+            response_stream = run_tool_loop(chat_session, [prompt] + file_contents, on_event=emit)
+            for text in genai_stream_wrapper(response_stream, [], [], [], citation_engine=citation_engine):
+                if stop.is_set():
+                    return
+                emit({"type": "text", "text": text})
+
+            with span("citations"):
+                for header, text in citation_engine.sections():
+                    if stop.is_set():
+                        return
+                    emit({"type": "citations", "header": header, "text": text})
+        except BaseException as e:
+            emit(e)
+        finally:
+            emit(_DONE)
+
+    async def _produce_async(self, prompt, files, sdk_history, sources, emit, stop):
+        try:
+            set_session(self.session_key, on_throttle=lambda info: emit({"type": "throttle", **info}))
+            # 도구 결과(추출한 페이지, 자막)를 줄일 때 기준이 되는 질문
+            set_query(prompt)
+            set_sources(sources)
+            config = generate_config(temperature=self.temperature, location=self.location, **self.options)
+
+            file_contents = []
+            if files:
+                def _progress(done, total, name):
+                    emit({"type": "upload", "done": done, "total": total, "name": name})
+                # 업로드는 기존 업로드 스레드 풀(캐시, 중복 업로드 합치기)을 그대로 사용
+                file_contents = await asyncio.to_thread(process_files, files, _progress)
+
+            if self.use_context_cache:
+                config, sdk_history, file_contents = await asyncio.to_thread(
+                    self.context_cache.prepare, self.model, config, sdk_history, file_contents)
+
+            with span("chats.create"):
+                chat_session = self.client.aio.chats.create(model=self.model, config=config, history=sdk_history)
+
+            citation_engine = CitationEngine()
+            response_stream = run_tool_loop_async(chat_session, [prompt] + file_contents, on_event=emit)
+            async for text in genai_stream_wrapper_async(response_stream, [], [], [], citation_engine=citation_engine):
+                if stop.is_set():
+                    return
+                emit({"type": "text", "text": text})
+
+            with span("citations"):
+                async for header, text in citation_engine.sections_async():
+                    if stop.is_set():
+                        return
+                    emit({"type": "citations", "header": header, "text": text})
+        except BaseException as e:
+            emit(e)
+        finally:
+            emit(_DONE)
@@ -0,0 +1,410 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import itertools
+import contextvars
+import email.utils
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+
+from tracing import METRICS
+
+# 외부 API(Gemini, Tavily, YouTube 등)별 요청 속도(초당 요청 수, 0이면 제한 없음), 버스트 크기, 동시 요청 수 제한
+# 환경 변수 GOVERNOR_<PROVIDER>_RPS / _BURST / _CONCURRENCY 로 변경 (예: GOVERNOR_TAVILY_RPS=1.5)
+DEFAULT_LIMITS = {
+    "gemini": {"rps": 5, "burst": 10, "concurrency": 16},
+    "tavily": {"rps": 5, "burst": 10, "concurrency": 8},
+    "youtube": {"rps": 10, "burst": 20, "concurrency": 8},
+    "transcript": {"rps": 5, "burst": 10, "concurrency": 4},
+    "resolver": {"rps": 0, "burst": 0, "concurrency": 32},
+}
+GOVERNOR_MAX_RETRIES = int(os.getenv("GOVERNOR_MAX_RETRIES", 4))
+GOVERNOR_BASE_DELAY = float(os.getenv("GOVERNOR_BASE_DELAY", 0.5))
+GOVERNOR_MAX_DELAY = float(os.getenv("GOVERNOR_MAX_DELAY", 30))
+# 제한(429 등)을 받으면 요청 속도를 이 비율로 낮추고, 성공할 때마다 설정값의 RECOVERY 비율만큼 회복 (AIMD)
+GOVERNOR_BACKOFF_FACTOR = float(os.getenv("GOVERNOR_BACKOFF_FACTOR", 0.5))
+GOVERNOR_RECOVERY = float(os.getenv("GOVERNOR_RECOVERY", 0.05))
+
+THROTTLE_STATUS_CODES = {429, 503}
+# 상태 코드 없이 예외 타입이나 메시지로만 구분되는 제한 오류 (Tavily, youtube_transcript_api의 YouTubeRequestFailed 등)
+THROTTLE_ERROR_NAMES = {"UsageLimitExceededError"}
+THROTTLE_MESSAGES = ("RESOURCE_EXHAUSTED", "Too Many Requests")
+
+# 공정 큐잉에 사용하는 현재 세션 key와 제한 발생 알림 콜백 (ChatEngine이 턴마다 설정)
+_session_key = contextvars.ContextVar("dumblexity_governor_session", default="default")
+_throttle_listener = contextvars.ContextVar("dumblexity_governor_listener", default=None)
+
+
+class ProviderThrottledError(Exception):
+    """재시도 횟수를 모두 사용해도 외부 API의 요청 제한이 풀리지 않은 경우"""
+
+    def __init__(self, provider, attempts, cause):
+        super().__init__(f"{provider} is rate limiting requests; gave up after {attempts} attempts ({cause})")
+        self.provider = provider
+        self.attempts = attempts
+
+
+def set_session(key, on_throttle=None):
+    """현재 컨텍스트(작업 스레드 또는 task)의 요청을 key 세션의 요청으로 큐에 넣습니다."""
+    _session_key.set(key or "default")
+    _throttle_listener.set(on_throttle)
+
+
+def _parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def throttle_info(exc):
+    """예외가 요청 제한(429/503, quota 초과)이면 (True, Retry-After 초 또는 None)을 반환합니다."""
+    response = getattr(exc, "response", None)
+    resp = getattr(exc, "resp", None)  # googleapiclient HttpError (httplib2 응답, dict 형태)
+    status = None
+    for candidate in (getattr(exc, "code", None), getattr(exc, "status_code", None),
+                      getattr(response, "status_code", None), getattr(response, "status", None),
+                      getattr(resp, "status", None)):
+        if isinstance(candidate, int):
+            status = candidate
+            break
+    throttled = (status in THROTTLE_STATUS_CODES or type(exc).__name__ in THROTTLE_ERROR_NAMES
+                 or any(message in str(exc) for message in THROTTLE_MESSAGES))
+    if not throttled:
+        return False, None
+    headers = getattr(response, "headers", None) or (resp if isinstance(resp, dict) else None) or {}
+    try:
+        retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    except AttributeError:
+        retry_after = None
+    return True, _parse_retry_after(retry_after)
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted", "delay", "enqueued")
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+        self.delay = 0.0
+        self.enqueued = time.monotonic()
+
+    def grant(self, delay):
+        self.granted = True
+        self.delay = delay
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._set_result)
+        else:
+            self.event.set()
+
+    def _set_result(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ProviderLimiter:
+    """
+    외부 API 하나에 대한 토큰 버킷 + 동시 요청 수 제한.
+    자리가 없으면 세션별 대기열에 넣고, 자리가 날 때마다 세션을 돌아가며(round-robin) 하나씩 허용하므로
+    한 세션이 요청을 많이 보내도 다른 세션의 요청이 뒤로 밀리지 않습니다. 스레드와 이벤트 루프 양쪽에서 사용할 수 있습니다.
+    """
+
+    def __init__(self, name, rps, burst, concurrency):
+        self.name = name
+        self.max_rate = float(rps)
+        self.rate = float(rps)
+        self.burst = max(1.0, float(burst))
+        self.concurrency = max(1, int(concurrency))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._waiters = OrderedDict()  # 세션 key -> deque[_Waiter]
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.queued_total = 0
+        self.throttled = 0
+        self.retries = 0
+        self.gave_up = 0
+
+    # --- 토큰 버킷 (lock 안에서 호출) ---
+    def _reserve(self, now):
+        """토큰 하나를 예약하고, 요청을 보내기 전에 기다려야 하는 시간을 반환합니다."""
+        delay = max(0.0, self._paused_until - now)
+        if self.rate <= 0:
+            return delay
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            delay = max(delay, -self._tokens / self.rate)
+        return delay
+
+    def _dispatch(self):
+        while self._waiters and self._in_flight < self.concurrency:
+            session, queue = self._waiters.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                # 남은 요청이 있으면 맨 뒤로 보내 다른 세션에 먼저 차례를 줌
+                self._waiters[session] = queue
+            self._in_flight += 1
+            self.granted += 1
+            waiter.grant(self._reserve(time.monotonic()))
+
+    def _enter(self, waiter, session):
+        """바로 자리를 얻으면 대기 시간을, 대기열에 들어가면 None을 반환합니다."""
+        with self._lock:
+            if not self._waiters and self._in_flight < self.concurrency:
+                self._in_flight += 1
+                self.granted += 1
+                return self._reserve(time.monotonic())
+            self.queued_total += 1
+            self._waiters.setdefault(session, deque()).append(waiter)
+            return None
+
+    def _observe_wait(self, started):
+        METRICS.observe("dumblexity_governor_wait_seconds", time.monotonic() - started, provider=self.name)
+
+    def acquire(self):
+        waiter = _Waiter()
+        delay = self._enter(waiter, _session_key.get())
+        if delay is None:
+            waiter.event.wait()
+            delay = waiter.delay
+        if delay > 0:
+            time.sleep(delay)
+        self._observe_wait(waiter.enqueued)
+
+    async def acquire_async(self):
+        session = _session_key.get()
+        waiter = _Waiter(asyncio.get_running_loop())
+        delay = self._enter(waiter, session)
+        try:
+            if delay is None:
+                await waiter.future
+                delay = waiter.delay
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:
+            # 대기 중 취소되면 대기열에서 빼거나, 이미 받은 자리를 반납
+            with self._lock:
+                holds_slot = waiter.granted or delay is not None
+                if not holds_slot:
+                    queue = self._waiters.get(session)
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[session]
+            if holds_slot:
+                self.release()
+            raise
+        self._observe_wait(waiter.enqueued)
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._dispatch()
+
+    # --- 적응형 속도 조절 ---
+    def record_success(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * GOVERNOR_RECOVERY)
+
+    def record_throttle(self, delay):
+        """제한 응답을 받으면 모든 요청을 delay 동안 멈추고 요청 속도를 낮춥니다."""
+        with self._lock:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            if self.max_rate > 0:
+                self.rate = max(self.max_rate * 0.1, self.rate * GOVERNOR_BACKOFF_FACTOR)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": sum(len(q) for q in self._waiters.values()),
+                "sessions_waiting": len(self._waiters),
+                "rate": round(self.rate, 2),
+                "granted": self.granted,
+                "queued_total": self.queued_total,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+            }
+
+
+def _limits_from_env(name, defaults):
+    prefix = f"GOVERNOR_{name.upper()}_"
+    return {
+        "rps": float(os.getenv(prefix + "RPS", defaults["rps"])),
+        "burst": float(os.getenv(prefix + "BURST", defaults["burst"])),
+        "concurrency": int(os.getenv(prefix + "CONCURRENCY", defaults["concurrency"])),
+    }
+
+
+class Governor:
+    """
+    모든 외부 API 호출이 거치는 프로세스 전체의 속도 제한기.
+    요청 제한(429, quota 초과) 응답은 Retry-After를 우선으로, 없으면 jitter를 준 지수 백오프로 재시도합니다.
+    """
+
+    def __init__(self, limits=None):
+        self._limiters = {}
+        self._lock = threading.Lock()
+        for name, defaults in (limits or DEFAULT_LIMITS).items():
+            self._limiters[name] = ProviderLimiter(name, **_limits_from_env(name, defaults))
+
+    def limiter(self, provider):
+        with self._lock:
+            if provider not in self._limiters:
+                self._limiters[provider] = ProviderLimiter(provider, 0, 0, 64)
+            return self._limiters[provider]
+
+    @contextmanager
+    def limit(self, provider):
+        limiter = self.limiter(provider)
+        limiter.acquire()
+        try:
+            yield limiter
+        finally:
+            limiter.release()
+
+    @asynccontextmanager
+    async def limit_async(self, provider):
+        limiter = self.limiter(provider)
+        await limiter.acquire_async()
+        try:
+            yield limiter
+        finally:
+            limiter.release()
+
+    def _retry_delay(self, limiter, exc, attempt):
+        """재시도할 제한 오류이면 기다릴 시간을, 아니면 None을 반환합니다. (재시도 횟수를 넘으면 ProviderThrottledError)"""
+        throttled, retry_after = throttle_info(exc)
+        if not throttled:
+            return None
+        if attempt >= GOVERNOR_MAX_RETRIES:
+            limiter.gave_up += 1
+            raise ProviderThrottledError(limiter.name, attempt + 1, exc) from exc
+        # Full jitter: 여러 호출이 동시에 제한을 받아도 같은 시점에 다시 몰리지 않도록 분산
+        delay = retry_after if retry_after is not None else random.uniform(
+            0, min(GOVERNOR_MAX_DELAY, GOVERNOR_BASE_DELAY * 2 ** attempt))
+        limiter.record_throttle(delay)
+        limiter.retries += 1
+        print(f"{limiter.name} rate limited (attempt {attempt + 1}); retrying in {delay:.1f}s")
+        listener = _throttle_listener.get()
+        if listener:
+            listener({"provider": limiter.name, "attempt": attempt + 1, "delay": delay})
+        return delay
+
+    def call(self, provider, fn, *args, **kwargs):
+        """fn(*args, **kwargs)를 속도 제한 아래에서 실행하고, 제한 오류는 재시도합니다."""
+        limiter = self.limiter(provider)
+        for attempt in itertools.count():
+            with self.limit(provider):
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    delay = self._retry_delay(limiter, e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    limiter.record_success()
+                    return result
+            time.sleep(delay)
+
+    async def call_async(self, provider, fn, *args, **kwargs):
+        """call()의 비동기 버전 (fn은 코루틴 함수)"""
+        limiter = self.limiter(provider)
+        for attempt in itertools.count():
+            async with self.limit_async(provider):
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    delay = self._retry_delay(limiter, e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    limiter.record_success()
+                    return result
+            await asyncio.sleep(delay)
+
+    def stream(self, provider, fn, *args, **kwargs):
+        """
+        스트리밍 호출(fn이 iterator를 반환)을 속도 제한 아래에서 실행합니다. 스트림이 끝날 때까지 동시 요청 자리를 차지하며,
+        첫 chunk를 받기 전에 실패한 경우에만 재시도합니다. (이미 일부를 전달한 뒤에는 재시도하지 않음)
+        """
+        limiter = self.limiter(provider)
+        for attempt in itertools.count():
+            with self.limit(provider):
+                try:
+                    iterator = iter(fn(*args, **kwargs))
+                    first = next(iterator, _EMPTY)
+                except Exception as e:
+                    delay = self._retry_delay(limiter, e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    limiter.record_success()
+                    if first is not _EMPTY:
+                        yield first
+                        yield from iterator
+                    return
+            time.sleep(delay)
+
+    async def stream_async(self, provider, fn, *args, **kwargs):
+        """stream()의 비동기 버전 (fn은 async iterator를 반환하는 코루틴 함수, 예: AsyncChat.send_message_stream)"""
+        limiter = self.limiter(provider)
+        for attempt in itertools.count():
+            async with self.limit_async(provider):
+                try:
+                    iterator = (await fn(*args, **kwargs)).__aiter__()
+                    first = await anext(iterator, _EMPTY)
+                except Exception as e:
+                    delay = self._retry_delay(limiter, e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    limiter.record_success()
+                    if first is not _EMPTY:
+                        yield first
+                        async for chunk in iterator:
+                            yield chunk
+                    return
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.name: limiter.stats() for limiter in limiters}
+
+    def render_prometheus(self):
+        stats = self.stats()
+        lines = []
+        for key, kind in (("in_flight", "gauge"), ("queued", "gauge"), ("rate", "gauge"), ("granted", "counter"),
+                          ("queued_total", "counter"), ("throttled", "counter"), ("retries", "counter"), ("gave_up", "counter")):
+            metric = f"dumblexity_governor_{key}"
+            lines.append(f"# TYPE {metric} {kind}")
+            for provider, values in stats.items():
+                lines.append(f'{metric}{{provider="{provider}"}} {values[key]}')
+        return "\n".join(lines) + "\n"
+
+
+_EMPTY = object()
+
+GOVERNOR = Governor()
+METRICS.add_collector(GOVERNOR.render_prometheus)
+
+
+def get_governor_stats():
+    return GOVERNOR.stats()
@@ -0,0 +1,149 @@
+import os
+import hashlib
+
+# sdk_history에 사용할 토큰 예산. 초과하면 오래된 턴을 요약으로 대체합니다.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 32000))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gemini-2.5-flash-lite")
+# 요약이 필요해지면 최근 메시지가 예산의 이 비율 이하가 되도록 한 번에 넉넉히 요약 (매 턴 요약하지 않도록)
+RECENT_TOKEN_RATIO = 0.5
+SUMMARY_PREFIX = "[Summary of the earlier conversation]\n"
+
+SUMMARY_INSTRUCTION = """
+You maintain a running summary of a conversation between a user and an AI assistant.
+Update the existing summary with the new messages. Keep facts, decisions, user preferences, open questions and
+important URLs. Be concise and write in the language the conversation mostly uses.
+"""
+
+
+def estimate_tokens(text):
+    """
+    로컬 토큰 수 추정 (네트워크 호출 없음). 영문은 약 4글자당 1토큰, 한글 등 비ASCII 문자는 약 1.5글자당 1토큰으로 계산합니다.
+    """
+    # 비ASCII 문자를 버린 길이 = ASCII 문자 수 (긴 도구 결과에도 글자 단위 파이썬 루프를 돌지 않도록)
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 1.5) + 4
+
+
+# 요약이 어떤 대화의 것인지 확인할 때 비교하는, 요약에 반영된 마지막 메시지 수
+# (앞쪽 전체를 비교하면 PagedMessages의 이전 페이지를 모두 읽게 되므로 경계 부분만 비교)
+SUMMARY_DIGEST_MESSAGES = 2
+
+
+def _messages_digest(messages):
+    digest = hashlib.sha1()
+    for message in messages:
+        digest.update(message["role"].encode("utf-8"))
+        digest.update(message["content"].encode("utf-8"))
+    return digest.hexdigest()
+
+
+class HistoryManager:
+    """
+    메시지 목록으로 sdk_history를 만들되, 토큰 예산을 넘으면 오래된 턴을 요약으로 대체합니다.
+    요약은 state(dict, 보통 st.session_state의 일부)에 캐시되고, 새로 밀려난 메시지만 반영해 점진적으로 갱신됩니다.
+    """
+
+    def __init__(self, client, budget=HISTORY_TOKEN_BUDGET, summary_model=SUMMARY_MODEL, state=None):
+        self.client = client
+        self.budget = budget
+        self.summary_model = summary_model
+        self.state = state if state is not None else {}
+
+    @staticmethod
+    def _boundary_digest(messages, upto):
+        return _messages_digest(messages[max(0, upto - SUMMARY_DIGEST_MESSAGES):upto])
+
+    @staticmethod
+    def _recent_tokens(messages, start, limit):
+        """
+        messages[start:]의 토큰 합. 최근 메시지부터 세고 limit을 넘으면 바로 멈추므로(반환값은 limit보다 큼)
+        예산 안에 들어가는 최근 메시지보다 앞쪽 페이지는 읽지 않습니다.
+        """
+        total = 0
+        for i in range(len(messages) - 1, start - 1, -1):
+            total += estimate_tokens(messages[i]["content"])
+            if total > limit:
+                break
+        return total
+
+    def _cached_summary(self, messages):
+        upto = self.state.get("upto", 0)
+        if upto and upto <= len(messages) and self.state.get("digest") == self._boundary_digest(messages, upto):
+            return self.state["summary"], upto
+        # 다른 세션을 불러왔거나 메시지가 바뀐 경우
+        self.state.clear()
+        return "", 0
+
+    def _summarize(self, summary, messages):
+        from google.genai import types
+
+        transcript = "\n\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+        response = self.client.models.generate_content(
+            model=self.summary_model,
+            contents=f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}",
+            config=types.GenerateContentConfig(
+                system_instruction=SUMMARY_INSTRUCTION,
+                temperature=0.0,
+                thinking_config=types.ThinkingConfig(thinking_budget=0),
+            ),
+        )
+        return response.text or summary
+
+    def _cut_index(self, messages, limit):
+        """최근 메시지의 토큰 합이 limit 이하가 되는 가장 앞 인덱스 (user 메시지에서 시작하도록 맞춤)"""
+        total = 0
+        cut = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            total += estimate_tokens(messages[i]["content"])
+            if total > limit:
+                break
+            cut = i
+        # 최소한 마지막 턴(user + assistant)은 유지
+        cut = min(cut, max(0, len(messages) - 2))
+        while cut < len(messages) and messages[cut]["role"] != "user":
+            cut += 1
+        return cut
+
+    def build(self, messages):
+        """
+        Returns:
+            (sdk_history, stats) - stats: {"tokens", "budget", "summarized", "dropped"}
+        """
+        # 예산 상수만 필요한 UI가 genai SDK까지 로드하지 않도록 여기서 가져옴
+        from ai import gen_sdk_history
+
+        summary, upto = self._cached_summary(messages)
+        summary_tokens = estimate_tokens(summary) if summary else 0
+        recent_tokens = self._recent_tokens(messages, upto, self.budget - summary_tokens)
+        dropped = 0
+
+        if summary_tokens + recent_tokens > self.budget:
+            cut = max(upto, self._cut_index(messages, int(self.budget * RECENT_TOKEN_RATIO)))
+            if cut > upto:
+                try:
+                    summary = self._summarize(summary, messages[upto:cut])
+                    self.state.update({"summary": summary, "upto": cut, "digest": self._boundary_digest(messages, cut)})
+                    upto = cut
+                except Exception as e:
+                    # 요약에 실패하면 오래된 턴을 버림
+                    print(f"Failed to summarize history: {e}")
+                    dropped = cut - upto
+                    upto = cut
+            summary_tokens = estimate_tokens(summary) if summary else 0
+            recent_tokens = sum(estimate_tokens(m["content"]) for m in messages[upto:])
+
+        sdk_history = []
+        if summary:
+            sdk_history.append(gen_sdk_history("user", SUMMARY_PREFIX + summary))
+            sdk_history.append(gen_sdk_history("model", "Understood. I will continue the conversation with this context."))
+        for msg in messages[upto:]:
+            role = "user" if msg["role"] == "user" else "model"
+            sdk_history.append(gen_sdk_history(role, msg["content"]))
+
+        stats = {
+            "tokens": summary_tokens + recent_tokens,
+            "budget": self.budget,
+            "summarized": self.state.get("upto", 0) if summary else 0,
+            "dropped": dropped,
+        }
+        return sdk_history, stats
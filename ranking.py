@@ -0,0 +1,188 @@
+"""
+도구 결과(추출한 웹 페이지, YouTube 자막)를 모델에 보내기 전에 줄이는 로컬 passage 랭킹.
+
+본문을 passage로 나누고 BM25로 질문과의 관련도를 매긴 뒤, 도구 호출당 토큰 예산(RANK_TOKEN_BUDGET) 안에서
+관련도가 높은 passage만 원래 순서대로 남깁니다. (CPU만 사용, 네트워크 호출 없음)
+질문은 도구 인자(query)로 받거나, 없으면 ChatEngine이 턴마다 설정하는 사용자 질문을 사용합니다.
+"""
+import os
+import re
+import math
+import contextvars
+from collections import Counter
+
+from history import estimate_tokens
+
+# 도구 호출 하나의 결과에 허용하는 토큰 수 (0이면 줄이지 않음)
+RANK_TOKEN_BUDGET = int(os.getenv("RANK_TOKEN_BUDGET", 8000))
+# passage 하나의 최대 토큰 수
+RANK_PASSAGE_TOKENS = int(os.getenv("RANK_PASSAGE_TOKENS", 200))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_query = contextvars.ContextVar("rank_query", default=None)
+
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?。])\s+")
+_HEADING_RE = re.compile(r"^#{1,6}\s")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was were what when where "
+    "which who why will with".split()
+)
+
+
+def set_query(text):
+    """현재 턴의 사용자 질문 (도구에 query 인자가 없을 때 사용)"""
+    _query.set(text)
+
+
+def current_query():
+    return _query.get()
+
+
+def index_terms(text):
+    """BM25 색인과 검색에 사용하는 단어 목록 (소문자, 영어 불용어 제외)"""
+    terms = []
+    for word in _WORD_RE.findall(text.lower()):
+        if word.isascii():
+            if len(word) > 1 and word not in _STOPWORDS:
+                terms.append(word)
+            continue
+        terms.append(word)
+        # 조사/어미가 붙는 언어(한국어 등)도 부분 일치하도록 글자 bigram 추가 ("서울에서" -> "서울", "울에", "에서")
+        terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def _split_long(paragraph, max_tokens):
+    """max_tokens를 넘는 문단을 문장 단위로, 문장도 길면 글자 수로 나눕니다."""
+    pieces = []
+    current = ""
+    for sentence in _SENTENCE_RE.split(paragraph):
+        while estimate_tokens(sentence) > max_tokens:
+            # 비ASCII 문자 기준(1.5글자당 1토큰)으로 잘라 예산을 넘지 않도록 함
+            cut = int(max_tokens * 1.5)
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:]
+        if current and estimate_tokens(current + " " + sentence) > max_tokens:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_passages(text, max_tokens=RANK_PASSAGE_TOKENS):
+    """
+    본문을 문단 경계에서 나누고, 짧은 문단은 max_tokens까지 이어 붙입니다. 마크다운 제목에서는 새 passage를 시작합니다.
+    """
+    passages = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) > max_tokens:
+            if current:
+                passages.append(current)
+                current = ""
+            passages.extend(_split_long(paragraph, max_tokens))
+            continue
+        if current and (_HEADING_RE.match(paragraph) or estimate_tokens(current + "\n\n" + paragraph) > max_tokens):
+            passages.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def transcript_passages(segments, max_tokens=RANK_PASSAGE_TOKENS):
+    """
+    자막 조각([[시작 초, 텍스트], ...])을 max_tokens까지 이어 붙여 [(시작 초, 텍스트)] passage로 만듭니다.
+    """
+    passages = []
+    start, texts, tokens = None, [], 0
+    for seg_start, text in segments:
+        cost = estimate_tokens(text)
+        if texts and tokens + cost > max_tokens:
+            passages.append((start, " ".join(texts)))
+            start, texts, tokens = None, [], 0
+        if start is None:
+            start = seg_start
+        texts.append(text)
+        tokens += cost
+    if texts:
+        passages.append((start, " ".join(texts)))
+    return passages
+
+
+def bm25_scores(passages, query):
+    """passages(텍스트 목록) 각각의 query에 대한 BM25 점수"""
+    query_terms = set(index_terms(query or ""))
+    if not query_terms or not passages:
+        return [0.0] * len(passages)
+    docs = [Counter(index_terms(p)) for p in passages]
+    lengths = [sum(doc.values()) for doc in docs]
+    avg_length = sum(lengths) / len(docs) or 1.0
+    n = len(docs)
+    idf = {}
+    for term in query_terms:
+        df = sum(1 for doc in docs if term in doc)
+        idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+    scores = []
+    for doc, length in zip(docs, lengths):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        scores.append(sum(idf[t] * doc[t] * (BM25_K1 + 1) / (doc[t] + norm) for t in query_terms if t in doc))
+    return scores
+
+
+def select_passages(documents, query, budget=RANK_TOKEN_BUDGET):
+    """
+    여러 문서의 passage 중 query와 관련도가 높은 것만 budget 토큰 안에서 고릅니다.
+    각 문서에서 가장 관련 있는 passage를 먼저 하나씩 넣고, 남은 예산은 점수 순으로 채웁니다.
+    query와 겹치는 passage가 있으면 겹치지 않는 passage로는 예산을 채우지 않습니다.
+    (query가 없거나 점수가 같으면 문서 앞부분을 우선)
+
+    Args:
+        documents: [[passage 텍스트, ...], ...]
+    Returns:
+        문서별로 선택된 passage 인덱스 목록 (원래 순서)
+    """
+    flat = [(d, p, text) for d, passages in enumerate(documents) for p, text in enumerate(passages)]
+    scores = bm25_scores([text for _, _, text in flat], query)
+    order = sorted(range(len(flat)), key=lambda i: (-scores[i], flat[i][1], flat[i][0]))
+    best_per_document = list({flat[i][0]: i for i in reversed(order)}.values())
+    best_per_document.sort(key=lambda i: (-scores[i], flat[i][1]))
+
+    if any(scores):
+        order = [i for i in order if scores[i] > 0]
+
+    chosen = set()
+    used = 0
+    for i in best_per_document + order:
+        if i in chosen:
+            continue
+        cost = estimate_tokens(flat[i][2])
+        if used + cost > budget:
+            continue
+        chosen.add(i)
+        used += cost
+    selected = [[] for _ in documents]
+    for i in sorted(chosen):
+        selected[flat[i][0]].append(flat[i][1])
+    return selected
+
+
+def fits_budget(texts, budget=RANK_TOKEN_BUDGET):
+    return budget <= 0 or sum(estimate_tokens(t) for t in texts) <= budget
@@ -0,0 +1,203 @@
+"""
+Streamlit 없이 ChatEngine을 HTTP로 제공하는 경량 서버.
+
+    python server.py                     # SERVER_HOST/SERVER_PORT (기본 0.0.0.0:8000)
+
+POST /v1/chat
+    {"prompt": "...", "session": "name"(선택), "messages": [...](선택, 세션 없이 이전 대화 전달),
+     "model", "temperature", "search_mode": "google|maps|code|external|none", "history_budget",
+     "context_cache": bool, "location": {"latitude", "longitude"}, "stream": true}
+    google_web_search 등 generate_config의 도구 옵션을 직접 지정하면 search_mode의 기본값을 덮어씁니다.
+    stream=true(기본)이면 text/event-stream으로 ChatEngine 이벤트를 전달합니다. (event: <type>, data: <json>)
+    stream=false이면 최종 답변과 인용, 도구 호출 목록을 JSON으로 반환합니다.
+GET /v1/sessions, GET /health, GET /metrics
+"""
+import os
+import json
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache import TTLCache
+from engine import ChatEngine, tool_options, SEARCH_MODES, TOOL_OPTION_NAMES
+from history import HISTORY_TOKEN_BUDGET
+from session_store import get_session_backend, sanitize_session_name
+from tracing import METRICS
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+# 세션별 상태(요약 캐시, 컨텍스트 캐시 등)를 메모리에 유지하는 시간
+SERVER_SESSION_TTL = int(os.getenv("SERVER_SESSION_TTL", 3600))
+
+# 세션 이름 -> state
+_session_states = TTLCache(maxsize=256, ttl=SERVER_SESSION_TTL)
+# 세션 이름 -> [lock, 잠금을 기다리거나 잡고 있는 요청 수]. 같은 세션의 요청은 순서대로 처리
+# (state 캐시와 따로 두어, 요청이 잠금을 잡고 있는 동안 state가 밀려나도 잠금은 유지됨)
+_session_locks = {}
+_session_states_lock = threading.Lock()
+
+
+def _session_state(name):
+    with _session_states_lock:
+        state = _session_states.get(name)
+        if state is None:
+            state = {}
+        # 사용할 때마다 TTL 연장
+        _session_states.set(name, state)
+        return state
+
+
+@contextmanager
+def _session_lock(name):
+    with _session_states_lock:
+        entry = _session_locks.setdefault(name, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _session_states_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _session_locks[name]
+
+
+def _engine_for(request, state):
+    search_mode = request.get("search_mode", "google")
+    if search_mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search_mode: {search_mode}")
+    return ChatEngine(
+        state=state,
+        model=request.get("model"),
+        temperature=float(request.get("temperature", 0.2)),
+        options=tool_options(search_mode, **{k: request.get(k) for k in TOOL_OPTION_NAMES}),
+        history_budget=int(request.get("history_budget", HISTORY_TOKEN_BUDGET)),
+        use_context_cache=bool(request.get("context_cache", False)),
+        location=request.get("location") or {},
+    )
+
+
+class ChatRequestHandler(BaseHTTPRequestHandler):
+    server_version = "Dumblexity/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/health":
+            self._send_json({"status": "ok"})
+        elif path == "/metrics":
+            data = METRICS.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == "/v1/sessions":
+            self._send_json({"sessions": get_session_backend().list_sessions(limit=100)})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/v1/chat":
+            self._send_json({"error": "not found"}, status=404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("request body must be a JSON object")
+            prompt = request.get("prompt")
+            if not prompt:
+                raise ValueError("prompt is required")
+            if not isinstance(request.get("session"), (str, type(None))):
+                raise ValueError("session must be a string")
+            if not isinstance(request.get("messages"), (list, type(None))):
+                raise ValueError("messages must be a list")
+            session_name = sanitize_session_name(request.get("session"))
+        except ValueError as e:
+            self._send_json({"error": str(e)}, status=400)
+            return
+
+        with _session_lock(session_name) if session_name else nullcontext():
+            # 잠금을 잡은 뒤에 state를 가져와야 앞선 요청이 변경한 state를 이어서 사용함
+            if session_name:
+                state = _session_state(session_name)
+            else:
+                state = {"messages": list(request.get("messages") or [])}
+            try:
+                engine = _engine_for(request, state)
+                if session_name and state.get("current_session_name") != session_name:
+                    if get_session_backend().exists(session_name):
+                        engine.load(session_name)
+                    else:
+                        state["current_session_name"] = session_name
+            except Exception as e:
+                self._send_json({"error": str(e)}, status=400)
+                return
+
+            if request.get("stream", True):
+                self._stream(engine.ask(prompt))
+            else:
+                self._respond(engine.ask(prompt))
+
+    def _stream(self, events):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for event in events:
+                self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 클라이언트 연결이 끊기면 생성 중단 (events.close()로 작업 스레드에 전달)
+            events.close()
+        except Exception as e:
+            print(f"Chat request failed: {e}")
+            try:
+                self.wfile.write(f"event: error\ndata: {json.dumps({'type': 'error', 'error': str(e)})}\n\n".encode("utf-8"))
+            except OSError:
+                pass
+
+    def _respond(self, events):
+        result = {"content": "", "citations": [], "tool_calls": [], "trace": None}
+        try:
+            for event in events:
+                if event["type"] == "citations":
+                    result["citations"].append({"header": event["header"], "text": event["text"]})
+                elif event["type"] == "tool_call":
+                    result["tool_calls"].extend(event["calls"])
+                elif event["type"] == "done":
+                    result["content"] = event["content"]
+                    result["trace"] = event["trace"]
+        except Exception as e:
+            print(f"Chat request failed: {e}")
+            self._send_json({"error": str(e)}, status=502)
+            return
+        self._send_json(result)
+
+
+def main():
+    server = ThreadingHTTPServer((SERVER_HOST, SERVER_PORT), ChatRequestHandler)
+    server.daemon_threads = True
+    print(f"Serving chat API on http://{SERVER_HOST}:{SERVER_PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
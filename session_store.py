@@ -0,0 +1,973 @@
+import os
+import re
+import json
+import glob
+import math
+import time
+import zlib
+import fcntl
+import struct
+import sqlite3
+import threading
+from collections import defaultdict
+from collections.abc import MutableSequence
+from contextlib import contextmanager
+from functools import lru_cache
+
+SESSION_DIR = "sessions"
+os.makedirs(SESSION_DIR, exist_ok=True)
+
+# "sqlite" (기본값), "packed" (압축 파일) 또는 "jsonl"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+# 세션을 열 때 먼저 읽어오는 최근 메시지 수 (이전 메시지는 필요할 때 페이지 단위로 읽음)
+SESSION_TAIL_MESSAGES = int(os.getenv("SESSION_TAIL_MESSAGES", 40))
+# 페이지 크기 (packed 백엔드에서 한 번에 압축하는 메시지 수, 이전 메시지를 읽어오는 단위)
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", 50))
+
+
+class SessionBackend:
+    """
+    세션 저장소 인터페이스.
+    list_sessions()는 최근 수정 순으로 {"name", "message_count", "updated_at", "size"} 목록을,
+    search()는 관련도 순으로 {"session", "seq", "role", "snippet", "score"} 목록을 반환합니다.
+    """
+
+    def list_sessions(self, limit=None, offset=0):
+        raise NotImplementedError
+
+    def count_sessions(self):
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def load(self, name):
+        raise NotImplementedError
+
+    def message_count(self, name):
+        return len(self.load(name))
+
+    def load_range(self, name, start, stop):
+        """seq가 start 이상 stop 미만인 메시지"""
+        return self.load(name)[start:stop]
+
+    def load_paged(self, name, tail=SESSION_TAIL_MESSAGES):
+        """최근 tail개의 메시지만 읽은 PagedMessages를 반환합니다. (이전 메시지는 접근할 때 읽음)"""
+        return PagedMessages(lambda start, stop: self.load_range(name, start, stop), self.message_count(name), tail)
+
+    def append(self, name, messages):
+        raise NotImplementedError
+
+    def replace(self, name, messages):
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def load_sources(self, name):
+        """세션과 함께 저장된 소스 저장소 데이터 (SessionSources.dump()의 결과, 없으면 None)"""
+        raise NotImplementedError
+
+    def save_sources(self, name, data):
+        """data가 None이면 저장된 소스 저장소를 삭제합니다."""
+        raise NotImplementedError
+
+    def search(self, query, limit=20):
+        raise NotImplementedError
+
+
+class PagedMessages(MutableSequence):
+    """
+    뒤쪽 메시지만 메모리에 두고, 앞쪽 메시지는 처음 접근할 때 SESSION_PAGE_SIZE 단위로 읽어오는 메시지 목록.
+    list처럼 사용할 수 있습니다. (append, 인덱스/슬라이스, 반복 등)
+    화면 렌더링은 최근 메시지만 접근하므로 긴 세션도 열 때는 tail개만 디코딩합니다.
+    UI 스레드와 ChatEngine 스레드에서 함께 사용하므로 접근은 lock으로 직렬화합니다.
+    """
+
+    def __init__(self, loader, total, tail=SESSION_TAIL_MESSAGES, page_size=SESSION_PAGE_SIZE):
+        self._loader = loader
+        self._page_size = page_size
+        self._lock = threading.RLock()
+        # 아직 읽지 않은 앞쪽 메시지 수
+        self._offset = max(0, total - tail)
+        self._items = loader(self._offset, total) if total else []
+
+    @property
+    def unloaded(self):
+        return self._offset
+
+    def _load_before(self, index):
+        if index >= self._offset:
+            return
+        start = index - index % self._page_size
+        older = self._loader(start, self._offset)
+        if len(older) != self._offset - start:
+            raise RuntimeError("Session changed on disk while it was open; reload it.")
+        self._items[:0] = older
+        self._offset = start
+
+    def _index(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("message index out of range")
+        return index
+
+    def __len__(self):
+        return self._offset + len(self._items)
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                indices = range(*index.indices(len(self)))
+                if indices:
+                    self._load_before(min(indices[0], indices[-1]))
+                return [self._items[i - self._offset] for i in indices]
+            index = self._index(index)
+            self._load_before(index)
+            return self._items[index - self._offset]
+
+    def __setitem__(self, index, value):
+        with self._lock:
+            if isinstance(index, slice):
+                self._load_before(0)
+                self._items[index] = value
+                return
+            index = self._index(index)
+            self._load_before(index)
+            self._items[index - self._offset] = value
+
+    def __delitem__(self, index):
+        with self._lock:
+            self._load_before(0)
+            del self._items[index]
+
+    def insert(self, index, value):
+        with self._lock:
+            index = max(0, min(len(self), index + len(self) if index < 0 else index))
+            self._load_before(index)
+            self._items.insert(index - self._offset, value)
+
+    def __iter__(self):
+        with self._lock:
+            self._load_before(0)
+            items = list(self._items)
+        return iter(items)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, PagedMessages)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"PagedMessages({len(self)} messages, {self._offset} not loaded)"
+
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _make_snippet(content, terms, width=60):
+    lowered = content.lower()
+    positions = [lowered.find(t) for t in terms if lowered.find(t) >= 0]
+    pos = min(positions) if positions else 0
+    start = max(0, pos - width // 2)
+    snippet = content[start:start + width * 2].replace("\n", " ")
+    return ("…" if start > 0 else "") + snippet + ("…" if start + width * 2 < len(content) else "")
+
+
+class _InvertedIndex:
+    """
+    메시지 단위 인메모리 역색인. 검색어는 단어 접두어로 매칭합니다. (예: "서울" -> "서울에서")
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)  # token -> {(session, seq): term frequency}
+        self.docs = {}  # (session, seq) -> (role, content)
+        self.doc_tokens = {}  # (session, seq) -> set(tokens)
+
+    def add(self, name, seq, message):
+        key = (name, seq)
+        tokens = _TOKEN_RE.findall(message["content"].lower())
+        self.docs[key] = (message["role"], message["content"])
+        self.doc_tokens[key] = set(tokens)
+        for token in tokens:
+            self.postings[token][key] = self.postings[token].get(key, 0) + 1
+
+    def remove_session(self, name):
+        for key in [k for k in self.docs if k[0] == name]:
+            for token in self.doc_tokens.pop(key):
+                self.postings[token].pop(key, None)
+                if not self.postings[token]:
+                    del self.postings[token]
+            del self.docs[key]
+
+    def search(self, query, limit=20):
+        terms = _TOKEN_RE.findall(query.lower())
+        if not terms:
+            return []
+        scores = None
+        for term in terms:
+            term_scores = defaultdict(float)
+            for token in [t for t in self.postings if t.startswith(term)]:
+                idf = math.log(1 + len(self.docs) / len(self.postings[token]))
+                for key, tf in self.postings[token].items():
+                    term_scores[key] += tf * idf
+            # 모든 검색어를 포함한 메시지만 남김 (AND)
+            scores = term_scores if scores is None else {k: v + term_scores[k] for k, v in scores.items() if k in term_scores}
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+        return [{"session": name, "seq": seq, "role": self.docs[(name, seq)][0],
+                 "snippet": _make_snippet(self.docs[(name, seq)][1], terms), "score": score}
+                for (name, seq), score in ranked]
+
+
+# --- JSONL backend ---
+# 세션은 append-only JSONL 로그로 저장합니다. 한 줄이 하나의 레코드:
+#   {"op": "append", "message": {...}}  메시지 추가
+#   {"op": "reset"}                     이전 레코드 무시 (다른 대화로 덮어쓸 때)
+# 죽은 레코드(reset 이전)는 백그라운드에서 압축(compaction)하여 원자적으로 교체합니다.
+
+def _read_session_log(file_path):
+    """
+    로그를 재생해 (메시지 목록, 전체 레코드 수)를 반환합니다. 마지막 줄이 잘려 있으면(쓰는 도중 종료) 무시합니다.
+    """
+    messages = []
+    records = 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records += 1
+            if record.get("op") == "reset":
+                messages = []
+            elif record.get("op") == "append":
+                messages.append(record["message"])
+    return messages, records
+
+
+def _repair_tail(f):
+    # 이전 쓰기가 중간에 끊겨 마지막 줄이 개행으로 끝나지 않으면 잘린 부분을 제거
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size == 0:
+        return
+    f.seek(size - 1)
+    if f.read(1) == b"\n":
+        return
+    f.seek(0)
+    data = f.read()
+    f.truncate(data.rfind(b"\n") + 1)
+
+
+def _write_session_log_atomic(file_path, messages):
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for message in messages:
+            f.write(json.dumps({"op": "append", "message": message}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class JsonlSessionBackend(SessionBackend):
+    """
+    세션마다 하나의 JSONL 로그 파일을 사용하는 백엔드.
+    여러 프로세스(컨테이너)가 같은 디렉토리를 공유할 수 있도록 디렉토리 단위 flock으로 쓰기를 직렬화합니다.
+    목록(index)은 파일의 mtime과 크기가 바뀐 세션만 다시 읽습니다. (다른 프로세스가 이어서 쓴 경우도 반영)
+    """
+
+    # 세션 파일 확장자. 첫 번째가 현재 형식이고 나머지는 열 때 변환하는 이전 형식
+    extensions = (".jsonl", ".json")
+
+    def __init__(self, session_dir=SESSION_DIR):
+        self.session_dir = session_dir
+        self._lock = threading.RLock()
+        self._index = {}
+        self._search_index = None
+
+    def _paths(self, name):
+        return [os.path.join(self.session_dir, name + ext) for ext in self.extensions]
+
+    def _path(self, name):
+        return self._paths(name)[0]
+
+    @contextmanager
+    def _file_lock(self):
+        with self._lock:
+            with open(os.path.join(self.session_dir, ".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_messages(self, path):
+        if path.endswith(".jsonl"):
+            return _read_session_log(path)[0]
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _count_messages(self, path):
+        return len(self._read_messages(path))
+
+    def _write_atomic(self, path, messages):
+        _write_session_log_atomic(path, messages)
+
+    def _migrate_legacy(self, name):
+        """이전 형식(indent JSON(.json) 등)으로 저장된 세션을 현재 형식으로 변환합니다."""
+        for legacy_path in self._paths(name)[1:]:
+            if not os.path.exists(legacy_path):
+                continue
+            with self._file_lock():
+                if not os.path.exists(legacy_path):
+                    continue
+                if not os.path.exists(self._path(name)):
+                    self._write_atomic(self._path(name), self._read_messages(legacy_path))
+                os.remove(legacy_path)
+
+    def _update_index(self, name, message_count):
+        path = self._path(name)
+        stat = os.stat(path)
+        with self._lock:
+            self._index[name] = {"name": name, "message_count": message_count, "updated_at": stat.st_mtime, "size": stat.st_size}
+
+    def _cached_count(self, name, stat):
+        """파일이 마지막으로 색인한 상태(mtime, 크기) 그대로일 때만 캐시된 메시지 수"""
+        cached = self._index.get(name)
+        if cached and cached["updated_at"] == stat.st_mtime and cached["size"] == stat.st_size:
+            return cached["message_count"]
+        return None
+
+    def _refresh_index(self):
+        # 디렉토리 mtime은 기존 파일에 이어 쓸 때 바뀌지 않으므로 파일마다 확인
+        with self._lock:
+            index = {}
+            paths = [p for ext in self.extensions for p in glob.glob(os.path.join(self.session_dir, "*" + ext))]
+            for path in paths:
+                name = os.path.splitext(os.path.basename(path))[0]
+                if name in index:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if self._cached_count(name, stat) is not None:
+                    index[name] = self._index[name]
+                    continue
+                try:
+                    message_count = self._count_messages(path)
+                except Exception:
+                    message_count = 0
+                index[name] = {"name": name, "message_count": message_count, "updated_at": stat.st_mtime, "size": stat.st_size}
+            self._index = index
+
+    def list_sessions(self, limit=None, offset=0):
+        self._refresh_index()
+        with self._lock:
+            items = sorted(self._index.values(), key=lambda x: x["updated_at"], reverse=True)
+        return items[offset:offset + limit if limit else None]
+
+    def count_sessions(self):
+        self._refresh_index()
+        return len(self._index)
+
+    def exists(self, name):
+        return any(os.path.exists(path) for path in self._paths(name))
+
+    def load(self, name):
+        self._migrate_legacy(name)
+        messages, records = _read_session_log(self._path(name))
+        if records > len(messages):
+            self._schedule_compaction(name)
+        return messages
+
+    def load_paged(self, name, tail=SESSION_TAIL_MESSAGES):
+        # 로그 전체를 재생해야 메시지 목록이 확정되므로 페이지 단위로 나눠 읽는 이점이 없음
+        return self.load(name)
+
+    def _write_records(self, path, records):
+        # 파일 잠금을 잡은 상태에서 호출
+        payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        with open(path, "ab+") as f:
+            _repair_tail(f)
+            f.seek(0, os.SEEK_END)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append_records(self, name, records):
+        with self._file_lock():
+            self._write_records(self._path(name), records)
+
+    def append(self, name, messages):
+        self._migrate_legacy(name)
+        path = self._path(name)
+        with self._file_lock():
+            # 다른 프로세스가 같은 세션에 이어서 썼을 수 있으므로 잠금 안에서 현재 메시지 수를 확인
+            start_seq = None
+            if os.path.exists(path):
+                start_seq = self._cached_count(name, os.stat(path))
+                if start_seq is None:
+                    start_seq = self._count_messages(path)
+            start_seq = start_seq or 0
+            if messages:
+                self._write_records(path, [{"op": "append", "message": m} for m in messages])
+            self._update_index(name, start_seq + len(messages))
+        self._index_messages(name, start_seq, messages)
+
+    def replace(self, name, messages):
+        # 다른 대화로 덮어쓰기: reset 레코드 후 전체 메시지 append, 죽은 레코드는 백그라운드에서 압축
+        self._migrate_legacy(name)
+        path = self._path(name)
+        existed = os.path.exists(path) and os.path.getsize(path) > 0
+        records = [{"op": "reset"}] if existed else []
+        self._append_records(name, records + [{"op": "append", "message": m} for m in messages])
+        if existed:
+            self._schedule_compaction(name)
+        self._update_index(name, len(messages))
+        with self._lock:
+            if self._search_index is not None:
+                self._search_index.remove_session(name)
+        self._index_messages(name, 0, messages)
+
+    def delete(self, name):
+        with self._file_lock():
+            for path in self._paths(name) + [self._sources_path(name)]:
+                if os.path.exists(path):
+                    os.remove(path)
+        with self._lock:
+            self._index.pop(name, None)
+            if self._search_index is not None:
+                self._search_index.remove_session(name)
+
+    def _sources_path(self, name):
+        return os.path.join(self.session_dir, name + ".sources")
+
+    def load_sources(self, name):
+        try:
+            with open(self._sources_path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save_sources(self, name, data):
+        path = self._sources_path(name)
+        with self._file_lock():
+            if data is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+    def _index_messages(self, name, start_seq, messages):
+        with self._lock:
+            if self._search_index is None:
+                return
+            for i, message in enumerate(messages):
+                self._search_index.add(name, start_seq + i, message)
+
+    def search(self, query, limit=20):
+        with self._lock:
+            if self._search_index is None:
+                # 첫 검색 시 한 번만 전체 세션을 색인하고, 이후에는 저장할 때마다 증분 업데이트
+                self._search_index = _InvertedIndex()
+                for info in self.list_sessions():
+                    for seq, message in enumerate(self.load(info["name"])):
+                        self._search_index.add(info["name"], seq, message)
+            return self._search_index.search(query, limit)
+
+    def _compact(self, name):
+        path = self._path(name)
+        try:
+            with self._file_lock():
+                if not os.path.exists(path):
+                    return
+                messages, records = _read_session_log(path)
+                if records > len(messages):
+                    _write_session_log_atomic(path, messages)
+        except Exception as e:
+            print(f"Failed to compact session log {path}: {e}")
+
+    def _schedule_compaction(self, name):
+        threading.Thread(target=self._compact, args=(name,), daemon=True).start()
+
+
+# --- Packed backend ---
+# 세션마다 하나의 압축 파일(.pack)을 사용합니다.
+#   헤더 (20 bytes): magic "DLXPACK1", 인덱스 위치 (uint64), 인덱스 길이 (uint32)
+#   페이지: 메시지 최대 SESSION_PAGE_SIZE개의 JSON 배열을 zlib으로 압축한 것
+#   인덱스: {"count", "pages": [[위치, 길이, 메시지 수], ...], "garbage"}를 zlib으로 압축한 것
+# 추가 저장은 새 페이지와 새 인덱스를 파일 끝에 쓰고 fsync한 뒤 헤더의 인덱스 위치를 바꿉니다.
+# (도중에 종료되어도 헤더는 이전 인덱스를 가리키므로 파일이 깨지지 않음)
+# 작은 페이지가 쌓이거나 버려진 바이트가 살아있는 바이트보다 많아지면 페이지를 다시 묶어 원자적으로 교체합니다.
+
+PACK_MAGIC = b"DLXPACK1"
+_PACK_HEADER = struct.Struct("<8sQI")
+PACK_COMPRESS_LEVEL = int(os.getenv("PACK_COMPRESS_LEVEL", 6))
+# 가득 차지 않은 페이지를 이 개수보다 많이 허용하지 않음 (턴마다 2개씩 추가되는 작은 페이지)
+PACK_SMALL_PAGE_SLACK = 8
+
+
+def _encode_page(messages):
+    data = json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(data, PACK_COMPRESS_LEVEL)
+
+
+def _decode_page(data):
+    return json.loads(zlib.decompress(data))
+
+
+def _page_frames(messages, page_size=SESSION_PAGE_SIZE):
+    pages = [messages[i:i + page_size] for i in range(0, len(messages), page_size)]
+    return [(_encode_page(page), len(page)) for page in pages]
+
+
+def _read_pack_index(f):
+    """(인덱스, 인덱스 길이)"""
+    f.seek(0)
+    magic, offset, length = _PACK_HEADER.unpack(f.read(_PACK_HEADER.size))
+    if magic != PACK_MAGIC:
+        raise ValueError("Not a session pack file.")
+    f.seek(offset)
+    return json.loads(zlib.decompress(f.read(length))), length
+
+
+def _read_pack_pages(f, pages):
+    messages = []
+    for offset, length, _ in pages:
+        f.seek(offset)
+        messages.extend(_decode_page(f.read(length)))
+    return messages
+
+
+def _write_pack_tail(f, index, frames):
+    """압축된 페이지(frames: [(bytes, 메시지 수)])와 새 인덱스를 파일 끝에 쓰고 헤더가 새 인덱스를 가리키게 합니다."""
+    f.seek(0, os.SEEK_END)
+    for data, count in frames:
+        index["pages"].append([f.tell(), len(data), count])
+        index["count"] += count
+        f.write(data)
+    index_offset = f.tell()
+    index_data = zlib.compress(json.dumps(index).encode("utf-8"))
+    f.write(index_data)
+    f.flush()
+    os.fsync(f.fileno())
+    f.seek(0)
+    f.write(_PACK_HEADER.pack(PACK_MAGIC, index_offset, len(index_data)))
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _write_pack_atomic(file_path, frames):
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PACK_HEADER.pack(PACK_MAGIC, 0, 0))
+        _write_pack_tail(f, {"count": 0, "pages": [], "garbage": 0}, frames)
+    os.replace(tmp_path, file_path)
+
+
+def _repack_frames(f, pages, page_size=SESSION_PAGE_SIZE):
+    """가득 찬 페이지는 압축된 그대로 복사하고, 작은 페이지는 풀어서 page_size개씩 다시 묶습니다."""
+    frames = []
+    buffer = []
+    for offset, length, count in pages:
+        f.seek(offset)
+        data = f.read(length)
+        if count >= page_size and not buffer:
+            frames.append((data, count))
+            continue
+        buffer.extend(_decode_page(data))
+        while len(buffer) >= page_size:
+            frames.append((_encode_page(buffer[:page_size]), page_size))
+            buffer = buffer[page_size:]
+    if buffer:
+        frames.append((_encode_page(buffer), len(buffer)))
+    return frames
+
+
+class PackedSessionBackend(JsonlSessionBackend):
+    """
+    세션마다 하나의 압축 파일(.pack)을 사용하는 백엔드. 인덱스로 필요한 페이지만 골라 풀 수 있으므로
+    긴 세션도 최근 메시지만 디코딩해서 열 수 있습니다. 목록, 검색, 파일 잠금은 JSONL 백엔드와 같습니다.
+    """
+
+    extensions = (".pack", ".jsonl", ".json")
+
+    def _read_messages(self, path):
+        if path.endswith(".pack"):
+            with open(path, "rb") as f:
+                return _read_pack_pages(f, _read_pack_index(f)[0]["pages"])
+        return super()._read_messages(path)
+
+    def _count_messages(self, path):
+        if path.endswith(".pack"):
+            with open(path, "rb") as f:
+                return _read_pack_index(f)[0]["count"]
+        return super()._count_messages(path)
+
+    def _write_atomic(self, path, messages):
+        _write_pack_atomic(path, _page_frames(messages))
+
+    def load(self, name):
+        self._migrate_legacy(name)
+        return self._read_messages(self._path(name))
+
+    def message_count(self, name):
+        self._migrate_legacy(name)
+        return self._count_messages(self._path(name))
+
+    def load_range(self, name, start, stop):
+        messages = []
+        with open(self._path(name), "rb") as f:
+            seq = 0
+            for offset, length, count in _read_pack_index(f)[0]["pages"]:
+                if seq < stop and seq + count > start:
+                    f.seek(offset)
+                    page = _decode_page(f.read(length))
+                    messages.extend(page[max(0, start - seq):stop - seq])
+                seq += count
+        return messages
+
+    load_paged = SessionBackend.load_paged
+
+    def append(self, name, messages):
+        self._migrate_legacy(name)
+        path = self._path(name)
+        with self._file_lock():
+            if not os.path.exists(path):
+                _write_pack_atomic(path, _page_frames(messages))
+                count = len(messages)
+            else:
+                with open(path, "r+b") as f:
+                    index, index_length = _read_pack_index(f)
+                    if messages:
+                        # 이전 인덱스는 더 이상 참조되지 않음
+                        index["garbage"] += index_length
+                        _write_pack_tail(f, index, _page_frames(messages))
+                count = index["count"]
+                live = sum(page[1] for page in index["pages"])
+                if (index["garbage"] > live
+                        or len(index["pages"]) > math.ceil(count / SESSION_PAGE_SIZE) + PACK_SMALL_PAGE_SLACK):
+                    self._repack(path)
+            self._update_index(name, count)
+        self._index_messages(name, count - len(messages), messages)
+
+    def _repack(self, path):
+        with open(path, "rb") as f:
+            frames = _repack_frames(f, _read_pack_index(f)[0]["pages"])
+        _write_pack_atomic(path, frames)
+
+    def replace(self, name, messages):
+        with self._file_lock():
+            self._write_atomic(self._path(name), messages)
+            for legacy_path in self._paths(name)[1:]:
+                if os.path.exists(legacy_path):
+                    os.remove(legacy_path)
+        self._update_index(name, len(messages))
+        with self._lock:
+            if self._search_index is not None:
+                self._search_index.remove_session(name)
+        self._index_messages(name, 0, messages)
+
+
+# --- SQLite backend ---
+
+# FTS5 색인(messages_fts)이 가리키는 명시적 id 열. 암묵적 rowid는 VACUUM 시 번호가 바뀔 수 있음
+_MESSAGES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        session TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        extra TEXT,
+        UNIQUE (session, seq)
+    );
+"""
+
+class SqliteSessionBackend(SessionBackend):
+    """
+    SQLite(WAL 모드) 기반 백엔드. 세션 메타데이터(sessions 테이블)가 목록 조회용 인덱스 역할을 합니다.
+    여러 프로세스가 같은 DB 파일을 안전하게 공유할 수 있습니다. (WAL은 공유 메모리를 사용하므로 같은 호스트의 볼륨이어야 함)
+    """
+
+    def __init__(self, session_dir=SESSION_DIR, db_name="sessions.db"):
+        self.session_dir = session_dir
+        self.db_path = os.path.join(session_dir, db_name)
+        self._local = threading.local()
+        # executescript는 자체적으로 커밋하므로 트랜잭션 밖에서 실행 (CREATE IF NOT EXISTS는 멱등)
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                name TEXT PRIMARY KEY,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions(updated_at DESC);
+        """ + _MESSAGES_TABLE_SQL.format(name="messages") + """
+            CREATE TABLE IF NOT EXISTS session_sources (
+                session TEXT PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+        """)
+        self._migrate_message_ids()
+        self._fts_tokenizer = self._init_fts()
+        self._import_files()
+
+    def _migrate_message_ids(self):
+        """id 열이 없는 이전 messages 테이블(PRIMARY KEY (session, seq))을 id 열이 있는 테이블로 옮깁니다."""
+        def _has_id(conn):
+            return any(row[1] == "id" for row in conn.execute("PRAGMA table_info(messages)"))
+
+        if _has_id(self._conn()):
+            return
+        with self._transaction() as conn:
+            if _has_id(conn):
+                return
+            # rowid를 기준으로 만든 FTS 색인과 트리거는 _init_fts에서 id 기준으로 다시 만듦
+            conn.execute("DROP TRIGGER IF EXISTS messages_fts_ai")
+            conn.execute("DROP TRIGGER IF EXISTS messages_fts_ad")
+            conn.execute("DROP TABLE IF EXISTS messages_fts")
+            conn.execute(_MESSAGES_TABLE_SQL.format(name="messages_new"))
+            conn.execute("""
+                INSERT INTO messages_new (id, session, seq, role, content, extra)
+                SELECT rowid, session, seq, role, content, extra FROM messages ORDER BY rowid
+            """)
+            conn.execute("DROP TABLE messages")
+            conn.execute("ALTER TABLE messages_new RENAME TO messages")
+
+    def _init_fts(self):
+        """
+        메시지 본문에 대한 FTS5 색인(messages_fts)을 만들고 트리거로 자동 갱신합니다.
+        한국어처럼 조사가 붙는 언어도 부분 일치가 되도록 가능하면 trigram 토크나이저를 사용합니다.
+        """
+        conn = self._conn()
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        if row is not None:
+            return "trigram" if "trigram" in row[0] else "unicode61"
+        tokenizer = "trigram" if sqlite3.sqlite_version_info >= (3, 34, 0) else "unicode61"
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is not None:
+                return tokenizer
+            conn.execute(f"CREATE VIRTUAL TABLE messages_fts USING fts5(content, content='messages', content_rowid='id', tokenize='{tokenizer}')")
+            conn.execute("""
+                CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END
+            """)
+            # 이미 저장된 메시지 색인 (FTS 도입 이전에 만들어진 DB)
+            conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        return tokenizer
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        # IMMEDIATE: 트랜잭션 시작 시점에 쓰기 락을 잡아 다른 프로세스와의 경합을 막음
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row(message):
+        extra = {k: v for k, v in message.items() if k not in ("role", "content")}
+        return message["role"], message["content"], json.dumps(extra, ensure_ascii=False) if extra else None
+
+    @staticmethod
+    def _message(role, content, extra):
+        message = {"role": role, "content": content}
+        if extra:
+            message.update(json.loads(extra))
+        return message
+
+    def _insert(self, conn, name, start_seq, messages):
+        rows = [(name, start_seq + i, *self._row(m)) for i, m in enumerate(messages)]
+        conn.executemany("INSERT INTO messages (session, seq, role, content, extra) VALUES (?, ?, ?, ?, ?)", rows)
+        return sum(len(r[3].encode("utf-8")) for r in rows)
+
+    def _import_files(self):
+        """JSONL/JSON 파일로 저장된 기존 세션을 DB로 가져옵니다. (가져온 파일은 .migrated로 이름 변경)"""
+        jsonl = JsonlSessionBackend(self.session_dir)
+        paths = glob.glob(os.path.join(self.session_dir, "*.jsonl")) + glob.glob(os.path.join(self.session_dir, "*.json"))
+        for name in dict.fromkeys(os.path.splitext(os.path.basename(p))[0] for p in paths):
+            try:
+                messages = jsonl.load(name)
+                with self._transaction() as conn:
+                    if conn.execute("SELECT 1 FROM sessions WHERE name = ?", (name,)).fetchone() is None:
+                        self._replace(conn, name, messages)
+                path = jsonl._path(name)
+                os.replace(path, path + ".migrated")
+                print(f"Migrated session '{name}' to SQLite.")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Failed to migrate session '{name}': {e}")
+
+    def list_sessions(self, limit=None, offset=0):
+        rows = self._conn().execute(
+            "SELECT name, message_count, updated_at, size FROM sessions ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (limit if limit else -1, offset),
+        ).fetchall()
+        return [{"name": r[0], "message_count": r[1], "updated_at": r[2], "size": r[3]} for r in rows]
+
+    def count_sessions(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def exists(self, name):
+        return self._conn().execute("SELECT 1 FROM sessions WHERE name = ?", (name,)).fetchone() is not None
+
+    def load(self, name):
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM sessions WHERE name = ?", (name,)).fetchone() is None:
+            raise FileNotFoundError(f"Session '{name}' not found.")
+        rows = conn.execute("SELECT role, content, extra FROM messages WHERE session = ? ORDER BY seq", (name,)).fetchall()
+        return [self._message(*r) for r in rows]
+
+    def message_count(self, name):
+        row = self._conn().execute("SELECT message_count FROM sessions WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Session '{name}' not found.")
+        return row[0]
+
+    def load_range(self, name, start, stop):
+        rows = self._conn().execute(
+            "SELECT role, content, extra FROM messages WHERE session = ? AND seq >= ? AND seq < ? ORDER BY seq",
+            (name, start, stop),
+        ).fetchall()
+        return [self._message(*r) for r in rows]
+
+    def append(self, name, messages):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT message_count FROM sessions WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO sessions (name, created_at, updated_at) VALUES (?, ?, ?)", (name, now, now))
+            count = row[0] if row else 0
+            size = self._insert(conn, name, count, messages)
+            conn.execute("UPDATE sessions SET message_count = message_count + ?, size = size + ?, updated_at = ? WHERE name = ?",
+                         (len(messages), size, now, name))
+
+    def _replace(self, conn, name, messages):
+        now = time.time()
+        conn.execute("DELETE FROM messages WHERE session = ?", (name,))
+        size = self._insert(conn, name, 0, messages)
+        conn.execute("""
+            INSERT INTO sessions (name, message_count, size, created_at, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET message_count = excluded.message_count, size = excluded.size, updated_at = excluded.updated_at
+        """, (name, len(messages), size, now, now))
+
+    def replace(self, name, messages):
+        with self._transaction() as conn:
+            self._replace(conn, name, messages)
+
+    def delete(self, name):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE session = ?", (name,))
+            conn.execute("DELETE FROM sessions WHERE name = ?", (name,))
+            conn.execute("DELETE FROM session_sources WHERE session = ?", (name,))
+
+    def load_sources(self, name):
+        row = self._conn().execute("SELECT data FROM session_sources WHERE session = ?", (name,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def save_sources(self, name, data):
+        with self._transaction() as conn:
+            if data is None:
+                conn.execute("DELETE FROM session_sources WHERE session = ?", (name,))
+            else:
+                conn.execute("INSERT OR REPLACE INTO session_sources (session, data) VALUES (?, ?)", (name, sqlite3.Binary(data)))
+
+    def search(self, query, limit=20):
+        terms = query.split()
+        if not terms:
+            return []
+        conn = self._conn()
+        if self._fts_tokenizer == "trigram" and any(len(t) < 3 for t in terms):
+            # trigram 색인은 3글자 미만 검색어를 지원하지 않으므로 LIKE로 대체
+            where = " AND ".join("m.content LIKE ?" for _ in terms)
+            rows = conn.execute(
+                f"SELECT m.session, m.seq, m.role, m.content, 0 FROM messages m WHERE {where} ORDER BY m.id DESC LIMIT ?",
+                [f"%{t}%" for t in terms] + [limit],
+            ).fetchall()
+            return [{"session": r[0], "seq": r[1], "role": r[2], "snippet": _make_snippet(r[3], [t.lower() for t in terms]), "score": 0.0}
+                    for r in rows]
+        match = " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        rows = conn.execute("""
+            SELECT m.session, m.seq, m.role, snippet(messages_fts, 0, '**', '**', '…', 48), bm25(messages_fts)
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? ORDER BY bm25(messages_fts) LIMIT ?
+        """, (match, limit)).fetchall()
+        return [{"session": r[0], "seq": r[1], "role": r[2], "snippet": r[3].replace("\n", " "), "score": -r[4]} for r in rows]
+
+
+_BACKENDS = {
+    "sqlite": SqliteSessionBackend,
+    "packed": PackedSessionBackend,
+    "jsonl": JsonlSessionBackend,
+}
+
+
+@lru_cache(maxsize=1)
+def get_session_backend():
+    return _BACKENDS[SESSION_BACKEND]()
+
+
+def sanitize_session_name(name):
+    """파일/DB 키로 사용할 수 있도록 영문/숫자, 공백, -, _ 만 남깁니다."""
+    return "".join([c for c in name or "" if c.isalnum() or c in (' ', '-', '_')]).strip()
+
+
+def save_messages(state, name, backend=None):
+    """
+    state(dict 또는 st.session_state)의 "messages"를 name 세션으로 저장합니다.
+    같은 세션에 이어서 저장하면 새로 추가된 메시지만 append하고, 그 외에는 전체를 덮어씁니다.
+    state에 "session_sources"(SessionSources)가 있으면 세션과 함께 저장합니다.
+    저장 후 state의 "persisted_message_count", "persisted_sources_version", "current_session_name"을 갱신합니다.
+    """
+    backend = backend or get_session_backend()
+    messages = state["messages"]
+    persisted = state.get("persisted_message_count", 0)
+    sources = state.get("session_sources")
+    # 도구가 저장 도중에 소스를 추가할 수 있으므로 데이터보다 버전을 먼저 읽음 (추가된 소스는 다음 저장 때 반영)
+    sources_version = sources.version if sources is not None else None
+    if (state.get("current_session_name") == name and 0 < persisted <= len(messages)
+            and backend.exists(name)):
+        # 같은 세션에 이어서 저장: 새로 추가된 메시지만 append
+        if len(messages) > persisted:
+            backend.append(name, messages[persisted:])
+        # 소스 저장소(state의 "session_sources")는 마지막 저장 이후 바뀐 경우에만 저장
+        if sources is not None and sources_version != state.get("persisted_sources_version"):
+            backend.save_sources(name, sources.dump())
+    else:
+        # 다른 대화로 덮어쓰기
+        backend.replace(name, messages)
+        backend.save_sources(name, sources.dump() if sources is not None else None)
+    state["persisted_message_count"] = len(messages)
+    state["persisted_sources_version"] = sources_version
+    state["current_session_name"] = name
@@ -0,0 +1,256 @@
+"""
+세션별 소스 저장소: 대화 중에 가져온 검색 결과, 추출한 웹 페이지, YouTube 자막을 passage 단위로 보관하고
+BM25 역색인으로 검색합니다. 모델은 search_session_sources 도구로 이미 가져온 자료를 네트워크 호출 없이 다시 찾을 수 있습니다.
+
+도구는 ChatEngine이 턴마다 설정하는 현재 세션의 저장소(set_sources)에 결과를 색인하며, 저장소는 세션과 함께 저장됩니다.
+(모델에 보낸 결과가 랭킹으로 줄었더라도 전체 본문을 색인하므로, 다음 턴에서 생략된 passage도 찾을 수 있음)
+"""
+import os
+import json
+import math
+import zlib
+import struct
+import threading
+import contextvars
+from collections import Counter, defaultdict
+
+from history import estimate_tokens
+from ranking import (
+    RANK_TOKEN_BUDGET,
+    BM25_K1,
+    BM25_B,
+    index_terms,
+    split_passages,
+    transcript_passages,
+    format_timestamp,
+)
+
+# 세션마다 보관하는 최대 문서 수 (넘으면 오래된 문서부터 제거)
+SESSION_SOURCES_MAX_DOCS = int(os.getenv("SESSION_SOURCES_MAX_DOCS", 100))
+SOURCES_COMPRESS_LEVEL = int(os.getenv("SOURCES_COMPRESS_LEVEL", 6))
+
+# 저장 형식: magic 뒤에 문서마다 [길이 (uint32), zlib으로 압축한 문서 JSON]
+# 문서는 추가될 때(도구 스레드에서) 한 번만 압축하므로 저장할 때는 이어 붙이기만 하면 됨
+SOURCES_MAGIC = b"DLXSRC1\n"
+_FRAME_HEADER = struct.Struct("<I")
+
+_sources = contextvars.ContextVar("session_sources", default=None)
+
+
+def set_sources(sources):
+    """현재 턴의 세션 소스 저장소 (도구가 결과를 색인하고 search_session_sources가 검색하는 곳)"""
+    _sources.set(sources)
+
+
+def current_sources():
+    return _sources.get()
+
+
+def _read_frames(data):
+    """저장 데이터의 문서별 압축 bytes 목록"""
+    if not data.startswith(SOURCES_MAGIC):
+        raise ValueError("not a session sources file")
+    frames = []
+    pos = len(SOURCES_MAGIC)
+    while pos < len(data):
+        (length,) = _FRAME_HEADER.unpack_from(data, pos)
+        pos += _FRAME_HEADER.size
+        if pos + length > len(data):
+            raise ValueError("truncated session sources file")
+        frames.append(data[pos:pos + length])
+        pos += length
+    return frames
+
+
+class SessionSources:
+    """
+    한 세션의 소스 문서와 passage 역색인. 문서는 (종류, URL)로 구분하며 같은 URL을 다시 가져오면 갱신됩니다.
+    추출한 페이지나 자막이 들어오면 같은 URL의 검색 결과 요약은 제거합니다. (전체 본문이 요약을 포함하므로)
+
+    저장된 데이터(dump()의 결과)로 만들면 처음 검색하거나 추가할 때 압축을 풀고 색인합니다. (세션을 열 때는 비용 없음)
+    도구는 여러 스레드에서 동시에 실행되므로 모든 접근은 lock으로 직렬화합니다.
+    """
+
+    def __init__(self, data=None, max_documents=SESSION_SOURCES_MAX_DOCS):
+        self.max_documents = max_documents
+        # 변경될 때마다 증가 (저장할 필요가 있는지 판단하는 데 사용)
+        self.version = 0
+        self._lock = threading.RLock()
+        # 아직 풀지 않은 문서별 압축 bytes
+        self._frames = None
+        if data:
+            try:
+                self._frames = _read_frames(data)
+            except Exception as e:
+                # 손상된 저장 데이터는 버리고 빈 저장소로 시작 (다음 저장 때 덮어씀)
+                print(f"Failed to load session sources: {e}")
+        # (종류, URL) -> {"url", "kind", "title", "passages": [[시작 초 | None, 텍스트], ...], "ids": [passage id, ...], "frame"}
+        self._documents = {}
+        # passage id -> (문서 key, 시작 초, 텍스트, 단어 수)
+        self._passages = {}
+        # 단어 -> {passage id: 등장 횟수}
+        self._postings = defaultdict(dict)
+        self._total_length = 0
+        self._next_id = 0
+
+    def _ensure_loaded(self):
+        if self._frames is None:
+            return
+        frames, self._frames = self._frames, None
+        for frame in frames:
+            try:
+                doc = json.loads(zlib.decompress(frame))
+            except Exception as e:
+                print(f"Failed to load a session source: {e}")
+                continue
+            self._add(doc["url"], doc["kind"], doc.get("title"), doc["passages"], frame)
+
+    def __len__(self):
+        with self._lock:
+            if self._frames is not None:
+                return len(self._frames)
+            return len(self._documents)
+
+    def dump(self):
+        """저장용 bytes. 색인은 저장하지 않고 열 때 다시 만듭니다."""
+        with self._lock:
+            frames = self._frames if self._frames is not None else [d["frame"] for d in self._documents.values()]
+            return SOURCES_MAGIC + b"".join(_FRAME_HEADER.pack(len(frame)) + frame for frame in frames)
+
+    def add(self, url, kind, title, passages):
+        """
+        문서를 추가하거나 갱신합니다.
+        Args:
+            kind: "search" (검색 결과 요약), "page" (추출한 페이지) 또는 "transcript" (자막)
+            passages: [[시작 초 | None, 텍스트], ...]
+        """
+        passages = [[start, text] for start, text in passages if text and text.strip()]
+        if not url or not passages:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            if kind == "search" and any((k, url) in self._documents for k in ("page", "transcript")):
+                return
+            existing = self._documents.get((kind, url))
+            if existing is not None and existing["passages"] == passages:
+                return
+            # 추출한 페이지에는 제목이 없으므로 검색 결과의 제목을 이어받음
+            summary = self._documents.get(("search", url))
+            if not title and summary is not None:
+                title = summary["title"]
+            frame = zlib.compress(json.dumps({"url": url, "kind": kind, "title": title, "passages": passages},
+                                             ensure_ascii=False, separators=(",", ":")).encode("utf-8"), SOURCES_COMPRESS_LEVEL)
+            self._add(url, kind, title, passages, frame)
+            if kind != "search":
+                self._remove(("search", url))
+            while len(self._documents) > self.max_documents:
+                self._remove(next(iter(self._documents)))
+            self.version += 1
+
+    def _add(self, url, kind, title, passages, frame):
+        key = (kind, url)
+        # 같은 문서를 다시 넣으면 가장 최근 문서가 되도록 기존 항목을 지우고 끝에 추가
+        self._remove(key)
+        ids = []
+        for start, text in passages:
+            pid = self._next_id
+            self._next_id += 1
+            counts = Counter(index_terms(f"{title}\n{text}" if title else text))
+            for term, count in counts.items():
+                self._postings[term][pid] = count
+            length = sum(counts.values())
+            self._passages[pid] = (key, start, text, length)
+            self._total_length += length
+            ids.append(pid)
+        self._documents[key] = {"url": url, "kind": kind, "title": title, "passages": passages, "ids": ids, "frame": frame}
+
+    def _remove(self, key):
+        doc = self._documents.pop(key, None)
+        if doc is None:
+            return
+        for pid in doc["ids"]:
+            _, _, text, length = self._passages.pop(pid)
+            for term in set(index_terms(f"{doc['title']}\n{text}" if doc["title"] else text)):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(pid, None)
+                    if not postings:
+                        del self._postings[term]
+            self._total_length -= length
+
+    def search(self, query, max_results=8, budget=RANK_TOKEN_BUDGET):
+        """
+        query와 관련도(BM25)가 높은 passage를 max_results개까지, 합계 budget 토큰 안에서 관련도 순으로 반환합니다.
+        역색인에서 query 단어가 들어 있는 passage만 점수를 매깁니다.
+        """
+        query_terms = set(index_terms(query or ""))
+        with self._lock:
+            self._ensure_loaded()
+            if not query_terms or not self._passages:
+                return []
+            n = len(self._passages)
+            avg_length = self._total_length / n or 1.0
+            scores = defaultdict(float)
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for pid, count in postings.items():
+                    length = self._passages[pid][3]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[pid] += idf * count * (BM25_K1 + 1) / (count + norm)
+
+            results = []
+            used = 0
+            for pid in sorted(scores, key=lambda pid: (-scores[pid], pid)):
+                if len(results) >= max_results:
+                    break
+                key, start, text, _ = self._passages[pid]
+                cost = estimate_tokens(text)
+                if budget > 0 and used + cost > budget:
+                    continue
+                used += cost
+                doc = self._documents[key]
+                result = {"url": doc["url"], "title": doc["title"] or doc["url"], "kind": doc["kind"]}
+                if start is not None:
+                    # 자막은 해당 시각으로 이동하는 링크
+                    result["timestamp"] = format_timestamp(start)
+                    result["url"] = f"{doc['url']}{'&' if '?' in doc['url'] else '?'}t={int(start)}s"
+                result["text"] = text
+                results.append(result)
+            return results
+
+
+# --- 도구 결과 색인 (현재 턴에 저장소가 없으면 아무것도 하지 않음) ---
+
+def remember_search_results(response):
+    """Tavily 검색 응답의 결과(요약, 포함된 경우 원문)를 색인합니다."""
+    sources = current_sources()
+    if sources is None or not isinstance(response, dict):
+        return
+    for result in response.get("results") or []:
+        if result.get("raw_content"):
+            sources.add(result.get("url"), "page", result.get("title"),
+                        [[None, p] for p in split_passages(result["raw_content"])])
+        else:
+            sources.add(result.get("url"), "search", result.get("title"), [[None, result.get("content")]])
+
+
+def remember_pages(pages):
+    """추출한 페이지([{"url", "content"}])의 전체 본문을 색인합니다."""
+    sources = current_sources()
+    if sources is None:
+        return
+    for page in pages:
+        sources.add(page["url"], "page", None, [[None, p] for p in split_passages(page["content"])])
+
+
+def remember_transcripts(videos):
+    """자막([{"url", "title", "segments": [[시작 초, 텍스트], ...]}])을 시작 시각이 있는 passage로 색인합니다."""
+    sources = current_sources()
+    if sources is None:
+        return
+    for video in videos:
+        sources.add(video["url"], "transcript", video.get("title"),
+                    [[start, text] for start, text in transcript_passages(video["segments"])])
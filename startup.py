@@ -0,0 +1,128 @@
+"""
+시작 시간 리포트: 모듈별 import 시간과 첫 화면 렌더링 시간(time-to-first-render)을 측정합니다.
+
+    python startup.py              # 첫 화면에 필요한 모듈과, 모드별로 나중에 로드되는 모듈의 import 시간
+    python startup.py --ttfr       # 새 프로세스에서 Streamlit 스크립트 첫 실행 시간도 측정
+    python startup.py --top 20     # 그룹별로 오래 걸린 모듈을 20개까지 표시
+
+각 그룹은 새 프로세스에서 `python -X importtime`으로 측정하며, 첫 화면 그룹 이후의 그룹은
+첫 화면 모듈을 먼저 가져온 상태에서 추가로 드는 시간만 보여줍니다.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# dumblexity.py가 첫 화면을 그리기 전에 가져오는 모듈
+STARTUP_MODULES = ["streamlit", "utils", "clients", "history", "tracing", "ui"]
+# 필요한 시점에 처음 로드되는 모듈 (그룹 이름 -> 모듈)
+LAZY_GROUPS = {
+    "model (first question)": ["engine"],
+    "tools (External Search)": ["tavily_clients", "youtube_transcript_api", "googleapiclient.discovery"],
+    "ui components": ["st_copy", "streamlit_mermaid", "streamlit_geolocation"],
+}
+
+_TTFR_SCRIPT = """
+import sys, time
+sys.path.insert(0, {app_dir!r})
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+at = AppTest.from_file({script!r}, default_timeout=120).run()
+first = time.perf_counter() - started
+started = time.perf_counter()
+at.run()
+print(first, time.perf_counter() - started, len(at.exception))
+"""
+
+
+def _import_code(modules, preload=()):
+    lines = [f"import sys; sys.path.insert(0, {APP_DIR!r})"]
+    lines += [f"import {m}" for m in preload]
+    # 측정 구간 구분용 표시 (이후에 출력되는 import만 집계)
+    lines.append("sys.stderr.write('import time: --- measure ---\\n')")
+    lines += [f"import {m}" for m in modules]
+    return "\n".join(lines)
+
+
+def measure_imports(modules, preload=()):
+    """
+    새 프로세스에서 modules를 가져오며 -X importtime 출력을 모읍니다.
+    Returns:
+        {"total": 초, "modules": {최상위 모듈 이름: 초(self 시간 합계)}}
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _import_code(modules, preload)],
+        capture_output=True, text=True, cwd=APP_DIR,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    by_module = defaultdict(float)
+    measuring = False
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        if "--- measure ---" in line:
+            measuring = True
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not measuring or len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].strip().split(".")[0]
+        by_module[name] += int(fields[0]) / 1e6
+    return {"total": sum(by_module.values()), "modules": dict(by_module)}
+
+
+def measure_first_render(script="dumblexity.py"):
+    """새 프로세스에서 Streamlit 스크립트를 처음 실행하는 데 걸린 시간과 다시 실행하는 데 걸린 시간 (초)"""
+    code = _TTFR_SCRIPT.format(app_dir=APP_DIR, script=os.path.join(APP_DIR, script))
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=APP_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    first, rerun, exceptions = result.stdout.strip().splitlines()[-1].split()
+    return {"first_run": float(first), "rerun": float(rerun), "exceptions": int(exceptions)}
+
+
+def startup_report(ttfr=False):
+    report = {"startup": measure_imports(STARTUP_MODULES)}
+    for group, modules in LAZY_GROUPS.items():
+        report[group] = measure_imports(modules, preload=STARTUP_MODULES)
+    if ttfr:
+        report["first_render"] = measure_first_render()
+    return report
+
+
+def print_report(report, top=10):
+    for group, data in report.items():
+        if group == "first_render":
+            continue
+        print(f"{group:<28} {data['total'] * 1000:8.1f} ms")
+        ranked = sorted(data["modules"].items(), key=lambda item: item[1], reverse=True)[:top]
+        for name, seconds in ranked:
+            print(f"    {name:<36} {seconds * 1000:8.1f} ms")
+    if "first_render" in report:
+        render = report["first_render"]
+        print(f"{'time-to-first-render':<28} {render['first_run'] * 1000:8.1f} ms "
+              f"(rerun {render['rerun'] * 1000:.1f} ms, exceptions {render['exceptions']})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Break down startup import time per module.")
+    parser.add_argument("--ttfr", action="store_true", help="also measure time-to-first-render in a fresh process")
+    parser.add_argument("--top", type=int, default=10, help="modules to list per group")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = startup_report(ttfr=args.ttfr)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, top=args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+커넥션 풀을 재사용하는 Tavily 클라이언트.
+tavily 패키지는 가져오는 데 시간이 걸리므로 clients.get_tavily_client()가 처음 호출될 때만 로드됩니다.
+
+SDK의 내부 메서드(_post, _handle_error)를 재정의하고 search/extract를 tavily 1.1.0과 같은 형식으로 구현하므로
+requirements.txt에서 tavily 버전을 고정합니다. 버전을 올릴 때는 SDK 코드와 비교해서 함께 수정해야 합니다.
+"""
+import httpx
+import requests
+from tavily import TavilyClient, AsyncTavilyClient
+from tavily.exceptions import TavilyError, TimeoutError as TavilyTimeoutError
+
+from clients import TAVILY_BASE_URL, TAVILY_POOL_SIZE, _pooled_session, get_async_http_client
+
+
+class PooledTavilyClient(TavilyClient):
+    """
+    requests.Session(keep-alive 커넥션 풀)을 재사용하는 TavilyClient.
+    (기본 TavilyClient는 호출마다 requests.post로 새 커넥션을 맺음)
+    """
+
+    def __init__(self, api_key=None, pool_size=TAVILY_POOL_SIZE, **kwargs):
+        super().__init__(api_key, **kwargs)
+        self.session = _pooled_session(pool_size)
+        self.session.headers.update(self.headers)
+
+    def _post(self, path, data):
+        try:
+            response = self.session.post(f"{self.base_url}/{path}", json=data, timeout=self.timeout)
+        except requests.exceptions.Timeout:
+            self._update_usage_stats(success=False)
+            raise TavilyTimeoutError(f"Request timed out after {self.timeout} seconds")
+        except requests.exceptions.RequestException as e:
+            self._update_usage_stats(success=False)
+            raise TavilyError(f"Request failed: {str(e)}")
+
+        if response.status_code == 200:
+            self._update_usage_stats(success=True)
+            return response.json()
+        self._update_usage_stats(success=False)
+        self._handle_error(response)
+
+    def search(self, query, search_depth="basic", max_results=5, include_domains=None, exclude_domains=None,
+               include_answer=False, include_raw_content=False, **kwargs):
+        data = {
+            "query": query,
+            "search_depth": search_depth,
+            "max_results": max_results,
+            "include_answer": include_answer,
+            "include_raw_content": include_raw_content,
+        }
+        if include_domains:
+            data["include_domains"] = include_domains
+        if exclude_domains:
+            data["exclude_domains"] = exclude_domains
+        data.update(kwargs)
+        return self._post("search", data)
+
+    def extract(self, urls, include_images=False, format="markdown", **kwargs):
+        data = {
+            "urls": urls,
+            "include_images": include_images,
+            "format": format,
+        }
+        data.update(kwargs)
+        return self._post("extract", data)
+
+
+class PooledAsyncTavilyClient(AsyncTavilyClient):
+    """
+    공유 이벤트 루프의 httpx.AsyncClient(keep-alive 커넥션 풀)를 사용하는 AsyncTavilyClient.
+    (기본 AsyncTavilyClient는 호출마다 aiohttp 세션을 새로 만듦) 공유 이벤트 루프 안에서만 사용해야 합니다.
+    """
+
+    def __init__(self, api_key=None, base_url=TAVILY_BASE_URL, timeout=60):
+        super().__init__(api_key, base_url=base_url, timeout=timeout)
+        self.request_timeout = min(timeout, 120)
+
+    async def _post(self, path, data):
+        try:
+            response = await get_async_http_client().post(f"{self.base_url}/{path}", json=data, headers=self.headers,
+                                                           timeout=self.request_timeout)
+        except httpx.TimeoutException:
+            raise TavilyTimeoutError(f"Request timed out after {self.request_timeout} seconds")
+        except httpx.HTTPError as e:
+            raise TavilyError(f"Request failed: {str(e)}")
+
+        if response.status_code == 200:
+            return response.json()
+        # httpx.Response는 requests.Response와 같은 속성(status_code, json, text)을 가지므로 동기 클라이언트의 오류 처리를 재사용
+        TavilyClient._handle_error(self, response)
+
+    async def search(self, query, search_depth="basic", max_results=5, include_domains=None, exclude_domains=None,
+                     include_answer=False, include_raw_content=False, **kwargs):
+        data = {
+            "query": query,
+            "search_depth": search_depth,
+            "max_results": max_results,
+            "include_answer": include_answer,
+            "include_raw_content": include_raw_content,
+        }
+        if include_domains:
+            data["include_domains"] = include_domains
+        if exclude_domains:
+            data["exclude_domains"] = exclude_domains
+        data.update(kwargs)
+        return await self._post("search", data)
+
+    async def extract(self, urls, include_images=False, format="markdown", **kwargs):
+        data = {
+            "urls": urls,
+            "include_images": include_images,
+            "format": format,
+        }
+        data.update(kwargs)
+        return await self._post("extract", data)
@@ -0,0 +1,132 @@
+"""
+PackedSessionBackend(.pack 파일) 저장/읽기 왕복 테스트. 임시 디렉토리에서 실제 백엔드를 사용합니다.
+"""
+import math
+import os
+
+import pytest
+
+from session_store import (
+    PACK_SMALL_PAGE_SLACK,
+    SESSION_PAGE_SIZE,
+    PackedSessionBackend,
+    _read_pack_index,
+)
+
+
+def _messages(start, stop):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"메시지 {i} " + "x" * (i % 7)}
+            for i in range(start, stop)]
+
+
+def _pack_index(backend, name):
+    with open(backend._path(name), "rb") as f:
+        return _read_pack_index(f)[0]
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return PackedSessionBackend(session_dir=str(tmp_path))
+
+
+def test_replace_append_load_round_trip(backend):
+    expected = _messages(0, SESSION_PAGE_SIZE + 7)
+    backend.replace("s", expected)
+    for i in range(5):
+        batch = _messages(len(expected), len(expected) + 2 + i)
+        backend.append("s", batch)
+        expected += batch
+
+    assert backend.load("s") == expected
+    assert backend.message_count("s") == len(expected)
+    assert backend.list_sessions()[0]["message_count"] == len(expected)
+
+
+def test_append_creates_missing_session(backend):
+    backend.append("s", _messages(0, 3))
+    assert backend.load("s") == _messages(0, 3)
+
+
+def test_load_range_across_page_boundaries(backend):
+    expected = _messages(0, SESSION_PAGE_SIZE * 2 + 5)
+    backend.replace("s", expected)
+    # 가득 차지 않은 페이지를 뒤에 붙여 페이지 크기가 섞이게 함
+    backend.append("s", _messages(len(expected), len(expected) + 3))
+    expected += _messages(len(expected), len(expected) + 3)
+
+    for start, stop in [(0, len(expected)), (SESSION_PAGE_SIZE - 2, SESSION_PAGE_SIZE + 2),
+                        (SESSION_PAGE_SIZE, SESSION_PAGE_SIZE * 2), (5, len(expected) - 1),
+                        (len(expected) - 4, len(expected)), (3, 3), (len(expected), len(expected) + 10)]:
+        assert backend.load_range("s", start, stop) == expected[start:stop]
+
+
+def test_small_appends_trigger_repack(backend, monkeypatch):
+    repacks = []
+    repack = backend._repack
+    monkeypatch.setattr(backend, "_repack", lambda path: (repacks.append(path), repack(path)))
+
+    expected = []
+    backend.replace("s", expected)
+    # 턴마다 메시지 2개씩 추가하면 작은 페이지가 쌓임
+    for i in range(PACK_SMALL_PAGE_SLACK + 3):
+        batch = _messages(len(expected), len(expected) + 2)
+        backend.append("s", batch)
+        expected += batch
+
+    assert repacks
+    index = _pack_index(backend, "s")
+    assert len(index["pages"]) <= math.ceil(index["count"] / SESSION_PAGE_SIZE) + PACK_SMALL_PAGE_SLACK
+    assert index["garbage"] <= sum(page[1] for page in index["pages"])
+    assert backend.load("s") == expected
+
+
+def test_repack_keeps_full_pages(backend):
+    expected = _messages(0, SESSION_PAGE_SIZE * 3)
+    backend.replace("s", expected)
+    for i in range(PACK_SMALL_PAGE_SLACK + 3):
+        batch = _messages(len(expected), len(expected) + 1)
+        backend.append("s", batch)
+        expected += batch
+
+    index = _pack_index(backend, "s")
+    assert [page[2] for page in index["pages"][:3]] == [SESSION_PAGE_SIZE] * 3
+    assert backend.load("s") == expected
+
+
+def test_interrupted_append_keeps_previous_state(backend):
+    expected = _messages(0, 10)
+    backend.replace("s", expected)
+    # 새 페이지를 쓰다가 헤더를 바꾸기 전에 종료된 경우 (파일 끝의 쓰레기 바이트)
+    with open(backend._path("s"), "ab") as f:
+        f.write(os.urandom(100))
+
+    assert backend.load("s") == expected
+    backend.append("s", _messages(10, 12))
+    assert backend.load("s") == _messages(0, 12)
+
+
+def test_load_paged_empty_session(backend):
+    backend.replace("s", [])
+    messages = backend.load_paged("s")
+    assert len(messages) == 0
+    assert list(messages) == []
+
+    messages.append({"role": "user", "content": "hi"})
+    assert list(messages) == [{"role": "user", "content": "hi"}]
+
+
+def test_load_paged_shorter_than_one_page(backend):
+    expected = _messages(0, SESSION_PAGE_SIZE // 2)
+    backend.replace("s", expected)
+
+    messages = backend.load_paged("s", tail=SESSION_PAGE_SIZE)
+    assert messages.unloaded == 0
+    assert list(messages) == expected
+
+    # tail이 더 짧으면 앞쪽 메시지는 접근할 때 읽음
+    messages = backend.load_paged("s", tail=4)
+    assert messages.unloaded == len(expected) - 4
+    assert messages[-4:] == expected[-4:]
+    assert messages[0] == expected[0]
+    assert messages.unloaded == 0
+    assert list(messages) == expected
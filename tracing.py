@@ -0,0 +1,198 @@
+import os
+import time
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache import CACHE_DIR
+
+# Prometheus 텍스트 형식으로 지표를 기록할 파일 (빈 문자열이면 기록하지 않음)
+METRICS_FILE = os.getenv("METRICS_FILE", os.path.join(CACHE_DIR, "metrics.prom"))
+# 지정하면 http://<host>:<port>/metrics 로 지표를 제공
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# 단계/모델별로 백분위수 계산에 사용할 최근 샘플 수
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", 1000))
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current_trace = contextvars.ContextVar("dumblexity_trace", default=None)
+
+
+class Trace:
+    """
+    한 턴(질문 하나에 대한 답변)의 span 목록. 여러 스레드(도구 실행, 업로드)와 공유 이벤트 루프에서 기록될 수 있습니다.
+    """
+
+    def __init__(self, model=None):
+        self.model = model or "unknown"
+        self.started = time.perf_counter()
+        self.ended = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, **attrs):
+        span = {"name": name, "start": start - self.started, "duration": end - start, **attrs}
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @property
+    def duration(self):
+        return (self.ended or time.perf_counter()) - self.started
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        return {"model": self.model, "duration": self.duration, "spans": spans}
+
+
+class LatencyMetrics:
+    """단계(stage)와 모델별 지연 시간 및 생성 속도를 집계하고 Prometheus 텍스트 형식으로 내보냅니다."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self._samples = defaultdict(lambda: deque(maxlen=window))  # (metric, labels) -> 최근 값
+        self._counts = defaultdict(int)
+        self._sums = defaultdict(float)
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def add_collector(self, collector):
+        """render_prometheus()에 덧붙일 Prometheus 텍스트를 반환하는 함수를 등록합니다. (gauge/counter 등)"""
+        self._collectors.append(collector)
+
+    def observe(self, metric, value, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._samples[key].append(value)
+            self._counts[key] += 1
+            self._sums[key] += value
+
+    def snapshot(self):
+        """{metric: [(labels, {"count", "sum", quantile: value})]}"""
+        with self._lock:
+            items = [(key, sorted(samples), self._counts[key], self._sums[key]) for key, samples in self._samples.items()]
+        result = defaultdict(list)
+        for (metric, labels), samples, count, total in sorted(items):
+            summary = {"count": count, "sum": total}
+            for q in QUANTILES:
+                summary[q] = samples[min(len(samples) - 1, int(q * len(samples)))]
+            result[metric].append((dict(labels), summary))
+        return dict(result)
+
+    def render_prometheus(self):
+        lines = []
+        for metric, series in self.snapshot().items():
+            lines.append(f"# TYPE {metric} summary")
+            for labels, summary in series:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{{label_text},quantile="{q}"}} {summary[q]:.6f}')
+                lines.append(f"{metric}_sum{{{label_text}}} {summary['sum']:.6f}")
+                lines.append(f"{metric}_count{{{label_text}}} {summary['count']}")
+        text = "\n".join(lines) + "\n"
+        for collector in self._collectors:
+            text += collector()
+        return text
+
+
+METRICS = LatencyMetrics()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(model=None):
+    """현재 컨텍스트에 새 Trace를 설정합니다. 종료 시 전체 소요 시간을 기록하고 지표 파일을 갱신합니다."""
+    trace = Trace(model)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.ended = time.perf_counter()
+        METRICS.observe("dumblexity_stage_duration_seconds", trace.duration, stage="turn", model=trace.model)
+        write_metrics_file()
+
+
+def record_span(name, start, end, trace=None, **attrs):
+    """직접 측정한 구간(perf_counter 기준)을 현재 Trace와 지표에 기록합니다."""
+    trace = trace or _current_trace.get()
+    model = trace.model if trace else "unknown"
+    METRICS.observe("dumblexity_stage_duration_seconds", end - start, stage=name, model=model)
+    if trace:
+        return trace.add(name, start, end, **attrs)
+    return None
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    with 블록의 실행 시간을 기록합니다. yield되는 dict에 값을 넣으면 span 속성으로 함께 저장됩니다.
+    Trace가 없는 곳(백그라운드 작업 등)에서도 지표는 집계됩니다.
+    """
+    trace = _current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        record_span(name, start, time.perf_counter(), trace=trace, **attrs)
+
+
+def observe_rate(name, value, model=None):
+    trace = _current_trace.get()
+    METRICS.observe(name, value, model=model or (trace.model if trace else "unknown"))
+
+
+def write_metrics_file(path=METRICS_FILE):
+    if not path:
+        return
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(METRICS.render_prometheus())
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Failed to write metrics file {path}: {e}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """METRICS_PORT가 설정된 경우 /metrics 엔드포인트를 백그라운드 스레드에서 제공합니다. (프로세스당 한 번)"""
+    global _metrics_server
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            try:
+                _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                print(f"Failed to start metrics server on port {port}: {e}")
+                return None
+            threading.Thread(target=_metrics_server.serve_forever, name="dumblexity-metrics", daemon=True).start()
+            print(f"Serving metrics on :{port}/metrics")
+        return _metrics_server
@@ -0,0 +1,206 @@
+import os
+import re
+import time
+import hashlib
+from functools import lru_cache
+
+import streamlit as st
+
+# 한 번에 렌더링할 최근 메시지 수 (이전 메시지는 버튼으로 한 페이지씩 펼침)
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", 20))
+
+# 스트리밍 답변을 화면에 반영하는 간격. 작은 청크를 모아 한 번에 갱신해 websocket 메시지 수와
+# 브라우저의 마크다운 재파싱 횟수를 줄임 (시간 또는 글자 수 중 먼저 도달하는 쪽에서 반영)
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", 0.05))
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", 512))
+
+_CITATION_SECTION_RE = re.compile(r"\n\n#### (?:Citations|Web Citations|Map Citations|Function Call Citations)")
+# 닫힌 코드 블록 (닫는 펜스는 여는 펜스와 같은 문자열이어야 하고 info string이 없어야 함)
+_FENCE_RE = re.compile(r"^ {0,3}(?P<fence>`{3,}|~{3,})[ \t]*(?P<lang>[^\s`]*)[^\n]*\n(?P<body>.*?)^ {0,3}(?P=fence)[ \t]*$",
+                       re.MULTILINE | re.DOTALL)
+
+
+@lru_cache(maxsize=4096)
+def _message_parts(content):
+    """
+    메시지를 (본문, 인용 섹션, 해시)로 나눕니다. 같은 메시지는 rerun마다 다시 계산하지 않도록 메모이즈됩니다.
+    """
+    match = _CITATION_SECTION_RE.search(content)
+    body, citations = (content[:match.start()], content[match.start():].strip()) if match else (content, "")
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+    return body, citations, digest
+
+
+def _closed_fence(text, final=False):
+    """
+    text에서 처음으로 닫힌 코드 블록의 match. 스트리밍 중에는 닫는 펜스 줄이 끝난(줄바꿈이 온) 경우만 닫힌 것으로 봅니다.
+    (다음 청크에 이어서 올 수 있으므로)
+    """
+    match = _FENCE_RE.search(text)
+    if match and (final or text.startswith("\n", match.end())):
+        return match
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _markdown_blocks(body):
+    """
+    본문을 [("markdown" | "mermaid", 텍스트)]로 나눕니다. mermaid 블록만 따로 떼어 다이어그램으로 렌더링합니다.
+    """
+    blocks = []
+    start = 0
+    pos = 0
+    while match := _closed_fence(body[pos:], final=True):
+        if match.group("lang").lower() == "mermaid":
+            blocks.append(("markdown", body[start:pos + match.start()]))
+            blocks.append(("mermaid", match.group("body")))
+            start = pos + match.end()
+        pos += match.end()
+    blocks.append(("markdown", body[start:]))
+    return tuple((kind, text) for kind, text in blocks if text.strip())
+
+
+def _render_mermaid(code, key=None):
+    # 다이어그램이 있는 답변에서만 필요
+    import streamlit_mermaid as stmd
+    stmd.st_mermaid(code, key=key)
+
+
+class StreamRenderer:
+    """
+    스트리밍 답변을 flush_interval초 또는 flush_chars글자마다 모아서 화면에 반영합니다.
+    (st.write_stream은 청크마다 전체 마크다운을 다시 보내므로 긴 답변에서 수천 번 갱신됨)
+
+    닫힌 코드 블록은 그 자리에서 확정되어 이후 청크에서 다시 렌더링되지 않고, mermaid 블록은 닫히는 즉시
+    다이어그램으로 표시됩니다. 빈 청크("")는 대기 중인 텍스트를 바로 반영합니다. (도구 호출 등 응답이 멈추는 시점)
+    """
+
+    def __init__(self, flush_interval=STREAM_FLUSH_INTERVAL, flush_chars=STREAM_FLUSH_CHARS):
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.flushes = 0
+        self._parts = []
+        self._pending = ""
+        # 현재 placeholder에 표시 중인, 아직 확정되지 않은 텍스트
+        self._segment = ""
+        self._placeholder = None
+        self._last_flush = 0.0
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def write(self, chunk):
+        self._parts.append(chunk)
+        self._pending += chunk
+        if not chunk or len(self._pending) >= self.flush_chars or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self, final=False):
+        if not self._pending and not final:
+            return
+        self._segment += self._pending
+        self._pending = ""
+        self._last_flush = time.monotonic()
+        while match := _closed_fence(self._segment, final):
+            if match.group("lang").lower() == "mermaid":
+                self._show(self._segment[:match.start()])
+                _render_mermaid(match.group("body"))
+            else:
+                self._show(self._segment[:match.end()])
+            # 확정된 블록 뒤의 내용은 새 placeholder에 표시
+            self._placeholder = None
+            self._segment = self._segment[match.end():]
+        self._show(self._segment)
+
+    def _show(self, text):
+        if not text.strip():
+            return
+        if self._placeholder is None:
+            self._placeholder = st.empty()
+        self._placeholder.markdown(text)
+        self.flushes += 1
+
+
+def render_stream(chunks, flush_interval=STREAM_FLUSH_INTERVAL, flush_chars=STREAM_FLUSH_CHARS):
+    """st.write_stream 대신 사용합니다. 청크를 모아서 표시하고 전체 텍스트를 반환합니다."""
+    renderer = StreamRenderer(flush_interval, flush_chars)
+    for chunk in chunks:
+        renderer.write(chunk)
+    renderer.flush(final=True)
+    return renderer.text
+
+
+def render_trace(trace):
+    """한 답변의 span들을 시작 시각 순서의 워터폴 차트로 표시합니다."""
+    # 타이밍 표시를 켠 경우에만 필요
+    import altair as alt
+    import pandas as pd
+
+    spans = trace["spans"]
+    if not spans:
+        return
+    rows = []
+    for i, s in enumerate(spans):
+        attrs = ", ".join(f"{k}={v}" for k, v in s.items() if k not in ("name", "start", "duration"))
+        rows.append({
+            "span": f"{i + 1:02d}. {s['name']}",
+            "start_ms": s["start"] * 1000,
+            "end_ms": (s["start"] + s["duration"]) * 1000,
+            "duration_ms": round(s["duration"] * 1000, 1),
+            "details": attrs,
+        })
+    chart = alt.Chart(pd.DataFrame(rows)).mark_bar().encode(
+        x=alt.X("start_ms:Q", title="ms"),
+        x2="end_ms:Q",
+        y=alt.Y("span:N", sort=None, title=None),
+        color=alt.Color("span:N", legend=None),
+        tooltip=["span", "duration_ms", "details"],
+    ).properties(height=max(120, 22 * len(rows)))
+    with st.expander(f"⏱️ Timing ({trace['duration']:.2f}s · {trace['model']})"):
+        st.altair_chart(chart, use_container_width=True)
+
+
+def render_message(index, message, trace=None):
+    body, citations, digest = _message_parts(message["content"])
+    with st.chat_message(message["role"]):
+        for i, (kind, text) in enumerate(_markdown_blocks(body)):
+            if kind == "mermaid":
+                _render_mermaid(text, key=f"mermaid_{index}_{digest}_{i}")
+            else:
+                st.markdown(text)
+        # 긴 인용 목록은 접어서 표시
+        if citations:
+            with st.expander(f"📚 Sources ({citations.count('](')})"):
+                st.markdown(citations)
+        # [NEW] 어시스턴트의 메시지(봇 답변) 아래에만 복사 버튼 추가
+        if message["role"] == "assistant":
+            from st_copy import copy_button
+            copy_button(message["content"],
+                        tooltip="Copy this text",
+                        copied_label="Copied!",
+                        icon="📋",
+                        key=f"copy_{index}_{digest}")
+        if trace:
+            render_trace(trace)
+
+
+def reset_history_window():
+    st.session_state.history_visible = HISTORY_WINDOW
+
+
+def render_chat_history(messages, traces=None):
+    """
+    최근 HISTORY_WINDOW개의 메시지만 렌더링하고, 이전 메시지는 요청할 때만 한 페이지씩 추가로 펼칩니다.
+    (대화가 길어져도 rerun 비용이 일정하게 유지됨)
+    traces({메시지 인덱스: Trace.to_dict()})가 주어지면 해당 답변 아래에 타이밍 워터폴을 표시합니다.
+    """
+    traces = traces or {}
+    visible = st.session_state.get("history_visible", HISTORY_WINDOW)
+    start = max(0, len(messages) - visible)
+    if start > 0:
+        if st.button(f"⬆️ Show {min(HISTORY_WINDOW, start)} older messages ({start} hidden)", use_container_width=True):
+            st.session_state.history_visible = visible + HISTORY_WINDOW
+            st.rerun()
+    for index in range(start, len(messages)):
+        render_message(index, messages[index], traces.get(index))
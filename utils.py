@@ -1,34 +1,138 @@
 import streamlit as st
 import os
-import json
-import glob
 import asyncio
 import httpx
 
-SESSION_DIR = "sessions"
-os.makedirs(SESSION_DIR, exist_ok=True)
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
+
+from cache import TTLCache, CACHE_DIR
+from clients import get_async_http_client, is_shared_loop_running
+from session_store import get_session_backend, sanitize_session_name, save_messages
+from sources import SessionSources
+from tracing import span
+from governor import GOVERNOR
+
+# 리디렉션 해석 결과 캐시 (원본 URL -> 최종 URL)
+URL_CACHE_TTL = int(os.getenv("URL_CACHE_TTL", 7 * 24 * 3600))
+URL_CACHE_MAXSIZE = int(os.getenv("URL_CACHE_MAXSIZE", 20000))
+_resolved_url_cache = TTLCache(maxsize=URL_CACHE_MAXSIZE, ttl=URL_CACHE_TTL,
+                               persist_path=os.path.join(CACHE_DIR, "resolved_urls.json"))
+
+# 최종 URL에서 제거할 트래킹 파라미터
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "yclid", "dclid", "igshid", "mc_cid", "mc_eid",
+                   "_hsenc", "_hsmi", "ref_src", "spm", "srsltid"}
+
+def _is_tracking_param(param):
+    key = unquote_plus(param.split("=", 1)[0]).lower()
+    return key.startswith("utm_") or key in TRACKING_PARAMS
+
+def canonicalize_url(url):
+    """
+    동일한 페이지를 가리키는 URL이 하나로 합쳐지도록 정규화합니다.
+    (scheme/host 소문자화, 기본 포트/fragment 제거, utm_* 등 트래킹 파라미터 제거)
+    """
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if parts.scheme not in ("http", "https"):
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    # 트래킹 파라미터만 빼고 나머지 파라미터는 원래 인코딩 그대로 유지 (다시 인코딩하면 실제 URL과 달라질 수 있음)
+    query = "&".join(param for param in parts.query.split("&") if param and not _is_tracking_param(param))
+    path = parts.path if parts.path not in ("", "/") else ""
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+def dedupe_resolved(entries):
+    """
+    (resolved_uri, title) 목록에서 정규화된 URL이 같은 항목을 제거합니다. (먼저 나온 항목 유지)
+    """
+    seen = set()
+    result = []
+    for uri, title in entries:
+        key = canonicalize_url(uri)
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append((uri, title))
+    return result
+
+def get_url_cache_stats():
+    return _resolved_url_cache.stats()
 
 async def _get_final_url_httpx(initial_url, client):
+    cached = _resolved_url_cache.get(initial_url)
+    if cached:
+        return cached
+    headers = {'User-Agent': 'Mozilla/5.0'}
     try:
-        # GET 요청을 보내고 리디렉션을 자동으로 따릅니다.
-        response = await client.get(initial_url, headers={'User-Agent': 'Mozilla/5.0'}, follow_redirects=True, timeout=10.0)
-        # 최종 URL 반환
-        return str(response.url)
+        # 캐시에 없는 URL만 전체 동시 요청 수 제한을 거쳐 요청 (실패하면 원본 URL을 쓰므로 재시도하지 않음)
+        async with GOVERNOR.limit_async("resolver"):
+            # 먼저 HEAD로 리디렉션만 따라가고, 서버가 HEAD를 거부하거나(오류 상태 코드, 연결 종료 등)
+            # 실패하면 본문을 받지 않는 streamed GET으로 재시도합니다.
+            try:
+                response = await client.head(initial_url, headers=headers, follow_redirects=True, timeout=10.0)
+                final_url = str(response.url) if response.status_code < 400 else None
+            except httpx.HTTPError:
+                final_url = None
+            if final_url is None:
+                async with client.stream("GET", initial_url, headers=headers, follow_redirects=True, timeout=10.0) as response:
+                    final_url = str(response.url)
+        final_url = canonicalize_url(final_url)
+        _resolved_url_cache.set(initial_url, final_url)
+        return final_url
     except Exception as e:
-        # 오류 발생 시 원본 URL 반환
+        # 오류 발생 시 원본 URL 반환 (실패한 결과는 캐시하지 않음)
         return initial_url
 
 # [NEW] 비동기 URL을 가져오는 로직을 래핑할 별도의 async 함수
 async def resolve_all_urls_async(urls_to_fetch):
-    async with httpx.AsyncClient() as client:
-        tasks = [_get_final_url_httpx(uri, client) for uri in urls_to_fetch]
-        # [NOTE] gather는 작업 목록을 받아 동시에 실행합니다.
-        resolved_urls = await asyncio.gather(*tasks)
-        return resolved_urls
+    # 캐시에 없던 URL이 있을 때만 캐시 파일을 다시 저장
+    misses = sum(uri not in _resolved_url_cache for uri in urls_to_fetch)
+    with span("resolve_urls", urls=len(urls_to_fetch), misses=misses):
+        if is_shared_loop_running():
+            # 공유 이벤트 루프에서는 keep-alive 커넥션 풀을 가진 클라이언트를 재사용
+            client = get_async_http_client()
+            resolved_urls = await asyncio.gather(*[_get_final_url_httpx(uri, client) for uri in urls_to_fetch])
+        else:
+            async with httpx.AsyncClient() as client:
+                tasks = [_get_final_url_httpx(uri, client) for uri in urls_to_fetch]
+                # [NOTE] gather는 작업 목록을 받아 동시에 실행합니다.
+                resolved_urls = await asyncio.gather(*tasks)
+    if misses:
+        _resolved_url_cache.save()
+    return resolved_urls
+
+async def resolve_url_async(url):
+    """
+    공유 이벤트 루프에서 URL 하나의 최종 주소를 해석합니다. (캐시 우선, 호출 측에서 save_url_cache()로 저장)
+    """
+    with span("resolve_url"):
+        return await _get_final_url_httpx(url, get_async_http_client())
+
+def save_url_cache():
+    _resolved_url_cache.save()
 
 def get_all_sessions():
-    files = glob.glob(os.path.join(SESSION_DIR, "*.json"))
-    return [os.path.splitext(os.path.basename(f))[0] for f in files]
+    return [x["name"] for x in get_session_backend().list_sessions()]
+
+def list_sessions(limit=None, offset=0):
+    """세션 인덱스에서 최근 수정 순으로 한 페이지를 조회합니다. (디렉토리 스캔 없음)"""
+    return get_session_backend().list_sessions(limit=limit, offset=offset)
+
+def count_sessions():
+    return get_session_backend().count_sessions()
+
+def search_sessions(query, limit=20):
+    """저장된 모든 세션의 메시지에서 전문 검색 (관련도 순)"""
+    try:
+        return get_session_backend().search(query, limit=limit)
+    except Exception as e:
+        print(f"Session search failed: {e}")
+        return []
 
 # [CHANGED] 'silent' 매개변수 추가 (자동 저장 시 알림을 띄우지 않기 위함)
 def save_session(session_name, silent=False):
@@ -36,7 +140,7 @@ def save_session(session_name, silent=False):
         if not silent:
             st.sidebar.error("Session name cannot be empty.")
         return
-    safe_name = "".join([c for c in session_name if c.isalnum() or c in (' ', '-', '_')]).strip()
+    safe_name = sanitize_session_name(session_name)
     
     # [NEW] 안전한 이름이 비어있는 경우 (예: 특수문자로만 입력)
     if not safe_name:
@@ -44,13 +148,8 @@ def save_session(session_name, silent=False):
             st.sidebar.error("Valid session name is required.")
         return
 
-    file_path = os.path.join(SESSION_DIR, f"{safe_name}.json")
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(st.session_state.messages, f, ensure_ascii=False, indent=2)
-        
-        # [NEW] 현재 세션 이름 업데이트
-        st.session_state.current_session_name = safe_name
+        save_messages(st.session_state, safe_name)
         
         if not silent:
             st.sidebar.success(f"Session '{safe_name}' saved!")
@@ -59,10 +158,17 @@ def save_session(session_name, silent=False):
             st.sidebar.error(f"Failed to save session: {e}")
 
 def load_session(session_name):
-    file_path = os.path.join(SESSION_DIR, f"{session_name}.json")
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            st.session_state.messages = json.load(f)
+        # [CHANGED] 최근 메시지만 읽고 이전 메시지는 스크롤하거나 history 구성에 필요할 때 읽음
+        backend = get_session_backend()
+        messages = backend.load_paged(session_name)
+        st.session_state.messages = messages
+        st.session_state.pop("history_visible", None)
+        st.session_state.pop("traces", None)
+        st.session_state.persisted_message_count = len(messages)
+        # [NEW] 이 세션에서 가져왔던 검색 결과/페이지/자막 (처음 검색할 때 압축을 풀고 색인)
+        st.session_state.session_sources = SessionSources(backend.load_sources(session_name))
+        st.session_state.persisted_sources_version = 0
         
         # [NEW] 현재 세션 이름 업데이트
         st.session_state.current_session_name = session_name
@@ -71,10 +177,10 @@ def load_session(session_name):
         st.sidebar.error(f"Failed to load session: {e}")
 
 def delete_session(session_name):
-    file_path = os.path.join(SESSION_DIR, f"{session_name}.json")
+    backend = get_session_backend()
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if backend.exists(session_name):
+            backend.delete(session_name)
             
             # [NEW] 만약 현재 세션을 삭제했다면, current_session_name 초기화
             if st.session_state.current_session_name == session_name:
@@ -84,4 +190,3 @@ def delete_session(session_name):
             st.rerun()
     except Exception as e:
         st.sidebar.error(f"Failed to delete session: {e}")
-